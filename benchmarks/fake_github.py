@@ -0,0 +1,284 @@
+import collections
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+
+class FakeGitHub:
+    """
+    Local fake of GitHub REST api for benchmarks.
+    It serves synthetic organization of repositories with labels, labels could be created, edited and deleted.
+
+    * every request waits latency seconds
+    * lists are paginated with Link header like GitHub
+    * GET responses have ETag, conditional requests are answered with 304 and don't consume rate limit
+    * responses have rate limit headers, when budget is exhausted, requests are answered with 403 until reset
+    * errorRate part of requests is answered with 502
+
+    :ivar template: labels of template, list of tuples (name, color)
+    :vartype template: list
+    :ivar repositories: labels of repositories (repository -> label name -> color)
+    :vartype repositories: OrderedDict
+    :ivar latency: time of every request in seconds
+    :vartype latency: float
+    :ivar errorRate: probability of 502 response
+    :vartype errorRate: float
+    :ivar rateLimit: number of requests in one rate limit window
+    :vartype rateLimit: int
+    :ivar rateWindow: length of rate limit window in seconds
+    :vartype rateWindow: float
+    :ivar drift: part of labels in repository, which differ from template
+    :vartype drift: float
+    :ivar calls: number of requests by method
+    :vartype calls: Counter
+    :ivar errors: number of injected errors
+    :vartype errors: int
+    :ivar notModified: number of 304 responses
+    :vartype notModified: int
+    """
+
+
+    def __init__(self, repos: int = 100, labels: int = 50, latency: float = 0.0, errorRate: float = 0.0,
+                 rateLimit: int = 1000000, rateWindow: float = 3600, drift: float = 0.1, seed: int = 0,
+                 owner: str = 'bench'):
+        self.latency = latency
+        self.errorRate = errorRate
+        self.rateLimit = rateLimit
+        self.rateWindow = rateWindow
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.errors = 0
+        self.notModified = 0
+        self.remaining = rateLimit
+        self.reset = time.time() + rateWindow
+        self.server = None
+        self.url = None
+
+        self.template = [('label-{:03d}'.format(i), '{:06x}'.format(self.random.randrange(0x1000000)))
+                         for i in range(labels)]
+        self.repositories = collections.OrderedDict()
+
+        for i in range(repos):
+            repoLabels = collections.OrderedDict()
+            for name, color in self.template:
+                chance = self.random.random()
+                if chance < drift / 2:
+                    continue
+                if chance < drift:
+                    color = '{:06x}'.format(self.random.randrange(0x1000000))
+                repoLabels[name] = color
+
+            for j in range(int(labels * drift / 2)):
+                repoLabels['extra-{:03d}'.format(j)] = 'ffffff'
+
+            self.repositories['{}/repo-{:04d}'.format(owner, i)] = repoLabels
+
+
+    def start(self) -> str:
+        """
+        Start server in background thread on free local port
+
+        :return: url of api
+        """
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+        self.server.daemon_threads = True
+        self.server.github = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        return self.url
+
+
+    def stop(self) -> None:
+        """
+        Stop server
+
+        :return: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+    def take_budget(self) -> tuple:
+        """
+        Take one request from rate limit budget
+
+        :return: tuple (allowed, remaining, reset)
+        """
+        with self.lock:
+            now = time.time()
+            if now >= self.reset:
+                self.remaining = self.rateLimit
+                self.reset = now + self.rateWindow
+
+            if self.remaining <= 0:
+                return False, 0, self.reset
+
+            self.remaining -= 1
+            return True, self.remaining, self.reset
+
+
+    def refund_budget(self) -> int:
+        """
+        Return one request to rate limit budget (304 responses are free)
+
+        :return: remaining budget
+        """
+        with self.lock:
+            self.remaining = min(self.remaining + 1, self.rateLimit)
+            self.notModified += 1
+            return self.remaining
+
+
+    def handle(self, method: str, path: str, query: dict, body) -> tuple:
+        """
+        Handle one request of api
+
+        :param method: http method
+        :param path: path of url
+        :param query: parsed query of url
+        :param body: parsed json body or None
+        :return: tuple (status, json data, headers)
+        """
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+
+        if method == 'GET' and parts == ['user', 'repos']:
+            return self.paginate(self.url + path, query, [{'full_name': name} for name in self.repositories])
+
+        if len(parts) < 4 or parts[0] != 'repos' or parts[3] != 'labels':
+            return 404, {'message': 'Not Found'}, {}
+
+        with self.lock:
+            labels = self.repositories.get('/'.join(parts[1:3]))
+            if labels is None:
+                return 404, {'message': 'Not Found'}, {}
+
+            if method == 'GET' and len(parts) == 4:
+                items = [{'name': name, 'color': color} for name, color in labels.items()]
+            elif method == 'POST' and len(parts) == 4:
+                if body['name'] in labels:
+                    return 422, {'message': 'Validation Failed'}, {}
+                labels[body['name']] = body['color']
+                return 201, body, {}
+            elif method == 'PATCH' and len(parts) == 5 and parts[4] in labels:
+                del labels[parts[4]]
+                labels[body['name']] = body['color']
+                return 200, body, {}
+            elif method == 'DELETE' and len(parts) == 5 and parts[4] in labels:
+                del labels[parts[4]]
+                return 204, None, {}
+            else:
+                return 404, {'message': 'Not Found'}, {}
+
+        return self.paginate(self.url + path, query, items)
+
+
+    @staticmethod
+    def paginate(url: str, query: dict, items: list) -> tuple:
+        """
+        Return one page of list with Link header
+
+        :param url: url of list without query
+        :param query: parsed query of url
+        :param items: all items of list
+        :return: tuple (status, json data, headers)
+        """
+        perPage = int(query.get('per_page', ['30'])[0])
+        page = int(query.get('page', ['1'])[0])
+        lastPage = max((len(items) + perPage - 1) // perPage, 1)
+
+        links = []
+        if page < lastPage:
+            links.append('<{}?per_page={}&page={}>; rel="next"'.format(url, perPage, page + 1))
+            links.append('<{}?per_page={}&page={}>; rel="last"'.format(url, perPage, lastPage))
+        if page > 1:
+            links.append('<{}?per_page={}&page={}>; rel="first"'.format(url, perPage, 1))
+            links.append('<{}?per_page={}&page={}>; rel="prev"'.format(url, perPage, page - 1))
+
+        headers = {'Link': ', '.join(links)} if links else {}
+        return 200, items[(page - 1) * perPage:page * perPage], headers
+
+
+class FakeGitHubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler of FakeGitHub, connections are kept alive
+    and whole response is send at once (without Nagle delay)
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+
+    def do_GET(self):
+        self.respond()
+
+
+    def do_POST(self):
+        self.respond()
+
+
+    def do_PATCH(self):
+        self.respond()
+
+
+    def do_DELETE(self):
+        self.respond()
+
+
+    def respond(self):
+        github = self.server.github
+        url = urllib.parse.urlsplit(self.path)
+
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length) if length else b''
+
+        with github.lock:
+            github.calls[self.command] += 1
+            fail = github.errorRate and github.random.random() < github.errorRate
+            if fail:
+                github.errors += 1
+
+        if github.latency:
+            time.sleep(github.latency)
+
+        allowed, remaining, reset = github.take_budget()
+
+        if not allowed:
+            status, body, headers = 403, {'message': 'API rate limit exceeded'}, {}
+        elif fail:
+            status, body, headers = 502, {'message': 'Server Error'}, {}
+        else:
+            status, body, headers = github.handle(self.command, url.path, urllib.parse.parse_qs(url.query),
+                                                  json.loads(data.decode()) if data else None)
+
+        content = json.dumps(body).encode() if body is not None else b''
+
+        if self.command == 'GET' and status == 200:
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, content = 304, b''
+                remaining = github.refund_budget()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-RateLimit-Limit', str(github.rateLimit))
+        self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.send_header('X-RateLimit-Reset', str(int(reset)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def log_message(self, format, *args):
+        pass
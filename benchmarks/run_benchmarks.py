@@ -0,0 +1,207 @@
+"""
+End-to-end benchmarks of labelord against local fake GitHub api
+
+Every scenario runs in new process, so peak memory is measured separately:
+
+* ``cli`` - whole ``labelord run -a`` command (including start of program)
+* ``api`` - ``LabelUpdater.update_labels`` with all repositories
+
+Usage (from root of repository)::
+
+    python -m benchmarks.run_benchmarks --repos 1000 --labels 200 --latency 0.01 --jobs 1 8 32 -o results.json
+    python -m benchmarks.run_benchmarks --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_github import FakeGitHub
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(scenario: str, url: str, configPath: str, jobs: int, mode: str) -> dict:
+    """
+    Run one scenario in this process against fake api
+
+    :param scenario: cli or api
+    :param url: url of fake api
+    :param configPath: path to labelord config file
+    :param jobs: number of repositories updated in parallel
+    :param mode: update or replace
+    :return: dictionary with elapsed time, exit code and peak memory
+    """
+    start = time.perf_counter()
+    from labelord import github, labelord, ratelimit
+
+    github.API_URL = url
+    exitCode = 0
+
+    try:
+        if scenario == 'cli':
+            labelord.cli.main(['-c', configPath, '--no-cache', 'run', '-a', '-q', '-j', str(jobs), mode], obj={})
+        else:
+            start = time.perf_counter()
+            config = github.load_config(configPath)
+            session = github.create_session(github.load_token(config, None), rateLimiter=ratelimit.RateLimiter(),
+                                            poolSize=jobs + github.PAGE_JOBS)
+            labelUpdater = github.LabelUpdater(session, config,
+                                               {'allRepos': True, 'mode': mode, 'quiet': True, 'jobs': jobs})
+            labelUpdater.update_labels(labelUpdater.get_source_labels(None), labelUpdater.get_target_repositories())
+    except SystemExit as e:
+        exitCode = e.code or 0
+
+    return {'elapsed': time.perf_counter() - start, 'exit_code': exitCode,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def write_config(directory: str, template: list) -> str:
+    """
+    Write labelord config file with template labels
+
+    :param directory: directory of config file
+    :param template: list of tuples (name, color)
+    :return: path to config file
+    """
+    path = os.path.join(directory, 'config.cfg')
+
+    with open(path, 'w') as f:
+        f.write('[github]\ntoken = benchmark\n\n[labels]\n')
+        for name, color in template:
+            f.write('{} = {}\n'.format(name, color))
+
+    return path
+
+
+def run_scenario(scenario: str, jobs: int, args) -> dict:
+    """
+    Start fake api, run scenario in new process and collect results
+
+    :param scenario: cli or api
+    :param jobs: number of repositories updated in parallel
+    :param args: parsed arguments
+    :return: dictionary with results
+    """
+    fake = FakeGitHub(repos=args.repos, labels=args.labels, latency=args.latency, errorRate=args.error_rate,
+                      rateLimit=args.rate_limit, rateWindow=args.rate_window, drift=args.drift, seed=args.seed)
+    url = fake.start()
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            configPath = write_config(directory, fake.template)
+            completed = subprocess.run([sys.executable, '-m', 'benchmarks.run_benchmarks', '--child', scenario,
+                                        '--url', url, '--config', configPath, '--jobs', str(jobs),
+                                        '--mode', args.mode],
+                                       cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       universal_newlines=True)
+    finally:
+        fake.stop()
+
+    if completed.returncode != 0 or not completed.stdout.strip():
+        raise RuntimeError('Benchmark {} failed:\n{}'.format(scenario, completed.stderr))
+
+    child = json.loads(completed.stdout.strip().splitlines()[-1])
+    calls = sum(fake.calls.values())
+
+    return {
+        'scenario': scenario,
+        'mode': args.mode,
+        'jobs': jobs,
+        'repos': args.repos,
+        'labels': args.labels,
+        'elapsed': round(child['elapsed'], 4),
+        'repos_per_sec': round(args.repos / child['elapsed'], 2) if child['elapsed'] else None,
+        'api_calls': calls,
+        'api_calls_per_repo': round(calls / args.repos, 2) if args.repos else None,
+        'calls_by_method': dict(fake.calls),
+        'injected_errors': fake.errors,
+        'exit_code': child['exit_code'],
+        'peak_rss_kb': child['peak_rss_kb'],
+    }
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Print change of throughput and api calls against baseline results
+
+    :param baseline: results of previous version
+    :param current: results of current version
+    :return: None
+    """
+    old = {(r['scenario'], r['mode'], r['jobs']): r for r in baseline['results']}
+
+    for result in current['results']:
+        key = (result['scenario'], result['mode'], result['jobs'])
+        if key not in old or not old[key]['repos_per_sec']:
+            continue
+
+        print('{} {} -j {}: {:+.1%} repos/sec, {:+.2f} calls/repo, {:+d} kB peak memory'.format(
+            *key,
+            result['repos_per_sec'] / old[key]['repos_per_sec'] - 1,
+            result['api_calls_per_repo'] - old[key]['api_calls_per_repo'],
+            result['peak_rss_kb'] - old[key]['peak_rss_kb']))
+
+
+def get_version():
+    try:
+        import importlib.metadata
+        return importlib.metadata.version('labelord_horacj10')
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks of labelord against local fake GitHub api')
+    parser.add_argument('--repos', type=int, default=100, help='Number of repositories in synthetic organization')
+    parser.add_argument('--labels', type=int, default=50, help='Number of labels in template')
+    parser.add_argument('--drift', type=float, default=0.1, help='Part of labels which differ from template')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency of every request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of 502 response')
+    parser.add_argument('--rate-limit', type=int, default=1000000, help='Requests in one rate limit window')
+    parser.add_argument('--rate-window', type=float, default=3600, help='Length of rate limit window in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic organization')
+    parser.add_argument('--scenario', nargs='+', choices=['cli', 'api'], default=['cli', 'api'])
+    parser.add_argument('--jobs', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--mode', choices=['update', 'replace'], default='update')
+    parser.add_argument('-o', '--output', default='-', help='File for JSON results (default stdout)')
+    parser.add_argument('--compare', help='JSON results of previous run to compare with')
+    parser.add_argument('--child', choices=['cli', 'api'], help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        result = run_child(args.child, args.url, args.config, args.jobs[0], args.mode)
+        print(json.dumps(result))
+        return
+
+    results = {
+        'labelord': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: getattr(args, key) for key in ('repos', 'labels', 'drift', 'latency', 'error_rate',
+                                                           'rate_limit', 'rate_window', 'seed', 'mode')},
+        'results': [run_scenario(scenario, jobs, args) for scenario in args.scenario for jobs in args.jobs],
+    }
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
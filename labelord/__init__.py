@@ -1,3 +1,13 @@
-from .labelord import run_server, list_labels, list_repos, run, cli, app
+from .labelord import run_server, list_labels, list_repos, run, cli, create_app, get_app
 
 __all__ = ['run_server', 'list_labels', 'list_repos', "run", 'cli', 'app']
+
+
+def __getattr__(name):
+    """
+    Flask app is created at first access to ``labelord.app``
+    """
+    if name == 'app':
+        return get_app()
+
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
@@ -0,0 +1,384 @@
+import asyncio
+import time
+from typing import Union
+
+import requests
+
+from labelord import github
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+class AsyncGitHubClient:
+    """
+    Asynchronous client for GitHub api, all requests share one event loop.
+    Client must be used as async context manager.
+
+    :ivar token: authentication token for GitHub
+    :vartype token: str
+    :ivar limit: maximal number of requests in flight
+    :vartype limit: int
+    :ivar apiUrl: base url of GitHub api
+    :vartype apiUrl: str
+    :ivar rateLimiter: scheduler of requests shared with synchronous session, or None
+    :vartype rateLimiter: RateLimiter
+    :ivar maxRetries: maximal number of retries of rate limited request
+    :vartype maxRetries: int
+    :ivar timeout: timeout of requests (connect, read) in seconds
+    :vartype timeout: tuple
+    """
+
+
+    def __init__(self, token: str, limit: int = 100, apiUrl: str = None, rateLimiter=None, maxRetries: int = 5,
+                 timeout: tuple = github.DEFAULT_TIMEOUT):
+        if aiohttp is None:
+            raise RuntimeError('Asynchronous client needs aiohttp package (pip install aiohttp)')
+
+        self.token = token
+        self.limit = limit
+        self.apiUrl = apiUrl or github.API_URL
+        self.rateLimiter = rateLimiter
+        self.maxRetries = maxRetries
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+
+
+    async def __aenter__(self):
+        headers = {'User-Agent': 'Python', 'Authorization': 'token ' + self.token}
+        connector = aiohttp.TCPConnector(limit=self.limit)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+
+        self.session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
+        self.semaphore = asyncio.Semaphore(self.limit)
+        return self
+
+
+    async def __aexit__(self, excType, exc, traceback):
+        await self.session.close()
+
+
+    async def request(self, method: str, path: str, **kwargs) -> tuple:
+        """
+        Send one request to GitHub api
+
+        :param method: http method
+        :param path: path of api endpoint (with query)
+        :param kwargs: other arguments for aiohttp request
+        :return: tuple (status code, json body or None)
+        :raises aiohttp.ClientError: if request could not be sent
+        :raises asyncio.TimeoutError: if timeout expired
+        """
+        response = await self.send(method, self.apiUrl + path, **kwargs)
+
+        return response.status_code, response.body
+
+
+    async def send(self, method: str, url: str, **kwargs) -> 'ResponseStatus':
+        """
+        Send one request to absolute url
+        If rateLimiter is set, request waits for it and rate limited request is retried (same as GitHubSession)
+
+        :param method: http method
+        :param url: absolute url
+        :param kwargs: other arguments for aiohttp request
+        :return: response status with headers and json body
+        """
+        attempt = 0
+        while True:
+            if self.rateLimiter is not None:
+                await self.rateLimiter.wait_async()
+
+            async with self.semaphore:
+                async with self.session.request(method, url, **kwargs) as r:
+                    try:
+                        body = await r.json(content_type=None)
+                    except ValueError:
+                        body = None
+
+                    response = ResponseStatus(r.status, '', r.headers, body)
+
+            if self.rateLimiter is None:
+                return response
+
+            self.rateLimiter.update(response)
+
+            delay = self.rateLimiter.retry_delay(response, attempt)
+            if delay is None or attempt >= self.maxRetries:
+                return response
+
+            self.rateLimiter.pause(delay)
+            attempt += 1
+
+
+    async def get_all_pages(self, path: str, exitProgram: bool = True) -> Union[list, bool]:
+        """
+        Get all items of paginated list, pages are loaded one by one by ``rel="next"`` of Link header
+        Response without Link header is the only page (same as github.get_all_pages)
+
+        :param path: path of api endpoint with per_page=100
+        :param exitProgram: if False, program will not quit if response is not correct, only return False
+        :return: list of items / False
+        :raises SystemExit: if response is not correct and exitProgram is true
+        """
+        items = []
+        url = self.apiUrl + path
+        while url is not None:
+            response = await self.send('GET', url)
+
+            if validate_status(response.status_code, response.body, exitProgram):
+                return False
+
+            items.extend(response.body)
+
+            url = get_next_url(response.headers)
+
+        return items
+
+
+    async def get_list_repos(self) -> list:
+        """
+        Get list of available repos
+
+        :return: list of available repos
+        :raises SystemExit: if response is not correct
+        """
+        repositories = await self.get_all_pages('/user/repos?per_page=100')
+
+        return [repo['full_name'] for repo in repositories]
+
+
+    async def get_list_labels(self, repository: str) -> Union[list, bool]:
+        """
+        Get list of labels in given repository
+
+        :param repository: target repository
+        :return: list of Labels / False if repository not found
+        """
+        userName, repoName = repository.split('/')
+        labelsJson = await self.get_all_pages('/repos/{}/{}/labels?per_page=100'.format(userName, repoName), False)
+
+        if labelsJson is False:
+            return False
+
+        return [github.Label(one['name'], one['color']) for one in labelsJson]
+
+
+    async def add_label(self, repository: str, label: github.Label) -> Union[str, None]:
+        """
+        Add label to repository
+
+        :param repository: target repository
+        :param label: class Label with new label
+        :return: error message or None
+        """
+        userName, repoName = repository.split('/')
+        status, body = await self.request('POST', '/repos/{}/{}/labels'.format(userName, repoName),
+                                          json={'name': label.name, 'color': label.color})
+
+        return format_error(status, body, 201)
+
+
+    async def update_label(self, repository: str, label: github.Label,
+                           oldLabel: github.Label = None) -> Union[str, None]:
+        """
+        Update existing label in repository
+
+        :param repository: target repository
+        :param label: class Label with new Label
+        :param oldLabel: class Label with old label, if change only case in name of label
+        :return: error message or None
+        """
+        userName, repoName = repository.split('/')
+        labelName = oldLabel.name if oldLabel is not None else label.name
+        status, body = await self.request('PATCH', '/repos/{}/{}/labels/{}'.format(userName, repoName, labelName),
+                                          json={'color': label.color, 'name': label.name})
+
+        return format_error(status, body, 200)
+
+
+    async def remove_label(self, repository: str, label: github.Label) -> Union[str, None]:
+        """
+        Remove label from repository
+
+        :param repository: target repository
+        :param label: class Label, which should be deleted
+        :return: error message or None
+        """
+        userName, repoName = repository.split('/')
+        status, body = await self.request('DELETE', '/repos/{}/{}/labels/{}'.format(userName, repoName, label.name))
+
+        return format_error(status, body, 204)
+
+
+class AsyncLabelUpdater(github.LabelUpdater):
+    """
+    LabelUpdater, which change labels of all target repositories concurrently on one event loop.
+    Source labels and target repositories are still loaded by synchronous session.
+
+    :ivar jobs: maximal number of requests in flight
+    :vartype jobs: int
+    :ivar token: authentication token for GitHub
+    :vartype token: str
+    """
+
+
+    def __init__(self, session, config, runConfig):
+        super().__init__(session, config, runConfig)
+        self.jobs = runConfig.get('jobs', None) or 100
+        self.token = runConfig.get('token', None) or session.auth.token
+        self.apiUrl = runConfig.get('apiUrl', None)
+        self.rateLimiter = getattr(session, 'rateLimiter', None)
+        self.maxRetries = getattr(session, 'maxRetries', 5)
+        self.timeout = getattr(session, 'timeout', None) or github.DEFAULT_TIMEOUT
+
+
+    def update_labels(self, newLabels: list, targetRepositories: list) -> None:
+        """
+        Change labels in given repositories
+
+        :param newLabels: list of new labels
+        :param targetRepositories: list of target repositories
+        :return: None
+        """
+        asyncio.run(self.update_labels_async(newLabels, targetRepositories))
+
+        self.print_summary()
+
+
+    async def update_labels_async(self, newLabels: list, targetRepositories: list) -> None:
+        """
+        Change labels in given repositories, coroutine version of update_labels without summary
+
+        :param newLabels: list of new labels
+        :param targetRepositories: list of target repositories
+        :return: None
+        """
+        async with AsyncGitHubClient(self.token, self.jobs, self.apiUrl, self.rateLimiter, self.maxRetries,
+                                     self.timeout) as client:
+            await asyncio.gather(*[self.update_repository_async(client, newLabels, repository)
+                                   for repository in targetRepositories])
+
+
+    async def update_repository_async(self, client: AsyncGitHubClient, newLabels: list, repository: str) -> None:
+        """
+        Change labels in one repository, all operations are send concurrently
+
+        :param client: opened asynchronous client
+        :param newLabels: list of new labels
+        :param repository: target repository
+        :return: None
+        """
+        try:
+            oldLabels = await client.get_list_labels(repository)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            oldLabels = False
+
+        if type(oldLabels) is not list:
+            self.print_repository_error(repository)
+            return
+
+        self.reposNum += 1
+
+        await asyncio.gather(*[self.apply_operation_async(client, repository, operation)
+                               for operation in self.compute_operations(newLabels, oldLabels)])
+
+
+    async def apply_operation_async(self, client: AsyncGitHubClient, repository: str, operation: tuple) -> None:
+        """
+        Apply one operation from diff_labels to repository and print log
+
+        :param client: opened asynchronous client
+        :param repository: target repository
+        :param operation: tuple (operationType, label, oldLabel)
+        :return: None
+        """
+        operationType, label, oldLabel = operation
+        error = None
+        latency = None
+
+        if not self.dry:
+            start = time.perf_counter()
+            try:
+                if operationType == 'ADD':
+                    error = await client.add_label(repository, label)
+                elif operationType == 'UPD':
+                    error = await client.update_label(repository, label, oldLabel)
+                elif operationType == 'DEL':
+                    error = await client.remove_label(repository, label)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Same as requests exception in synchronous updater, only this operation fails
+                error = str(e) or type(e).__name__
+            latency = time.perf_counter() - start
+
+            if error is not None:
+                self.errorNum += 1
+
+        self.print_log(repository, operationType, label, error, latency)
+
+
+def validate_status(status: int, body, exitProgram: bool = True) -> int:
+    """
+    Validate status code of asynchronous response, same as github.validate_response
+
+    :param status: status code
+    :param body: json body of response
+    :param exitProgram: if false, quit will be supprested
+    :return: error code
+    :raises SystemExit: if exitProgram is true
+    """
+    message = body.get('message', '') if isinstance(body, dict) else ''
+    response = ResponseStatus(status, message)
+
+    return github.validate_response(response, exitProgram)
+
+
+def get_next_url(headers) -> Union[str, None]:
+    """
+    Read url of next page from Link header
+
+    :param headers: headers of response
+    :return: url of next page, None if there is no next page
+    """
+    for link in requests.utils.parse_header_links(headers.get('Link', '')):
+        if link.get('rel') == 'next':
+            return link['url']
+
+    return None
+
+
+def format_error(status: int, body, expected: int) -> Union[str, None]:
+    """
+    Create error message for log, if status is not expected
+
+    :param status: status code
+    :param body: json body of response
+    :param expected: expected status code
+    :return: error message or None
+    """
+    if status == expected:
+        return None
+
+    message = body.get('message', '') if isinstance(body, dict) else ''
+    return '{} - {}'.format(status, message)
+
+
+class ResponseStatus:
+    """
+    Minimal response object for github.validate_response and RateLimiter
+    """
+
+
+    def __init__(self, status: int, text: str, headers=None, body=None):
+        self.status_code = status
+        self.ok = status < 400
+        self.text = text
+        self.headers = headers if headers is not None else {}
+        self.body = body
+
+
+    def json(self):
+        return self.body
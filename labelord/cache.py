@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Union
+
+
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+
+def default_cache_path() -> str:
+    """
+    Return path to cache file
+    Look to system variable ``LABELORD_CACHE``, default is ``~/.cache/labelord/http-cache.sqlite``
+
+    :return: path to cache file
+    """
+    return os.getenv('LABELORD_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'labelord',
+                                                    'http-cache.sqlite'))
+
+
+class CachedResponse:
+    """
+    One cached response
+
+    :ivar body: raw body of response
+    :vartype body: bytes
+    :ivar headers: headers of response
+    :vartype headers: dict
+    """
+
+
+    def __init__(self, body: bytes, headers: dict):
+        self.body = body
+        self.headers = headers
+
+
+    @property
+    def etag(self) -> Union[str, None]:
+        return self.headers.get('ETag')
+
+
+    @property
+    def lastModified(self) -> Union[str, None]:
+        return self.headers.get('Last-Modified')
+
+
+class ResponseCache:
+    """
+    On disk cache of GET responses with ETag / Last-Modified, stored in SQLite database.
+    Responses are keyed by url and token. If size of cache is bigger than maxSize,
+    least recently used responses are removed.
+    Time of last use is buffered in memory and written to database with next stored response or at close,
+    so cache hits don't write to disk.
+
+    :ivar path: path to cache file
+    :vartype path: str
+    :ivar maxSize: maximal size of all cached bodies in bytes
+    :vartype maxSize: int
+    :ivar used: buffered time of last use of responses {key: time}
+    :vartype used: dict
+    """
+
+
+    def __init__(self, path: str, maxSize: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.used = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                    'key TEXT PRIMARY KEY, body BLOB, headers TEXT, size INTEGER, used REAL)')
+
+
+    @staticmethod
+    def make_key(url: str, token: str) -> str:
+        """
+        Create key of response, token is hashed
+
+        :param url: url of request
+        :param token: GitHub token
+        :return: key
+        """
+        return hashlib.sha256('{} {}'.format(token or '', url).encode()).hexdigest()
+
+
+    def get(self, key: str) -> Union[CachedResponse, None]:
+        """
+        Get cached response and mark it as recently used
+
+        :param key: key from make_key
+        :return: cached response or None
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT body, headers FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            self.used[key] = time.time()
+
+        return CachedResponse(row[0], json.loads(row[1]))
+
+
+    def set(self, key: str, body: bytes, headers: dict) -> None:
+        """
+        Store response to cache and evict least recently used responses over size limit
+
+        :param key: key from make_key
+        :param body: raw body of response
+        :param headers: headers of response
+        :return: None
+        """
+        if len(body) > self.maxSize:
+            return
+
+        with self.lock, self.connection:
+            self.write_used()
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (key, body, json.dumps(headers), len(body), time.time()))
+
+            size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if size <= self.maxSize:
+                return
+
+            for rowKey, rowSize in self.connection.execute('SELECT key, size FROM responses ORDER BY used').fetchall():
+                if size <= self.maxSize:
+                    break
+                self.connection.execute('DELETE FROM responses WHERE key = ?', (rowKey,))
+                size -= rowSize
+
+
+    def write_used(self) -> None:
+        """
+        Write buffered time of last use to database, caller must hold lock and transaction
+
+        :return: None
+        """
+        if self.used:
+            self.connection.executemany('UPDATE responses SET used = ? WHERE key = ?',
+                                        [(used, key) for key, used in self.used.items()])
+            self.used.clear()
+
+
+    def flush(self) -> None:
+        """
+        Write buffered time of last use to database
+
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.write_used()
+
+
+    def clear(self) -> None:
+        """
+        Remove all responses from cache
+
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.used.clear()
+            self.connection.execute('DELETE FROM responses')
+
+
+    def close(self) -> None:
+        """
+        Write buffered time of last use and close database connection
+
+        :return: None
+        """
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+
+
+# Number of completed repositories and time (seconds) after which checkpoint is synced to disk
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_SYNC_INTERVAL = 1.0
+
+
+class Checkpoint:
+    """
+    Checkpoint file of run, so interrupted run could be resumed.
+    File is JSON lines, first line is header with fingerprint of template and mode,
+    next lines are completed repositories. If header doesn't match current template and mode,
+    checkpoint is started again.
+    Completed repositories are written immediately, but file is synced to disk (fsync) in batches.
+
+    :ivar path: path to checkpoint file
+    :vartype path: str
+    :ivar fingerprint: fingerprint of template and mode
+    :vartype fingerprint: str
+    :ivar completed: set of completed repositories (from previous runs and this run)
+    :vartype completed: set
+    """
+
+
+    def __init__(self, path: str, fingerprint: str, batchSize: int = DEFAULT_BATCH_SIZE,
+                 interval: float = DEFAULT_SYNC_INTERVAL, clock=time.monotonic):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.batchSize = batchSize
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.completed = set()
+        self.unsynced = 0
+        self.lastSync = clock()
+
+        resumed = self.load()
+
+        self.file = open(path, 'a' if resumed else 'w')
+        if not resumed:
+            self.file.write(json.dumps({'fingerprint': fingerprint, 'created': time.time()}) + '\n')
+            self.sync()
+
+
+    def load(self) -> bool:
+        """
+        Load completed repositories from existing checkpoint with same fingerprint
+
+        :return: True if checkpoint is resumed
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return False
+
+        if header.get('fingerprint') != self.fingerprint:
+            return False
+
+        for line in lines[1:]:
+            try:
+                self.completed.add(json.loads(line)['repo'])
+            except (ValueError, KeyError):
+                # Last line could be incomplete after crash
+                continue
+
+        if lines[-1] and not lines[-1].endswith('\n'):
+            with open(self.path, 'a') as f:
+                f.write('\n')
+
+        return True
+
+
+    def is_completed(self, repository: str) -> bool:
+        """
+        Check if repository was completed by previous run
+
+        :param repository: repository
+        :return: True if completed
+        """
+        return repository in self.completed
+
+
+    def complete(self, repository: str) -> None:
+        """
+        Record completed repository
+
+        :param repository: repository
+        :return: None
+        """
+        line = json.dumps({'repo': repository}) + '\n'
+
+        with self.lock:
+            self.completed.add(repository)
+            self.file.write(line)
+            self.unsynced += 1
+
+            if self.unsynced >= self.batchSize or self.clock() - self.lastSync >= self.interval:
+                self.sync()
+
+
+    def sync(self) -> None:
+        """
+        Flush and fsync checkpoint file
+
+        :return: None
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.lastSync = self.clock()
+
+
+    def close(self) -> None:
+        """
+        Sync and close checkpoint file
+
+        :return: None
+        """
+        with self.lock:
+            if not self.file.closed:
+                self.sync()
+                self.file.close()
+
+
+    def remove(self) -> None:
+        """
+        Close and remove checkpoint file (whole run is done)
+
+        :return: None
+        """
+        self.close()
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
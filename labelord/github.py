@@ -1,9 +1,36 @@
 import requests
+import urllib3
 import configparser
+import concurrent.futures
+import functools
+import hashlib
+import json
 import sys
 import string
+import threading
+import time
+import urllib.parse
 from typing import Union
 
+from labelord import checkpoint, metrics, profiling, syncstate
+
+
+API_URL = 'https://api.github.com'
+
+# Maximal number of pages loaded in parallel (by all workers together)
+PAGE_JOBS = 8
+
+# Pool of threads loading pages, shared by all workers, so they need at most PAGE_JOBS connections
+_pageExecutor = None
+_pageExecutorLock = threading.Lock()
+
+# Default connection pool size and timeout (connect, read) of session
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (10, 60)
+
+# Number of repositories in one GraphQL query
+GRAPHQL_BATCH = 50
+
 
 class MyAuth(requests.auth.AuthBase):
     """
@@ -33,6 +60,201 @@ class MyAuth(requests.auth.AuthBase):
         return req
 
 
+class GitHubSession(requests.Session):
+    """
+    Session for GitHub api with optional cache of GET responses and rate limit scheduler.
+    If cache is set, GET requests are send with If-None-Match / If-Modified-Since
+    and responses 304 Not Modified are served from cache.
+    If rateLimiter is set, every request waits for it and rate limited requests are retried.
+
+    :ivar cache: cache of responses or None
+    :vartype cache: ResponseCache
+    :ivar rateLimiter: scheduler of requests or None
+    :vartype rateLimiter: RateLimiter
+    :ivar maxRetries: maximal number of retries of rate limited request
+    :vartype maxRetries: int
+    :ivar timeout: default timeout of requests (connect, read) in seconds
+    :vartype timeout: tuple
+    :ivar poolSize: maximal number of kept connections
+    :vartype poolSize: int
+    :ivar concurrency: adaptive limit of requests in flight or None
+    :vartype concurrency: ConcurrencyLimiter
+    """
+
+
+    def __init__(self, cache=None, rateLimiter=None, maxRetries: int = 5, timeout: tuple = None,
+                 concurrency=None):
+        super().__init__()
+        self.headers = {'User-Agent': 'Python'}
+        self.cache = cache
+        self.rateLimiter = rateLimiter
+        self.concurrency = concurrency
+        self.maxRetries = maxRetries
+        self.timeout = timeout
+        self.poolSize = requests.adapters.DEFAULT_POOLSIZE
+
+
+    def mount_adapters(self, poolSize: int, retries: int = 3) -> None:
+        """
+        Mount http adapters with connection pool of given size
+        Connection errors and 502/503/504 responses of idempotent requests are retried with backoff
+
+        :param poolSize: maximal number of kept connections
+        :param retries: number of retries
+        :return: None
+        """
+        retry = urllib3.util.Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                   raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=retry)
+
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.poolSize = poolSize
+
+
+    def ensure_pool_size(self, poolSize: int) -> None:
+        """
+        Mount bigger connection pool, if current is smaller than poolSize
+
+        :param poolSize: needed number of connections
+        :return: None
+        """
+        if poolSize > self.poolSize:
+            self.mount_adapters(poolSize)
+
+
+    def request(self, method, url, *args, **kwargs):
+        if self.timeout is not None and kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        if self.rateLimiter is None:
+            return self.limited_request(method, url, *args, **kwargs)
+
+        attempt = 0
+        while True:
+            self.rateLimiter.wait()
+            response = self.limited_request(method, url, *args, **dict(kwargs))
+            self.rateLimiter.update(response)
+
+            delay = self.rateLimiter.retry_delay(response, attempt)
+            if delay is None or attempt >= self.maxRetries:
+                return response
+
+            self.rateLimiter.pause(delay)
+            attempt += 1
+
+
+    def limited_request(self, method, url, *args, **kwargs):
+        """
+        Send request, if concurrency is set, request waits for free slot and its result adjusts the limit
+        Slot is held for whole request including redirects (they are sent by send), not during rate limit pauses
+
+        :return: response
+        """
+        if self.concurrency is None:
+            return self.cached_request(method, url, *args, **kwargs)
+
+        epoch = self.concurrency.acquire()
+        start = time.perf_counter()
+        response = None
+
+        try:
+            response = self.cached_request(method, url, *args, **kwargs)
+        finally:
+            self.concurrency.release(epoch, time.perf_counter() - start, response)
+
+        return response
+
+
+    def send(self, request, **kwargs):
+        """
+        Send prepared request, method, status and latency are recorded to metrics
+
+        :return: response
+        """
+        start = time.perf_counter()
+
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            metrics.GITHUB_REQUESTS.inc((request.method, 'error'))
+            raise
+
+        metrics.GITHUB_SECONDS.observe(time.perf_counter() - start, (request.method,))
+        metrics.GITHUB_REQUESTS.inc((request.method, str(response.status_code)))
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            metrics.RATE_LIMIT_REMAINING.set(int(remaining))
+
+        return response
+
+
+    def cached_request(self, method, url, *args, **kwargs):
+        """
+        Send request, GET requests are served from cache if it is possible
+
+        :return: response
+        """
+        if self.cache is None or method.upper() != 'GET':
+            return super().request(method, url, *args, **kwargs)
+
+        token = self.auth.token if isinstance(self.auth, MyAuth) else None
+        key = self.cache.make_key(url, token)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            headers = dict(kwargs.pop('headers', None) or {})
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.lastModified:
+                headers['If-Modified-Since'] = cached.lastModified
+            kwargs['headers'] = headers
+
+        response = super().request(method, url, *args, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            headers = dict(cached.headers)
+            headers.update((k, v) for k, v in response.headers.items()
+                           if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding'))
+            response.status_code = 200
+            response.reason = 'OK'
+            response.headers = requests.structures.CaseInsensitiveDict(headers)
+            response._content = cached.body
+            response.from_cache = True
+            return response
+
+        response.from_cache = False
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            headers = {k: v for k, v in response.headers.items()
+                       if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+            self.cache.set(key, response.content, headers)
+
+        return response
+
+
+def create_session(token: str = None, cache=None, rateLimiter=None, poolSize: int = DEFAULT_POOL_SIZE,
+                   timeout: tuple = DEFAULT_TIMEOUT) -> GitHubSession:
+    """
+    Create session for GitHub api with connection pool, keep-alive, gzip and timeouts
+
+    :param token: GitHub token (session is not authenticated if not set)
+    :param cache: cache of responses or None
+    :param rateLimiter: scheduler of requests or None
+    :param poolSize: maximal number of kept connections
+    :param timeout: timeout of requests (connect, read) in seconds
+    :return: session
+    """
+    session = GitHubSession(cache, rateLimiter, timeout=timeout)
+    session.headers = {'User-Agent': 'Python', 'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+    session.mount_adapters(poolSize)
+
+    if token:
+        session.auth = MyAuth(token)
+
+    return session
+
+
 class Label:
     """
     Class that handle one github label.
@@ -79,6 +301,20 @@ class LabelUpdater:
     :vartype config: Config
     :ivar runConfig: dictionary with all arguments from console
     :vartype runConfig: dict
+    :ivar jobs: number of repositories updated in parallel
+    :vartype jobs: int
+    :ivar graphql: if True, labels of target repositories are loaded in batches by GraphQL api
+    :vartype graphql: bool
+    :ivar state: store of synchronized state of repositories for incremental run, or None
+    :vartype state: SyncState
+    :ivar writer: writer of JSON lines records, if set, it is used instead of console output
+    :vartype writer: JsonLinesWriter
+    :ivar shard: tuple (index, count), only repositories of this shard are target repositories, or None
+    :vartype shard: tuple
+    :ivar checkpointPath: path to checkpoint file of resumable run, or None
+    :vartype checkpointPath: str
+    :ivar concurrency: adaptive limit of requests in flight used by session, its changes are logged, or None
+    :vartype concurrency: ConcurrencyLimiter
     """
 
 
@@ -90,8 +326,23 @@ class LabelUpdater:
         self.verbose = runConfig.get('verbose', None)
         self.quiet = runConfig.get('quiet', None)
         self.mode = runConfig.get('mode', None)
+        self.jobs = runConfig.get('jobs', None) or 1
+        self.graphql = runConfig.get('graphql', None)
+        self.state = runConfig.get('state', None)
+        self.writer = runConfig.get('writer', None)
+        self.shard = runConfig.get('shard', None)
+        self.checkpointPath = runConfig.get('checkpoint', None)
+        self.checkpoint = None
+        self.concurrency = runConfig.get('concurrency', None)
+        if self.concurrency is not None:
+            self.concurrency.listener = self.print_limit
+        self.fingerprint = None
+        self.labelsFingerprint = None
+        self.plans = {}
+        self.prefetchedLabels = {}
         self.errorNum = 0
         self.reposNum = 0
+        self.lock = threading.RLock()
 
 
     def get_source_labels(self, repository: str) -> list:
@@ -107,11 +358,13 @@ class LabelUpdater:
         labels = []
 
         if repository:
-            labels = get_list_labels(self.session, repository)
+            with profiling.phase('template labels'):
+                labels = get_list_labels(self.session, repository)
             return labels
 
         if 'others' in self.config and 'template-repo' in self.config['others']:
-            labels = get_list_labels(self.session, self.config['others']['template-repo'])
+            with profiling.phase('template labels'):
+                labels = get_list_labels(self.session, self.config['others']['template-repo'])
 
         if labels:
             return labels
@@ -132,49 +385,72 @@ class LabelUpdater:
         First check parameter -a/--all_repos (use all accesable repos)
         Second try list of repos from repos section in config file
         If not found, quit with exit code 7
+        If shard is set, only repositories of shard are returned
 
         :return: list of repos
         :raises SystemExit: if not repos found
         """
         if self.allRepos:
-            repos = get_list_repos(self.session)
-            return repos
+            with profiling.phase('list repos'):
+                repos = get_list_repos(self.session)
+            return self.filter_shard(repos)
 
         repos = []
         if 'repos' in self.config:
             for key in self.config['repos']:
                 if self.config['repos'].getboolean(key):
                     repos.append(key)
-            return repos
+            return self.filter_shard(repos)
 
         sys.stderr.write('No repositories specification has been found\n')
         quit(7)
 
 
-    def print_summary(self) -> None:
+    def filter_shard(self, repositories: list) -> list:
+        """
+        Return only repositories of shard of this run
+
+        :param repositories: list of repositories
+        :return: list of repositories
+        """
+        if self.shard is None:
+            return repositories
+
+        return shard_repositories(repositories, *self.shard)
+
+
+    def print_summary(self, action: str = 'updated') -> None:
         """
         Print summary line based on -q/--quit and -v/--verbose parameters
         Each of them have another format
         If there were some errors, quit with exit code 10
 
+        :param action: what was done with repositories (updated, planned)
         :return: None
         :raises SystemExit: if there is some error
         """
-        if self.quiet and self.verbose:
+        if self.writer is not None:
+            self.writer.write({'op': 'SUMMARY', 'result': 'ERR' if self.errorNum else 'SUC', 'action': action,
+                               'repos': self.reposNum, 'errors': self.errorNum,
+                               'shard': '{}/{}'.format(*self.shard) if self.shard else None})
+            self.writer.flush()
+            if self.errorNum != 0:
+                quit(10)
+        elif self.quiet and self.verbose:
             if self.errorNum == 0:
-                print('SUMMARY: {} repo(s) updated successfully'.format(self.reposNum))
+                print('SUMMARY: {} repo(s) {} successfully'.format(self.reposNum, action))
             else:
                 print('SUMMARY: there were {} errors, please error check log'.format(self.errorNum))
                 quit(10)
         elif not self.quiet and not self.verbose:
             if self.errorNum == 0:
-                print('SUMMARY: {} repo(s) updated successfully'.format(self.reposNum))
+                print('SUMMARY: {} repo(s) {} successfully'.format(self.reposNum, action))
             else:
                 print('SUMMARY: {} error(s) in total, please check log above'.format(self.errorNum))
                 quit(10)
         elif self.verbose:
             if self.errorNum == 0:
-                print('[SUMMARY] {} repo(s) updated successfully'.format(self.reposNum))
+                print('[SUMMARY] {} repo(s) {} successfully'.format(self.reposNum, action))
             else:
                 print('[SUMMARY] {} error(s) in total, please check log above'.format(self.errorNum))
                 quit(10)
@@ -182,7 +458,8 @@ class LabelUpdater:
             quit(10)
 
 
-    def print_log(self, repository: str, operationType: str, label: Label, error: str) -> None:
+    def print_log(self, repository: str, operationType: str, label: Label, error: str,
+                  latency: float = None) -> None:
         """
         Print one log line
 
@@ -190,131 +467,529 @@ class LabelUpdater:
         :param operationType: Operation type (UPD,DEL,ADD)
         :param label: Label class with new label
         :param error: error message, if there war some error
+        :param latency: duration of request in seconds
         :return: None
         """
-        if self.verbose:
-            if not self.quiet:
-                if self.dry:
-                    res = 'DRY'
-                elif error is not None:
-                    res = 'ERR'
-                else:
-                    res = 'SUC'
+        if self.writer is not None:
+            self.writer.write({'op': operationType, 'result': 'DRY' if self.dry else 'ERR' if error else 'SUC',
+                               'repo': repository, 'label': label.name, 'color': label.color, 'error': error,
+                               'latency': round(latency, 6) if latency is not None else None})
+            return
+
+        with self.lock:
+            if self.verbose:
+                if not self.quiet:
+                    if self.dry:
+                        res = 'DRY'
+                    elif error is not None:
+                        res = 'ERR'
+                    else:
+                        res = 'SUC'
 
-                errorText = '; {}'.format(error) if error is not None else ''
-                print('[{}][{}] {}; {}; {}{}'.format(operationType, res, repository, label.name, label.color, errorText))
+                    errorText = '; {}'.format(error) if error is not None else ''
+                    print('[{}][{}] {}; {}; {}{}'.format(operationType, res, repository, label.name, label.color,
+                                                         errorText))
 
-        if not self.verbose and not self.quiet and error is not None:
-            sys.stderr.write('ERROR: {}; {}; {}; {}; {}\n'.format(operationType, repository, label.name, label.color, error))
+            if not self.verbose and not self.quiet and error is not None:
+                sys.stderr.write('ERROR: {}; {}; {}; {}; {}\n'.format(operationType, repository, label.name, label.color,
+                                                                     error))
 
 
     def update_labels(self, newLabels: list, targetRepositories: list) -> None:
         """
         Change labels in given repositories
+        If jobs is greater than 1, repositories are updated in parallel by pool of workers
 
         :param newLabels: list of new labels
         :param targetRepositories: list of target repositories
         :return: None
         """
-        for repository in targetRepositories:
-            oldLabels = get_list_labels(self.session, repository, False)
+        self.labelsFingerprint = syncstate.label_set_fingerprint(newLabels)
+        if self.state is not None:
+            self.fingerprint = syncstate.template_fingerprint(newLabels, self.mode)
 
-            if type(oldLabels) is not list:
-                self.errorNum += 1
-                if not self.quiet:
-                    if not self.verbose:
-                        sys.stderr.write('ERROR: LBL; {}; {}\n'.format(repository, '404 - Not Found'))
-                    else:
-                        print('[LBL][ERR] {}; {}'.format(repository, '404 - Not Found'))
-                continue
+        if self.checkpointPath is not None:
+            self.checkpoint = checkpoint.Checkpoint(self.checkpointPath,
+                                                    syncstate.template_fingerprint(newLabels, self.mode))
+            targetRepositories = [repository for repository in targetRepositories
+                                  if not self.skip_completed(repository)]
+
+        try:
+            self.prefetch_labels(targetRepositories)
+
+            self.run_parallel(functools.partial(self.update_repository, newLabels), targetRepositories)
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+
+        # Whole run is done, next run starts again
+        if self.checkpoint is not None and self.errorNum == 0:
+            self.checkpoint.remove()
+
+        self.print_summary()
+
+
+    def update_repository(self, newLabels: list, repository: str) -> None:
+        """
+        Change labels in one repository
+        In incremental run, repository is skipped if it was not changed since last synchronization
+        and state of synchronized repository is stored.
+        Repository without errors is recorded to checkpoint.
+
+        :param newLabels: list of new labels
+        :param repository: target repository
+        :return: None
+        """
+        if self.state is not None and self.is_unchanged(repository):
+            if self.checkpoint is not None:
+                self.checkpoint.complete(repository)
+            return
+
+        responses = [] if self.state is not None else None
+        oldLabels = self.get_repository_labels(repository, responses)
+
+        if oldLabels is None:
+            return
+
+        operations = self.compute_operations(newLabels, oldLabels)
 
+        errors = self.apply_operations(repository, operations)
+
+        if self.checkpoint is not None and not any(errors):
+            self.checkpoint.complete(repository)
+
+        if self.state is None:
+            return
+
+        if not operations:
+            self.save_state(repository, oldLabels, responses)
+        elif not self.dry and not any(errors):
+            self.refresh_state(newLabels, repository)
+
+
+    def compute_operations(self, newLabels: list, oldLabels: list) -> list:
+        """
+        Compute operations for repository with given labels
+        If labels are same as template, there is nothing to do without diff.
+        Repositories with same labels share one computed list of operations.
+
+        :param newLabels: list of new labels (same for whole run)
+        :param oldLabels: labels of target repository
+        :return: list of operations (operationType, label, oldLabel)
+        """
+        with profiling.phase('diff'):
+            if self.labelsFingerprint is None:
+                self.labelsFingerprint = syncstate.label_set_fingerprint(newLabels)
+
+            targetFingerprint = syncstate.label_set_fingerprint(oldLabels)
+            if targetFingerprint == self.labelsFingerprint:
+                return []
+
+            with self.lock:
+                operations = self.plans.get(targetFingerprint)
+
+            if operations is None:
+                operations = diff_labels(newLabels, oldLabels, self.mode)
+
+                with self.lock:
+                    self.plans[targetFingerprint] = operations
+
+        return operations
+
+
+    def is_unchanged(self, repository: str) -> bool:
+        """
+        Check if repository is still synchronized with same template
+        All pages of labels are loaded by conditional requests with stored ETags,
+        304 responses don't consume rate limit of GitHub
+
+        :param repository: target repository
+        :return: True if repository could be skipped
+        """
+        state = self.state.get(repository)
+
+        if state is None or not state.pages:
+            return False
+
+        if state.fingerprint != self.fingerprint and state.labels != self.labelsFingerprint:
+            return False
+
+        with profiling.phase('state check'):
+            for url, etag in state.pages:
+                r = self.session.get(url, headers={'If-None-Match': etag})
+
+                if r.status_code != 304 and (r.status_code != 200 or r.headers.get('ETag') != etag):
+                    return False
+
+        self.print_skip(repository, 'Unchanged')
+
+        return True
+
+
+    def skip_completed(self, repository: str) -> bool:
+        """
+        Check if repository was completed by previous run with same checkpoint, such repository is skipped
+
+        :param repository: target repository
+        :return: True if repository is skipped
+        """
+        if not self.checkpoint.is_completed(repository):
+            return False
+
+        self.print_skip(repository, 'Completed')
+
+        return True
+
+
+    def print_skip(self, repository: str, reason: str) -> None:
+        """
+        Count skipped repository as successful and print it in verbose mode
+
+        :param repository: skipped repository
+        :param reason: reason of skip
+        :return: None
+        """
+        with self.lock:
             self.reposNum += 1
+            if self.writer is not None:
+                self.writer.write({'op': 'SKP', 'result': 'SUC', 'repo': repository, 'label': None, 'color': None,
+                                   'error': None, 'latency': None})
+            elif self.verbose and not self.quiet:
+                print('[SKP][SUC] {}; {}'.format(repository, reason))
 
-            for label in newLabels:
-                it, sim = find_label(label, oldLabels)
 
-                if sim != 0:
-                    oldLabels.remove(it)
+    def save_state(self, repository: str, labels: list, responses: list) -> None:
+        """
+        Store state of synchronized repository from responses of its labels
+        If ETags are missing or last page is full (new page could be added unnoticed), state is removed
 
-                if sim == 0:
-                    self.add_label(repository, label)
+        :param repository: target repository
+        :param labels: current labels of repository
+        :param responses: responses of all pages of labels
+        :return: None
+        """
+        pages = [(r.url, r.headers.get('ETag')) for r in responses or []]
+
+        if not pages or any(etag is None for url, etag in pages) or (labels and len(labels) % 100 == 0):
+            self.state.delete(repository)
+            return
+
+        self.state.set(repository, self.fingerprint, pages, syncstate.label_set_fingerprint(labels))
+
+
+    def refresh_state(self, newLabels: list, repository: str) -> None:
+        """
+        Load labels of repository after changes and store state, if repository is synchronized
+
+        :param newLabels: list of new labels
+        :param repository: target repository
+        :return: None
+        """
+        responses = []
+        labels = get_list_labels(self.session, repository, False, responses)
+
+        if labels is not False and not diff_labels(newLabels, labels, self.mode):
+            self.save_state(repository, labels, responses)
+
+
+    def plan_labels(self, newLabels: list, targetRepositories: list, planFile) -> None:
+        """
+        Compute operations for given repositories and write them to plan file (one JSON line per repository)
+        Plan could be applied later by apply_plan
+
+        :param newLabels: list of new labels
+        :param targetRepositories: list of target repositories
+        :param planFile: opened file for writing
+        :return: None
+        """
+        self.prefetch_labels(targetRepositories)
+
+        plans = self.run_parallel(functools.partial(self.plan_repository, newLabels), targetRepositories)
 
-                elif sim == 1:
-                    self.update_label(repository, label)
+        for plan in plans:
+            if plan is not None:
+                planFile.write(json.dumps(plan) + '\n')
 
-                elif sim == 3:
-                    self.update_label(repository, label, it)
+        self.print_summary('planned')
 
-            if self.mode == 'replace':
-                for label in oldLabels:
-                    self.remove_label(repository, label)
+
+    def plan_repository(self, newLabels: list, repository: str) -> Union[dict, None]:
+        """
+        Compute operations for one repository, each operation is logged
+
+        :param newLabels: list of new labels
+        :param repository: target repository
+        :return: plan of repository (dictionary) or None if labels could not be loaded
+        """
+        oldLabels = self.get_repository_labels(repository)
+
+        if oldLabels is None:
+            return None
+
+        operations = self.compute_operations(newLabels, oldLabels)
+
+        for operationType, label, oldLabel in operations:
+            self.print_log(repository, operationType, label, None)
+
+        return {'repo': repository, 'mode': self.mode, 'operations': [operation_to_dict(o) for o in operations]}
+
+
+    def apply_plan(self, plans) -> None:
+        """
+        Apply plans created by plan_labels, no labels are loaded from GitHub
+
+        :param plans: iterable of plans (dictionaries)
+        :return: None
+        """
+        self.run_parallel(self.apply_repository_plan, plans)
 
         self.print_summary()
 
 
-    def add_label(self, repository: str, label: Label) -> None:
+    def apply_repository_plan(self, plan: dict) -> None:
+        """
+        Apply plan of one repository
+
+        :param plan: plan of repository (dictionary)
+        :return: None
+        """
+        with self.lock:
+            self.reposNum += 1
+
+        self.apply_operations(plan['repo'], [operation_from_dict(o) for o in plan['operations']])
+
+
+    def get_repository_labels(self, repository: str, responses: list = None) -> Union[list, None]:
+        """
+        Load labels of target repository, if repository is not found, increase error counter
+
+        :param repository: target repository
+        :param responses: if set, responses of all pages of labels are appended to it
+        :return: list of labels or None
+        """
+        if repository in self.prefetchedLabels:
+            oldLabels = self.prefetchedLabels.pop(repository)
+        else:
+            with profiling.phase('target labels'):
+                oldLabels = get_list_labels(self.session, repository, False, responses)
+
+        with self.lock:
+            if type(oldLabels) is not list:
+                self.print_repository_error(repository)
+                return None
+
+            self.reposNum += 1
+
+        return oldLabels
+
+
+    def print_limit(self, limit: int, reason: str) -> None:
+        """
+        Print change of adaptive limit of requests in flight (only in verbose mode or to jsonl output)
+
+        :param limit: new limit
+        :param reason: reason of change
+        :return: None
+        """
+        if self.writer is not None:
+            self.writer.write({'op': 'LIMIT', 'result': 'SUC', 'limit': limit, 'reason': reason})
+            return
+
+        with self.lock:
+            if self.verbose and not self.quiet:
+                print('[LIMIT] {}; {}'.format(limit, reason))
+
+
+    def print_repository_error(self, repository: str) -> None:
+        """
+        Increase error counter and print error of repository, which labels could not be loaded
+
+        :param repository: target repository
+        :return: None
+        """
+        with self.lock:
+            self.errorNum += 1
+
+            if self.writer is not None:
+                self.writer.write({'op': 'LBL', 'result': 'ERR', 'repo': repository, 'label': None, 'color': None,
+                                   'error': '404 - Not Found', 'latency': None})
+            elif not self.quiet:
+                if not self.verbose:
+                    sys.stderr.write('ERROR: LBL; {}; {}\n'.format(repository, '404 - Not Found'))
+                else:
+                    print('[LBL][ERR] {}; {}'.format(repository, '404 - Not Found'))
+
+
+    def prefetch_labels(self, targetRepositories: list) -> None:
+        """
+        Load labels of all target repositories by GraphQL api (only if graphql is set)
+        Loaded labels are used by get_repository_labels instead of REST api
+
+        :param targetRepositories: list of target repositories
+        :return: None
+        """
+        if self.graphql:
+            with profiling.phase('target labels'):
+                self.prefetchedLabels = get_labels_graphql(self.session, targetRepositories)
+
+
+    def apply_operations(self, repository: str, operations: list) -> list:
+        """
+        Apply operations from diff_labels to repository
+
+        :param repository: target repository
+        :param operations: list of operations (operationType, label, oldLabel)
+        :return: list of errors (None for successful operation)
+        """
+        return [self.apply_operation(repository, operation) for operation in operations]
+
+
+    def apply_operation(self, repository: str, operation: tuple) -> Union[str, None]:
+        """
+        Apply one operation from diff_labels to repository
+
+        :param repository: target repository
+        :param operation: tuple (operationType, label, oldLabel)
+        :return: error message or None
+        """
+        operationType, label, oldLabel = operation
+
+        with profiling.phase('writes'):
+            if operationType == 'ADD':
+                return self.add_label(repository, label)
+
+            elif operationType == 'UPD':
+                return self.update_label(repository, label, oldLabel)
+
+            elif operationType == 'DEL':
+                return self.remove_label(repository, label)
+
+
+    def run_parallel(self, function, items) -> list:
+        """
+        Call function for each item, if jobs is greater than 1, items are processed by pool of workers
+
+        :param function: function with one argument
+        :param items: iterable of arguments
+        :return: list of results in order of items
+        """
+        if self.jobs > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                return list(executor.map(function, items))
+
+        return [function(item) for item in items]
+
+
+    def add_label(self, repository: str, label: Label) -> Union[str, None]:
         """
         Add label to repository, if there is some error, increase error counter
 
         :param repository: target repository
         :param label: class Label with new label
-        :return: None
+        :return: error message or None
         """
         userName, repoName = repository.split('/')
         error = None
+        latency = None
 
         if not self.dry:
-            r = self.session.post('https://api.github.com/repos/{}/{}/labels'.format(userName, repoName),
+            start = time.perf_counter()
+            r = self.session.post(API_URL + '/repos/{}/{}/labels'.format(userName, repoName),
                                   json={'name': label.name, 'color': label.color})
 
+            latency = time.perf_counter() - start
+
             if r.status_code != 201:
                 error = '{} - {}'.format(r.status_code, r.json()['message'])
-                self.errorNum += 1
+                with self.lock:
+                    self.errorNum += 1
+
+        self.print_log(repository, 'ADD', label, error, latency)
 
-        self.print_log(repository, 'ADD', label, error)
+        return error
 
 
-    def update_label(self, repository: str, label: Label, oldLabel: Label = None) -> None:
+    def update_label(self, repository: str, label: Label, oldLabel: Label = None) -> Union[str, None]:
         """
         Update existing label in repository, if there is some error, increase error counter
 
         :param repository: target repository
         :param label: class Label with new Label
         :param oldLabel: class Label with old label, if change only case in name of label
-        :return: None
+        :return: error message or None
         """
         userName, repoName = repository.split('/')
         error = None
+        latency = None
         labelName = oldLabel.name if oldLabel is not None else label.name
         if not self.dry:
-            r = self.session.patch('https://api.github.com/repos/{}/{}/labels/{}'.format(userName, repoName, labelName),
+            start = time.perf_counter()
+            r = self.session.patch(API_URL + '/repos/{}/{}/labels/{}'.format(userName, repoName, labelName),
                                    json={'color': label.color, 'name': label.name})
 
+            latency = time.perf_counter() - start
+
             if r.status_code != 200:
                 error = '{} - {}'.format(r.status_code, r.json()['message'])
-                self.errorNum += 1
+                with self.lock:
+                    self.errorNum += 1
+
+        self.print_log(repository, 'UPD', label, error, latency)
 
-        self.print_log(repository, 'UPD', label, error)
+        return error
 
 
-    def remove_label(self, repository: str, label: Label) -> None:
+    def remove_label(self, repository: str, label: Label) -> Union[str, None]:
         """
         Remove label from repository, if there is some error, increase error counter
 
         :param repository: target repository
         :param label: class Label, which should be deleted
-        :return: None
+        :return: error message or None
         """
         userName, repoName = repository.split('/')
         error = None
+        latency = None
         if not self.dry:
-            r = self.session.delete('https://api.github.com/repos/{}/{}/labels/{}'.format(userName, repoName, label.name))
+            start = time.perf_counter()
+            r = self.session.delete(API_URL + '/repos/{}/{}/labels/{}'.format(userName, repoName, label.name))
+
+            latency = time.perf_counter() - start
 
             if r.status_code != 204:
                 error = '{} - {}'.format(r.status_code, r.json()['message'])
-                self.errorNum += 1
+                with self.lock:
+                    self.errorNum += 1
 
-        self.print_log(repository, 'DEL', label, error)
+        self.print_log(repository, 'DEL', label, error, latency)
+
+        return error
+
+
+def shard_of(repository: str, count: int) -> int:
+    """
+    Return shard of repository by rendezvous hashing (highest random weight)
+    Shard depends only on name of repository, so adding repositories doesn't move others
+    and change of number of shards moves only necessary part of repositories
+
+    :param repository: repository
+    :param count: number of shards
+    :return: index of shard (from 1)
+    """
+    weights = [hashlib.sha1('{}:{}'.format(index, repository).encode()).digest() for index in range(1, count + 1)]
+    return weights.index(max(weights)) + 1
+
+
+def shard_repositories(repositories: list, index: int, count: int) -> list:
+    """
+    Return repositories of one shard
+
+    :param repositories: list of repositories
+    :param index: index of shard (from 1)
+    :param count: number of shards
+    :return: list of repositories in shard
+    """
+    return [repository for repository in repositories if shard_of(repository, count) == index]
 
 
 def find_label(label: Label, iterable: list) -> tuple:
@@ -334,7 +1009,7 @@ def find_label(label: Label, iterable: list) -> tuple:
     """
     for it in iterable:
         if label.name == it.name:
-            if label.color == it.color:
+            if label.color.lower() == it.color.lower():
                 return it, 2
             else:
                 return it, 1
@@ -344,6 +1019,116 @@ def find_label(label: Label, iterable: list) -> tuple:
     return None, 0
 
 
+def diff_labels(newLabels: list, oldLabels: list, mode: str) -> list:
+    """
+    Compute operations, which change old labels of repository to new labels
+
+    Each operation is tuple (operationType, label, oldLabel)
+
+    * ADD -> label is not in repository
+    * UPD -> label has other color, oldLabel is set if name differs in case
+    * DEL -> label is not in new labels (only for replace mode)
+
+    Old labels are indexed by exact and case folded name, so diff is linear in number of labels.
+    Colors are compared case insensitive (API returns lower case colors).
+
+    :param newLabels: list of new labels
+    :param oldLabels: list of labels in repository
+    :param mode: update / replace
+    :return: list of operations
+    """
+    exactIndex = {}
+    foldedIndex = {}
+    for position, label in enumerate(oldLabels):
+        exactIndex.setdefault(label.name, []).append(position)
+        foldedIndex.setdefault(label.name.casefold(), []).append(position)
+
+    used = set()
+    operations = []
+
+    for label in newLabels:
+        position = _first_unused(exactIndex.get(label.name), used)
+
+        if position is not None:
+            used.add(position)
+            if label.color.lower() != oldLabels[position].color.lower():
+                operations.append(('UPD', label, None))
+            continue
+
+        position = _first_unused(foldedIndex.get(label.name.casefold()), used)
+
+        if position is not None:
+            used.add(position)
+            operations.append(('UPD', label, oldLabels[position]))
+        else:
+            operations.append(('ADD', label, None))
+
+    if mode == 'replace':
+        for position, label in enumerate(oldLabels):
+            if position not in used:
+                operations.append(('DEL', label, None))
+
+    return operations
+
+
+def _first_unused(positions: list, used: set) -> Union[int, None]:
+    """
+    Return first position from index, which is not used yet. Used positions are removed from index.
+
+    :param positions: list of positions from index (could be None)
+    :param used: set of used positions
+    :return: position or None
+    """
+    if not positions:
+        return None
+
+    while positions and positions[0] in used:
+        positions.pop(0)
+
+    return positions[0] if positions else None
+
+
+def operation_to_dict(operation: tuple) -> dict:
+    """
+    Convert operation from diff_labels to dictionary (for JSON plan)
+
+    :param operation: tuple (operationType, label, oldLabel)
+    :return: dictionary
+    """
+    operationType, label, oldLabel = operation
+    data = {'op': operationType, 'name': label.name, 'color': label.color}
+
+    if oldLabel is not None:
+        data['oldName'] = oldLabel.name
+        data['oldColor'] = oldLabel.color
+
+    return data
+
+
+def operation_from_dict(data: dict) -> tuple:
+    """
+    Convert dictionary from JSON plan back to operation
+
+    :param data: dictionary created by operation_to_dict
+    :return: tuple (operationType, label, oldLabel)
+    """
+    oldLabel = Label(data['oldName'], data['oldColor']) if 'oldName' in data else None
+
+    return data['op'], Label(data['name'], data['color']), oldLabel
+
+
+def load_plan(planFile):
+    """
+    Read plans from plan file (one JSON line per repository)
+
+    :param planFile: opened plan file
+    :return: generator of plans
+    """
+    for line in planFile:
+        if line.strip():
+            yield json.loads(line)
+
+
 def load_config(cfg: str) -> configparser.ConfigParser:
     """
     Load .cfg file and parse to Config object
@@ -424,54 +1209,192 @@ def get_list_repos(session: requests.Session) -> list:
     :param session: authenticated session
     :return: list of available repos
     """
-    reposList = []
-    page = 1
-    while True:
-        r = session.get('https://api.github.com/user/repos?per_page=100&page={}'.format(page))
-
-        validate_response(r)
-
-        repositories = r.json()
-        for repo in repositories:
-            reposList.append(repo['full_name'])
-
-        if len(repositories) == 100:
-            page += 1
-        else:
-            break
+    repositories = get_all_pages(session, API_URL + '/user/repos?per_page=100')
 
-    return reposList
+    return [repo['full_name'] for repo in repositories]
 
 
-def get_list_labels(session: requests.Session, repository: str, exitProgram: bool = True) -> Union[list, bool]:
+def get_list_labels(session: requests.Session, repository: str, exitProgram: bool = True,
+                    responses: list = None) -> Union[list, bool]:
     """
     Get list of labels in given repository
 
     :param session: authenticated session
     :param repository: target repository
     :param exitProgram: if False, program will not quit if repository not found, only return False
+    :param responses: if set, responses of all pages are appended to it
     :return: list of Labels / False
     """
-    labelsList = []
     userName, repoName = repository.split('/')
-    page = 1
-    while True:
-        r = session.get('https://api.github.com/repos/{}/{}/labels?per_page=100&page={}'.format(userName, repoName, page))
+    labelsJson = get_all_pages(session, API_URL + '/repos/{}/{}/labels?per_page=100'.format(userName, repoName),
+                               exitProgram, responses)
+
+    if labelsJson is False:
+        return False
+
+    return [Label(one['name'], one['color']) for one in labelsJson]
+
+
+def get_all_pages(session: requests.Session, url: str, exitProgram: bool = True,
+                  responses: list = None) -> Union[list, bool]:
+    """
+    Get all items of paginated list
+    First page is loaded and last page is read from Link header,
+    all other pages are loaded in parallel and merged in order.
+    Response without Link header is the only page (GitHub omits Link header for one page)
+
+    :param session: authenticated session
+    :param url: url of list with per_page=100 (without page)
+    :param exitProgram: if False, program will not quit if response is not correct, only return False
+    :param responses: if set, responses of all pages are appended to it
+    :return: list of items / False
+    """
+    if responses is None:
+        responses = []
+
+    r = session.get('{}&page=1'.format(url))
+
+    if validate_response(r, exitProgram):
+        return False
 
-        exitStatus = validate_response(r, exitProgram)
+    responses.append(r)
+    items = list(r.json())
 
-        if exitStatus:
+    if 'Link' not in r.headers:
+        return items
+
+    lastPage = get_last_page(r)
+    if lastPage <= 1:
+        return items
+
+    pages = range(2, lastPage + 1)
+    pageResponses = list(get_page_executor().map(lambda p: session.get('{}&page={}'.format(url, p)), pages))
+
+    for r in pageResponses:
+        if validate_response(r, exitProgram):
             return False
 
-        labelsJson = r.json()
+        responses.append(r)
+        items.extend(r.json())
 
-        for one in labelsJson:
-            labelsList.append(Label(one['name'], one['color']))
+    return items
 
-        # Check, if there is 100 labels and we need try another page
-        if len(labelsJson) != 100:
-            break
-        else:
-            page += 1
 
-    return labelsList
+def get_page_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Return pool of threads loading pages, pool is created at first call
+    One pool is shared by all workers, so number of pages loaded in parallel is at most PAGE_JOBS
+
+    :return: executor
+    """
+    global _pageExecutor
+
+    with _pageExecutorLock:
+        if _pageExecutor is None:
+            _pageExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=PAGE_JOBS,
+                                                                  thread_name_prefix='labelord-page')
+
+    return _pageExecutor
+
+
+def get_last_page(response: requests.Response) -> int:
+    """
+    Read number of last page from Link header
+
+    :param response: response with Link header
+    :return: number of last page, 0 if there is no last page
+    """
+    last = response.links.get('last')
+    if last is None:
+        return 0
+
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(last['url']).query)
+
+    try:
+        return int(query['page'][0])
+    except (KeyError, ValueError):
+        return 0
+
+
+def get_labels_graphql(session: requests.Session, repositories: list, batchSize: int = GRAPHQL_BATCH) -> dict:
+    """
+    Get labels of many repositories by GraphQL api
+    Labels of batchSize repositories are loaded by one query (each repository has own alias),
+    repositories with more than 100 labels are loaded by next queries with cursor.
+    If whole query fails (errors without data, for example rate limit), repositories of batch are not
+    in result, so their labels are loaded by REST api.
+
+    :param session: authenticated session
+    :param repositories: list of repositories
+    :param batchSize: number of repositories in one query
+    :return: dictionary {repository: list of Labels / False if repository not found}
+    :raises SystemExit: if GraphQL api response is not correct
+    """
+    labels = {repository: [] for repository in repositories}
+    cursors = {repository: None for repository in repositories}
+
+    while cursors:
+        pending = list(cursors)
+        batches = [pending[i:i + batchSize] for i in range(0, len(pending), batchSize)]
+
+        for batch in batches:
+            query, variables = create_labels_query(batch, cursors)
+            r = session.post(API_URL + '/graphql', json={'query': query, 'variables': variables})
+
+            validate_response(r)
+
+            body = r.json()
+            data = body.get('data')
+
+            if data is None:
+                messages = '; '.join(error.get('message', '') for error in body.get('errors') or [])
+                sys.stderr.write('GraphQL query failed ({}), labels are loaded by REST api\n'.format(messages))
+                for repository in batch:
+                    del labels[repository]
+                    del cursors[repository]
+                continue
+
+            for position, repository in enumerate(batch):
+                repo = data.get('r{}'.format(position))
+
+                if repo is None:
+                    labels[repository] = False
+                    del cursors[repository]
+                    continue
+
+                for one in repo['labels']['nodes']:
+                    labels[repository].append(Label(one['name'], one['color']))
+
+                pageInfo = repo['labels']['pageInfo']
+                if pageInfo['hasNextPage']:
+                    cursors[repository] = pageInfo['endCursor']
+                else:
+                    del cursors[repository]
+
+    return labels
+
+
+def create_labels_query(repositories: list, cursors: dict) -> tuple:
+    """
+    Create GraphQL query for labels of repositories, each repository has alias r0, r1, ...
+
+    :param repositories: list of repositories
+    :param cursors: dictionary {repository: cursor of labels or None}
+    :return: tuple (query, variables)
+    """
+    parameters = []
+    fields = []
+    variables = {}
+
+    for position, repository in enumerate(repositories):
+        userName, repoName = repository.split('/')
+        parameters.append('$o{0}: String!, $n{0}: String!, $c{0}: String'.format(position))
+        fields.append('r{0}: repository(owner: $o{0}, name: $n{0}) {{ labels(first: 100, after: $c{0}) '
+                      '{{ nodes {{ name color }} pageInfo {{ hasNextPage endCursor }} }} }}'.format(position))
+        variables['o{}'.format(position)] = userName
+        variables['n{}'.format(position)] = repoName
+        variables['c{}'.format(position)] = cursors.get(repository)
+
+    query = 'query({}) {{ {} }}'.format(', '.join(parameters), ' '.join(fields))
+
+    return query, variables
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+import time
+
+from labelord import github
+
+
+# Results of jobs are written to journal after FLUSH_SIZE jobs or FLUSH_INTERVAL seconds
+FLUSH_SIZE = 20
+FLUSH_INTERVAL = 1.0
+
+
+class JobJournal:
+    """
+    Durable journal of webhook fan-out jobs stored in SQLite database.
+    Jobs are written before they are executed and removed when they are done,
+    so unfinished jobs could be resumed after restart of server.
+    Jobs failed by transient error (5xx, rate limit, connection error) are retried,
+    after maxAttempts they are moved to dead letter table. Other failed jobs are moved there immediately.
+    New jobs of one fan-out are written in one transaction.
+    Each job is owned by process, which created it, so more server processes could share one journal.
+
+    :ivar path: path to journal file
+    :vartype path: str
+    :ivar maxAttempts: maximal number of attempts of one job
+    :vartype maxAttempts: int
+    """
+
+
+    def __init__(self, path: str, maxAttempts: int = 3):
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self.connection:
+            for table in ('jobs', 'dead_letter'):
+                self.connection.execute('CREATE TABLE IF NOT EXISTS {} ('
+                                        'id INTEGER PRIMARY KEY, repo TEXT, op TEXT, name TEXT, color TEXT, '
+                                        'oldName TEXT, oldColor TEXT, attempts INTEGER, error TEXT, '
+                                        'created REAL, owner INTEGER)'.format(table))
+
+
+    def add_jobs(self, jobs: list) -> list:
+        """
+        Write jobs to journal
+
+        :param jobs: list of tuples (repository, operation), operation is tuple from github.diff_labels
+        :return: list of ids of jobs
+        """
+        now = time.time()
+        ids = []
+
+        with self.lock, self.connection:
+            for repository, operation in jobs:
+                data = github.operation_to_dict(operation)
+                cursor = self.connection.execute(
+                    'INSERT INTO jobs (repo, op, name, color, oldName, oldColor, attempts, error, created, owner) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0, NULL, ?, ?)',
+                    (repository, data['op'], data['name'], data['color'], data.get('oldName'), data.get('oldColor'),
+                     now, os.getpid()))
+                ids.append(cursor.lastrowid)
+
+        return ids
+
+
+    def finish(self, results: list) -> list:
+        """
+        Write results of jobs to journal
+        Done jobs are removed, failed jobs are kept for retry or moved to dead letter table
+        (permanent errors and jobs after maxAttempts)
+
+        :param results: list of tuples (id, error message or None)
+        :return: list of ids of failed jobs, which should be retried
+        """
+        retry = []
+
+        with self.lock, self.connection:
+            done = [(jobId,) for jobId, error in results if error is None]
+            self.connection.executemany('DELETE FROM jobs WHERE id = ?', done)
+
+            failed = [(error, jobId) for jobId, error in results if error is not None]
+            self.connection.executemany('UPDATE jobs SET attempts = attempts + 1, error = ? WHERE id = ?', failed)
+
+            for error, jobId in failed:
+                attempts = self.connection.execute('SELECT attempts FROM jobs WHERE id = ?', (jobId,)).fetchone()[0]
+
+                if attempts >= self.maxAttempts or not is_transient(error):
+                    self.connection.execute('INSERT INTO dead_letter SELECT * FROM jobs WHERE id = ?', (jobId,))
+                    self.connection.execute('DELETE FROM jobs WHERE id = ?', (jobId,))
+                else:
+                    retry.append(jobId)
+
+        return retry
+
+
+    def pending(self) -> list:
+        """
+        Return all unfinished jobs
+
+        :return: list of tuples (id, repository, operation)
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT id, repo, op, name, color, oldName, oldColor FROM jobs '
+                                           'ORDER BY id').fetchall()
+
+        return [(row[0], row[1], row_to_operation(row[2:])) for row in rows]
+
+
+    def claim_orphans(self) -> list:
+        """
+        Take over unfinished jobs of processes, which are not running (crashed or restarted server)
+        Jobs are read and claimed in one write transaction, so processes started together don't claim same jobs
+
+        :return: list of tuples (id, repository, operation)
+        """
+        pid = os.getpid()
+
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            rows = self.connection.execute('SELECT id, repo, op, name, color, oldName, oldColor, owner FROM jobs '
+                                           'ORDER BY id').fetchall()
+
+            orphans = [row for row in rows if row[7] == pid or not process_alive(row[7])]
+            self.connection.executemany('UPDATE jobs SET owner = ? WHERE id = ?', [(pid, row[0]) for row in orphans])
+
+        return [(row[0], row[1], row_to_operation(row[2:7])) for row in orphans]
+
+
+    def dead_letters(self) -> list:
+        """
+        Return all jobs from dead letter table
+
+        :return: list of tuples (id, repository, operation, error)
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT id, repo, op, name, color, oldName, oldColor, error '
+                                           'FROM dead_letter ORDER BY id').fetchall()
+
+        return [(row[0], row[1], row_to_operation(row[2:7]), row[7]) for row in rows]
+
+
+    def close(self) -> None:
+        """
+        Close database connection
+
+        :return: None
+        """
+        self.connection.close()
+
+
+class ResultBatch:
+    """
+    Results of running fan-out, they are written to journal in small batches,
+    so after crash only jobs of unwritten batch are applied again.
+    Results could be added from more threads.
+
+    :ivar journal: journal of jobs
+    :vartype journal: JobJournal
+    :ivar retry: ids of failed jobs, which should be retried
+    :vartype retry: list
+    """
+
+
+    def __init__(self, journal: JobJournal, size: int = FLUSH_SIZE, interval: float = FLUSH_INTERVAL,
+                 clock=time.monotonic):
+        self.journal = journal
+        self.size = size
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.results = []
+        self.retry = []
+        self.lastFlush = clock()
+
+
+    def add(self, jobId: int, error) -> None:
+        """
+        Add result of one job, batch is written to journal if it is big or old enough
+
+        :param jobId: id of job
+        :param error: error message or None
+        :return: None
+        """
+        with self.lock:
+            self.results.append((jobId, error))
+            if len(self.results) < self.size and self.clock() - self.lastFlush < self.interval:
+                return
+
+        self.flush()
+
+
+    def flush(self) -> None:
+        """
+        Write all added results to journal
+
+        :return: None
+        """
+        with self.lock:
+            results, self.results = self.results, []
+            self.lastFlush = self.clock()
+
+        if results:
+            retry = self.journal.finish(results)
+            with self.lock:
+                self.retry.extend(retry)
+
+
+def is_transient(error: str) -> bool:
+    """
+    Check if error of job is transient (5xx, rate limit, connection error), only such jobs are retried
+    Error is in format "status - message" or text of connection error
+
+    :param error: error message
+    :return: True if job should be retried
+    """
+    status, _, message = error.partition(' - ')
+
+    if not status.isdigit():
+        return True
+
+    status = int(status)
+    message = message.lower()
+
+    return status >= 500 or status == 429 or (status == 403 and ('rate limit' in message or 'abuse' in message))
+
+
+def row_to_operation(row: tuple) -> tuple:
+    """
+    Convert database row (op, name, color, oldName, oldColor) to operation
+
+    :param row: database row
+    :return: tuple (operationType, label, oldLabel)
+    """
+    data = {'op': row[0], 'name': row[1], 'color': row[2]}
+
+    if row[3] is not None:
+        data['oldName'] = row[3]
+        data['oldColor'] = row[4]
+
+    return github.operation_from_dict(data)
+
+
+def process_alive(pid: int) -> bool:
+    """
+    Check if process with pid is running on this machine
+
+    :param pid: process id
+    :return: True if process is running
+    """
+    if pid is None:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
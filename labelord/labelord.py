@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import functools
+import json
 import os
+import sys
 
 import click
-import requests
 
-from labelord import server, github
-from labelord.server import server as serverBlueprint
+from labelord import github, cache, output, profiling, ratelimit, syncstate
 
 
+# Initial limit of requests in flight of --adaptive
+ADAPTIVE_START = 4
+
 # allow_extra_args = False
 # allow_interspersed_args = False
 
@@ -18,33 +22,135 @@ from labelord.server import server as serverBlueprint
 @click.option('-c', '--config', envvar='LABELORD_CONFIG', default='config.cfg', type=click.Path(),
               help='Specify path to config file.')
 @click.option('-t', '--token', envvar='GITHUB_TOKEN', type=str, help='Token for GitHub API.')
+@click.option('--cache', 'cachePath', envvar='LABELORD_CACHE', type=click.Path(), default=cache.default_cache_path,
+              help='Path to cache of GitHub responses.')
+@click.option('--no-cache', 'noCache', is_flag=True, help='Do not use cache of GitHub responses.')
+@click.option('--max-rate', 'maxRate', type=float,
+              help='Maximal number of requests to GitHub API per second.')
+@click.option('--pool-size', 'poolSize', default=github.DEFAULT_POOL_SIZE, type=click.IntRange(1, None),
+              help='Maximal number of kept connections to GitHub API.')
+@click.option('--connect-timeout', 'connectTimeout', default=github.DEFAULT_TIMEOUT[0], type=float,
+              help='Timeout of connection to GitHub API in seconds.')
+@click.option('--timeout', 'readTimeout', default=github.DEFAULT_TIMEOUT[1], type=float,
+              help='Timeout of GitHub API response in seconds.')
+@click.option('--profile', 'profile', is_flag=True, help='Print time of phases of command to stderr.')
+@click.option('--profile-output', 'profileOutput', type=click.Path(dir_okay=False, writable=True),
+              help='Write profile of command to file (implies --profile).')
+@click.option('--profile-format', 'profileFormat', type=click.Choice(['pstats', 'collapsed']), default='pstats',
+              help='Format of profile file: pstats (cProfile of main thread only, use collapsed with -j) '
+                   'or collapsed stacks of all threads (flamegraph).')
 @click.version_option('labelord, version 0.3')
 @click.pass_context
-def cli(ctx, config, token):
+def cli(ctx, config, token, cachePath, noCache, maxRate, poolSize, connectTimeout, readTimeout, profile,
+        profileOutput, profileFormat):
     """
     Main program group of click
 
     :param ctx: context for object passing
     :param config: path to config file, default config.cfg
     :param token: GITHUB token
+    :param cachePath: path to cache of responses
+    :param noCache: flag for disable cache
+    :param maxRate: maximal number of requests per second
+    :param poolSize: maximal number of kept connections
+    :param connectTimeout: timeout of connection
+    :param readTimeout: timeout of response
+    :param profile: flag for time of phases
+    :param profileOutput: path to profile file
+    :param profileFormat: format of profile file
     :return: None
     """
+    if profile or profileOutput:
+        profiler = profiling.Profiler(profileOutput, profileFormat)
+        profiler.start()
+        ctx.call_on_close(functools.partial(finish_profile, profiler))
+
     # Create session
 
-    session = ctx.obj.get('session', requests.Session())
-    session.headers = {'User-Agent': 'Python'}
+    session = ctx.obj.get('session', None)
+
+    if session is None:
+        responseCache = None if noCache else cache.ResponseCache(cachePath)
+        if responseCache is not None:
+            ctx.call_on_close(responseCache.close)
+
+        session = github.create_session(cache=responseCache,
+                                        rateLimiter=ratelimit.RateLimiter(maxRate),
+                                        poolSize=poolSize,
+                                        timeout=(connectTimeout, readTimeout))
+    else:
+        session.headers = {'User-Agent': 'Python'}
 
     ctx.obj['session'] = session
     ctx.obj['token'] = token
     ctx.obj['config'] = config
 
 
+def finish_profile(profiler: profiling.Profiler) -> None:
+    """
+    Stop profiler and print time of phases to stderr
+
+    :param profiler: running profiler
+    :return: None
+    """
+    profiler.stop()
+    sys.stderr.write(profiler.report())
+
+    if profiler.output:
+        sys.stderr.write('Profile has been written to {}\n'.format(profiler.output))
+
+
+class ShardParamType(click.ParamType):
+    """
+    Type of --shard parameter in format i/N (shard i of N, from 1)
+    """
+
+    name = 'i/N'
+
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+
+        try:
+            index, count = (int(part) for part in value.split('/'))
+        except ValueError:
+            self.fail('{} is not in format i/N'.format(value), param, ctx)
+
+        if not 1 <= index <= count:
+            self.fail('shard {} must be between 1 and {}'.format(index, count), param, ctx)
+
+        return index, count
+
+
+SHARD = ShardParamType()
+
+
+def create_writer(ctx, outputFormat: str):
+    """
+    Create writer of JSON lines for jsonl output, writer is flushed when command ends
+
+    :param ctx: context
+    :param outputFormat: text / jsonl
+    :return: writer or None for text output
+    """
+    if outputFormat != 'jsonl':
+        return None
+
+    writer = output.JsonLinesWriter()
+    ctx.call_on_close(writer.flush)
+    return writer
+
+
 @cli.command()
+@click.option('-o', '--output', 'outputFormat', type=click.Choice(['text', 'jsonl']), default='text',
+              help='Format of output, jsonl is one JSON object per line')
 @click.pass_context
-def list_repos(ctx):
+def list_repos(ctx, outputFormat):
     """
     Command for repositories list
     :param ctx: context
+    :param outputFormat: text / jsonl
     :return: None
     """
 
@@ -60,19 +166,26 @@ def list_repos(ctx):
     session.auth = auth
 
     repositories = github.get_list_repos(session)
+    writer = create_writer(ctx, outputFormat)
 
     for repo in repositories:
-        print(repo)
+        if writer is not None:
+            writer.write({'repo': repo})
+        else:
+            print(repo)
 
 
 @cli.command()
+@click.option('-o', '--output', 'outputFormat', type=click.Choice(['text', 'jsonl']), default='text',
+              help='Format of output, jsonl is one JSON object per line')
 @click.pass_context
 @click.argument('repository', nargs=1)
-def list_labels(ctx, repository):
+def list_labels(ctx, repository, outputFormat):
     """
     List of labels from repository
     :param ctx: context
     :param repository: name if repository
+    :param outputFormat: text / jsonl
     :return: None
     """
     session = ctx.obj['session']
@@ -87,9 +200,13 @@ def list_labels(ctx, repository):
     session.auth = auth
 
     labels = github.get_list_labels(session, repository)
+    writer = create_writer(ctx, outputFormat)
 
     for label in labels:
-        print('#{} {}'.format(label.color, label.name))
+        if writer is not None:
+            writer.write({'repo': repository, 'label': label.name, 'color': label.color})
+        else:
+            print('#{} {}'.format(label.color, label.name))
 
 
 @cli.command()
@@ -98,9 +215,25 @@ def list_labels(ctx, repository):
 @click.option('-q', '--quiet', 'quiet', is_flag=True, help='Quit print, no output to console')
 @click.option('-v', '--verbose', 'verbose', is_flag=True, help='Debug info to console')
 @click.option('-d', '--dry-run', 'dryRun', is_flag=True, help='Run only testing instation, no changes at repos')
+@click.option('-j', '--jobs', 'jobs', default=1, type=click.IntRange(1, None),
+              help='Number of repositories updated in parallel')
+@click.option('--async', 'useAsync', is_flag=True, help='Send all label operations concurrently on one event loop')
+@click.option('--graphql', 'graphql', is_flag=True, help='Load labels of target repositories in batches by GraphQL')
+@click.option('--incremental', 'incremental', is_flag=True,
+              help='Skip repositories, which were not changed since last synchronization')
+@click.option('--state', 'statePath', envvar='LABELORD_STATE', type=click.Path(dir_okay=False),
+              default=syncstate.default_state_path, help='Path to state of incremental run.')
+@click.option('-o', '--output', 'outputFormat', type=click.Choice(['text', 'jsonl']), default='text',
+              help='Format of output, jsonl is one JSON object per operation')
+@click.option('--shard', 'shard', type=SHARD, help='Update only shard i of N of target repositories')
+@click.option('--checkpoint', 'checkpointPath', type=click.Path(dir_okay=False),
+              help='Record completed repositories to file and skip them when interrupted run is restarted')
+@click.option('--adaptive', 'adaptive', is_flag=True,
+              help='Adapt number of requests in flight to latency and errors of GitHub API, up to --jobs')
 @click.argument('mode', nargs=1, type=click.Choice(['update', 'replace']))
 @click.pass_context
-def run(ctx, sourceRepository, allRepos, mode, quiet, verbose, dryRun):
+def run(ctx, sourceRepository, allRepos, mode, quiet, verbose, dryRun, jobs, useAsync, graphql, incremental,
+        statePath, outputFormat, shard, checkpointPath, adaptive):
     """
      Main program for copy labels and update labels
     :param ctx: context
@@ -110,15 +243,37 @@ def run(ctx, sourceRepository, allRepos, mode, quiet, verbose, dryRun):
     :param quiet: flag for quit mode
     :param verbose: flag for verbose mode
     :param dryRun: flag for dryRun mode
+    :param jobs: number of repositories updated in parallel (requests in flight for async)
+    :param useAsync: flag for asynchronous client
+    :param graphql: flag for loading labels by GraphQL
+    :param incremental: flag for incremental run
+    :param statePath: path to state of incremental run
+    :param outputFormat: text / jsonl
+    :param shard: tuple (index, count) of shard or None
+    :param checkpointPath: path to checkpoint file or None
+    :param adaptive: flag for adaptive limit of requests in flight
     :return: None
     """
+    if useAsync and graphql:
+        raise click.UsageError('--async could not be used with --graphql')
+    if incremental and (useAsync or graphql):
+        raise click.UsageError('--incremental could not be used with --async or --graphql')
+    if checkpointPath and (useAsync or dryRun):
+        raise click.UsageError('--checkpoint could not be used with --async or --dry-run')
+    if adaptive and useAsync:
+        raise click.UsageError('--adaptive could not be used with --async')
+
     session = ctx.obj['session']
     runConfig = {
         'allRepos': allRepos,
         'mode'    : mode,
         'quiet'   : quiet,
         'verbose' : verbose,
-        'dryRun'  : dryRun
+        'dryRun'  : dryRun,
+        'jobs'    : jobs,
+        'graphql' : graphql,
+        'shard'   : shard,
+        'checkpoint': checkpointPath
     }
 
     # Load config
@@ -129,7 +284,28 @@ def run(ctx, sourceRepository, allRepos, mode, quiet, verbose, dryRun):
     auth = github.MyAuth(token)
     session.auth = auth
 
-    lu = github.LabelUpdater(session, config, runConfig)
+    # Keep connection for every worker and for shared pool of page loaders
+    if isinstance(session, github.GitHubSession):
+        session.ensure_pool_size(jobs + github.PAGE_JOBS)
+
+    # Limit of requests in flight starts low and grows up to number of workers
+    if adaptive and isinstance(session, github.GitHubSession):
+        session.concurrency = ratelimit.ConcurrencyLimiter(jobs, min(jobs, ADAPTIVE_START))
+        runConfig['concurrency'] = session.concurrency
+
+    if incremental:
+        runConfig['state'] = syncstate.SyncState(statePath)
+
+    runConfig['writer'] = create_writer(ctx, outputFormat)
+
+    if useAsync:
+        from labelord import aiogithub
+
+        runConfig['token'] = token
+        runConfig['jobs'] = jobs if jobs > 1 else None
+        lu = aiogithub.AsyncLabelUpdater(session, config, runConfig)
+    else:
+        lu = github.LabelUpdater(session, config, runConfig)
 
     sourceLabels = lu.get_source_labels(sourceRepository)
 
@@ -138,6 +314,128 @@ def run(ctx, sourceRepository, allRepos, mode, quiet, verbose, dryRun):
     lu.update_labels(sourceLabels, targetRepositories)
 
 
+@cli.command()
+@click.option('-t', '--template-repo', 'sourceRepository', help='Source repository for labels')
+@click.option('-a', '--all-repos', 'allRepos', is_flag=True, help='Use all available repository')
+@click.option('-q', '--quiet', 'quiet', is_flag=True, help='Quit print, no output to console')
+@click.option('-v', '--verbose', 'verbose', is_flag=True, help='Debug info to console')
+@click.option('-j', '--jobs', 'jobs', default=1, type=click.IntRange(1, None),
+              help='Number of repositories loaded in parallel')
+@click.option('--graphql', 'graphql', is_flag=True, help='Load labels of target repositories in batches by GraphQL')
+@click.option('--shard', 'shard', type=SHARD, help='Plan only shard i of N of target repositories')
+@click.argument('mode', nargs=1, type=click.Choice(['update', 'replace']))
+@click.argument('planfile', nargs=1, type=click.File('w'))
+@click.pass_context
+def plan(ctx, sourceRepository, allRepos, mode, planfile, quiet, verbose, jobs, graphql, shard):
+    """
+    Compute changes of labels and write them to plan file, no changes at repos
+    :param ctx: context
+    :param sourceRepository: source repository for source labels
+    :param allRepos: flag if all repos should be planned
+    :param mode: mode -> update / replace
+    :param planfile: file for plan (JSON line per repository)
+    :param quiet: flag for quit mode
+    :param verbose: flag for verbose mode
+    :param jobs: number of repositories loaded in parallel
+    :param graphql: flag for loading labels by GraphQL
+    :param shard: tuple (index, count) of shard or None
+    :return: None
+    """
+    session = ctx.obj['session']
+    runConfig = {
+        'allRepos': allRepos,
+        'mode'    : mode,
+        'quiet'   : quiet,
+        'verbose' : verbose,
+        'dryRun'  : True,
+        'jobs'    : jobs,
+        'graphql' : graphql,
+        'shard'   : shard
+    }
+
+    # Load config
+    config = github.load_config(ctx.obj['config'])
+    token = github.load_token(config, ctx.obj['token'])
+
+    # Set auth
+    auth = github.MyAuth(token)
+    session.auth = auth
+
+    # Keep connection for every worker and for shared pool of page loaders
+    if isinstance(session, github.GitHubSession):
+        session.ensure_pool_size(jobs + github.PAGE_JOBS)
+
+    lu = github.LabelUpdater(session, config, runConfig)
+
+    sourceLabels = lu.get_source_labels(sourceRepository)
+
+    targetRepositories = lu.get_target_repositories()
+
+    lu.plan_labels(sourceLabels, targetRepositories, planfile)
+
+
+@cli.command()
+@click.option('-q', '--quiet', 'quiet', is_flag=True, help='Quit print, no output to console')
+@click.option('-v', '--verbose', 'verbose', is_flag=True, help='Debug info to console')
+@click.option('-d', '--dry-run', 'dryRun', is_flag=True, help='Run only testing instation, no changes at repos')
+@click.option('-j', '--jobs', 'jobs', default=1, type=click.IntRange(1, None),
+              help='Number of repositories updated in parallel')
+@click.argument('planfile', nargs=1, type=click.File('r'))
+@click.pass_context
+def apply(ctx, planfile, quiet, verbose, dryRun, jobs):
+    """
+    Apply plan file created by plan command, labels are not loaded again
+    :param ctx: context
+    :param planfile: file with plan
+    :param quiet: flag for quit mode
+    :param verbose: flag for verbose mode
+    :param dryRun: flag for dryRun mode
+    :param jobs: number of repositories updated in parallel
+    :return: None
+    """
+    session = ctx.obj['session']
+    runConfig = {
+        'quiet'  : quiet,
+        'verbose': verbose,
+        'dryRun' : dryRun,
+        'jobs'   : jobs
+    }
+
+    # Load config
+    config = github.load_config(ctx.obj['config'])
+    token = github.load_token(config, ctx.obj['token'])
+
+    # Set auth
+    auth = github.MyAuth(token)
+    session.auth = auth
+
+    # Keep connection for every worker and for shared pool of page loaders
+    if isinstance(session, github.GitHubSession):
+        session.ensure_pool_size(jobs + github.PAGE_JOBS)
+
+    lu = github.LabelUpdater(session, config, runConfig)
+
+    lu.apply_plan(github.load_plan(planfile))
+
+
+@cli.command()
+@click.argument('outputs', nargs=-1, required=True, type=click.File('r'))
+def merge_summaries(outputs):
+    """
+    Merge summaries of sharded runs from their jsonl outputs
+    :param outputs: files with jsonl output of run
+    :return: None
+    """
+    summaries = [record for f in outputs for record in map(json.loads, filter(str.strip, f))
+                 if record.get('op') == 'SUMMARY']
+
+    summary = output.merge_summaries(summaries)
+    print(json.dumps(summary))
+
+    if summary['errors'] or summary['missingShards']:
+        quit(10)
+
+
 @cli.command()
 @click.option('-h', '--host', 'hostname', help='Host name for start server', default='127.0.0.1')
 @click.option('-p', '--port', 'port', help='Port for start server', default=5000, type=int)
@@ -164,8 +462,10 @@ def run_server(ctx, hostname, port, debug):
     auth = github.MyAuth(token)
     session.auth = auth
 
+    app = get_app()
     app.inject_session(session)
-    app.set_labelord_config(config)
+    app.inject_token(ctx.obj['token'])
+    app.set_labelord_config(config, ctx.obj['config'])
 
     app.run(hostname, port, debug)
 
@@ -173,22 +473,50 @@ def run_server(ctx, hostname, port, debug):
 def create_app():
     """
     Factory creator for flask App
+    Flask and server module are imported only here, so console commands start fast
     :return: app class
     """
+    from labelord import server
+
     app = server.LabelordWeb(__name__)
 
     configPath = os.getenv('LABELORD_CONFIG', 'config.cfg')
 
     labelordConfig = github.load_config(configPath)
 
-    app.labelordConfig = labelordConfig
+    app.set_labelord_config(labelordConfig, configPath)
+
+    app.register_blueprint(server.server)
+    app.jinja_env.filters['gitLink'] = server.convert_git_repo
 
     return app
 
 
-app = create_app()
-app.register_blueprint(serverBlueprint)
-app.jinja_env.filters['gitLink'] = server.convert_git_repo
+_app = None
+
+
+def get_app():
+    """
+    Return flask App, app is created at first call
+    :return: app class
+    """
+    global _app
+
+    if _app is None:
+        _app = create_app()
+
+    return _app
+
+
+def __getattr__(name):
+    """
+    Create ``app`` attribute lazily (for WSGI servers and old imports)
+    """
+    if name == 'app':
+        return get_app()
+
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
 
 if __name__ == '__main__':
     cli(obj={})
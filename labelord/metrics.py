@@ -0,0 +1,280 @@
+import bisect
+import math
+import threading
+
+
+# Default buckets of latency histograms (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    """
+    Base class of metrics, values are stored by tuple of label values
+    Recording is only one lock and dictionary update, so metrics are always on.
+
+    :ivar name: name of metric
+    :vartype name: str
+    :ivar documentation: help text of metric
+    :vartype documentation: str
+    :ivar labelNames: names of labels
+    :vartype labelNames: tuple
+    """
+
+    type = None
+
+
+    def __init__(self, name: str, documentation: str, labelNames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+    def samples(self) -> list:
+        """
+        Return samples of metric
+
+        :return: list of tuples (name, labels dictionary, value)
+        """
+        with self.lock:
+            values = list(self.values.items())
+
+        return [(self.name, dict(zip(self.labelNames, labels)), value) for labels, value in sorted(values)]
+
+
+    def clear(self) -> None:
+        """
+        Remove all values (for testing)
+
+        :return: None
+        """
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing counter
+    """
+
+    type = 'counter'
+
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        """
+        Increase counter
+
+        :param labels: tuple of label values
+        :param amount: increment
+        :return: None
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def get(self, labels: tuple = ()) -> float:
+        """
+        Return current value of counter
+
+        :param labels: tuple of label values
+        :return: value
+        """
+        return self.values.get(labels, 0)
+
+
+class Gauge(Metric):
+    """
+    Value which could go up and down, value could be also read by function at time of export
+    """
+
+    type = 'gauge'
+
+
+    def __init__(self, name: str, documentation: str, labelNames: tuple = ()):
+        super().__init__(name, documentation, labelNames)
+        self.function = None
+
+
+    def set(self, value: float, labels: tuple = ()) -> None:
+        """
+        Set value of gauge
+
+        :param value: new value
+        :param labels: tuple of label values
+        :return: None
+        """
+        with self.lock:
+            self.values[labels] = value
+
+
+    def set_function(self, function) -> None:
+        """
+        Read value of gauge (without labels) by function at time of export
+
+        :param function: function without arguments returning value
+        :return: None
+        """
+        self.function = function
+
+
+    def samples(self) -> list:
+        if self.function is not None:
+            return [(self.name, {}, self.function())]
+
+        return super().samples()
+
+
+class Histogram(Metric):
+    """
+    Histogram of observed values (latencies) with cumulative buckets
+
+    :ivar buckets: upper bounds of buckets
+    :vartype buckets: tuple
+    """
+
+    type = 'histogram'
+
+
+    def __init__(self, name: str, documentation: str, labelNames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        """
+        Record one observed value
+
+        :param value: observed value
+        :param labels: tuple of label values
+        :return: None
+        """
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[index] += 1
+            counts[-1] += value
+
+
+    def samples(self) -> list:
+        samples = []
+
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+
+        for labels, counts in sorted(values):
+            labelDict = dict(zip(self.labelNames, labels))
+            total = 0
+
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                samples.append((self.name + '_bucket', dict(labelDict, le=format_value(float(bound))), total))
+
+            samples.append((self.name + '_sum', labelDict, counts[-1]))
+            samples.append((self.name + '_count', labelDict, total))
+
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics exported in Prometheus text format
+    """
+
+
+    def __init__(self):
+        self.metrics = []
+
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add metric to registry
+
+        :param metric: metric
+        :return: same metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+
+    def expose(self) -> str:
+        """
+        Export all metrics in Prometheus text format (version 0.0.4)
+
+        :return: text of all metrics
+        """
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{' + ','.join('{}="{}"'.format(key, escape(str(labelValue)))
+                                           for key, labelValue in labels.items()) + '}'
+                lines.append('{} {}'.format(name, format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value: str) -> str:
+    """
+    Escape label value
+
+    :param value: label value
+    :return: escaped value
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    """
+    Format value of sample
+
+    :param value: value
+    :return: formatted value
+    """
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(value)
+
+        return repr(value)
+
+    return str(value)
+
+
+REGISTRY = Registry()
+
+WEBHOOK_EVENTS = REGISTRY.register(Counter(
+    'labelord_webhook_events_total', 'Received webhook events by event and result', ('event', 'result')))
+
+EVENT_SECONDS = REGISTRY.register(Histogram(
+    'labelord_event_processing_seconds', 'Time of processing of label event by background worker', ('action',)))
+
+FANOUT_SECONDS = REGISTRY.register(Histogram(
+    'labelord_fanout_seconds', 'Time of replication of one change to all target repositories'))
+
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'labelord_queue_depth', 'Number of label events waiting in job queue'))
+
+ECHO_SUPPRESSED = REGISTRY.register(Counter(
+    'labelord_echo_suppressed_total', 'Webhooks ignored as echo of own change'))
+
+GITHUB_REQUESTS = REGISTRY.register(Counter(
+    'labelord_github_requests_total', 'Requests to GitHub api by method and status', ('method', 'status')))
+
+GITHUB_SECONDS = REGISTRY.register(Histogram(
+    'labelord_github_request_seconds', 'Latency of requests to GitHub api', ('method',)))
+
+RATE_LIMIT_REMAINING = REGISTRY.register(Gauge(
+    'labelord_github_rate_limit_remaining', 'Remaining requests in GitHub rate limit window'))
+
+CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    'labelord_concurrency_limit', 'Current adaptive limit of requests to GitHub api in flight'))
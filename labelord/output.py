@@ -0,0 +1,116 @@
+import json
+import sys
+import threading
+
+
+# Size of buffered output, buffer is flushed when it is bigger (characters)
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class JsonLinesWriter:
+    """
+    Buffered writer of JSON lines (one JSON object per line), safe for use from more threads.
+    Records are serialized outside of lock, only appending to buffer is locked.
+
+    :ivar stream: output stream
+    :vartype stream: file
+    :ivar bufferSize: size of buffer in characters
+    :vartype bufferSize: int
+    """
+
+
+    def __init__(self, stream=None, bufferSize: int = DEFAULT_BUFFER_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.bufferSize = bufferSize
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.size = 0
+
+
+    def write(self, record: dict) -> None:
+        """
+        Write one record
+
+        :param record: JSON serializable dictionary
+        :return: None
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self.lock:
+            self.buffer.append(line)
+            self.size += len(line)
+
+            if self.size >= self.bufferSize:
+                self.flush_buffer()
+
+
+    def flush(self) -> None:
+        """
+        Write all buffered records to stream
+
+        :return: None
+        """
+        with self.lock:
+            self.flush_buffer()
+
+
+    def flush_buffer(self) -> None:
+        """
+        Write buffer to stream, lock must be held
+
+        :return: None
+        """
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+        self.stream.flush()
+
+
+def merge_summaries(summaries: list) -> dict:
+    """
+    Merge SUMMARY records of sharded runs to one summary
+    Numbers of repositories and errors are summed, missing shards are reported.
+    If some shard has more summaries (shard was run again), only the last one is used and shard is reported as duplicate
+
+    :param summaries: list of SUMMARY records
+    :return: merged SUMMARY record with list of shards, missing shards and duplicate shards
+    """
+    byShard = {}
+    duplicates = set()
+    unsharded = []
+    for summary in summaries:
+        shard = summary.get('shard')
+        if not shard:
+            unsharded.append(summary)
+            continue
+        if shard in byShard:
+            duplicates.add(shard)
+        byShard[shard] = summary
+
+    merged = unsharded + list(byShard.values())
+    repos = sum(summary.get('repos', 0) for summary in merged)
+    errors = sum(summary.get('errors', 0) for summary in merged)
+    shards = sorted(byShard, key=shard_key)
+
+    missing = []
+    counts = {int(shard.split('/')[1]) for shard in shards}
+    for count in counts:
+        missing.extend('{}/{}'.format(index, count) for index in range(1, count + 1)
+                       if '{}/{}'.format(index, count) not in shards)
+
+    return {'op': 'SUMMARY', 'result': 'ERR' if errors or missing else 'SUC',
+            'action': summaries[0].get('action') if summaries else None,
+            'repos': repos, 'errors': errors, 'shards': shards, 'missingShards': missing,
+            'duplicateShards': sorted(duplicates, key=shard_key)}
+
+
+def shard_key(shard: str) -> list:
+    """
+    Key for sorting of shards in form i/N
+
+    :param shard: shard
+    :return: sort key
+    """
+    return [int(part) for part in shard.split('/')]
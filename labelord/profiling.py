@@ -0,0 +1,208 @@
+import collections
+import cProfile
+import os
+import sys
+import threading
+import time
+
+
+# Interval of stack sampling (seconds)
+SAMPLE_INTERVAL = 0.005
+
+# Active profiler, phases are recorded only if it is set
+_active = None
+
+
+class Profiler:
+    """
+    Profiler of one labelord command.
+    Time of phases (listing repositories, loading labels, diff, writes) is always recorded,
+    optionally whole run is profiled by cProfile (pstats file) or by stack sampling of all threads
+    (collapsed stacks for flamegraph).
+
+    Time of phase is summed over all threads, with -j/--jobs it could be longer than wall time.
+    cProfile profiles only main thread, so with -j/--jobs work of workers is only in collapsed stacks.
+
+    :ivar output: path to profile file or None
+    :vartype output: str
+    :ivar outputFormat: pstats or collapsed
+    :vartype outputFormat: str
+    :ivar phases: time of phases (name -> [calls, seconds])
+    :vartype phases: OrderedDict
+    """
+
+
+    def __init__(self, output: str = None, outputFormat: str = 'pstats', interval: float = SAMPLE_INTERVAL):
+        self.output = output
+        self.outputFormat = outputFormat
+        self.interval = interval
+        self.phases = collections.OrderedDict()
+        self.stacks = collections.Counter()
+        self.lock = threading.Lock()
+        self.profile = None
+        self.sampler = None
+        self.stopped = threading.Event()
+        self.started = None
+        self.wallTime = None
+
+
+    def start(self) -> None:
+        """
+        Start profiling and make profiler active
+
+        :return: None
+        """
+        global _active
+
+        self.started = time.perf_counter()
+
+        if self.output and self.outputFormat == 'pstats':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.output:
+            self.sampler = threading.Thread(target=self.sample, name='labelord-profiler', daemon=True)
+            self.sampler.start()
+
+        _active = self
+
+
+    def stop(self) -> None:
+        """
+        Stop profiling and write profile file
+
+        :return: None
+        """
+        global _active
+
+        _active = None
+        self.wallTime = time.perf_counter() - self.started
+
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.output)
+
+        if self.sampler is not None:
+            self.stopped.set()
+            self.sampler.join()
+            self.write_collapsed(self.output)
+
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Add time of one phase
+
+        :param name: name of phase
+        :param seconds: duration
+        :return: None
+        """
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = [0, 0.0]
+
+            phase[0] += 1
+            phase[1] += seconds
+
+
+    def sample(self) -> None:
+        """
+        Sample stacks of all threads until profiler is stopped
+
+        :return: None
+        """
+        ownThread = threading.get_ident()
+
+        while not self.stopped.wait(self.interval):
+            for threadId, frame in sys._current_frames().items():
+                if threadId == ownThread:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+    def write_collapsed(self, path: str) -> None:
+        """
+        Write sampled stacks in collapsed format (one stack and count per line)
+
+        :param path: path to file
+        :return: None
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+    def report(self) -> str:
+        """
+        Create table with time of phases
+
+        :return: text of report
+        """
+        lines = ['{:<20} {:>8} {:>10} {:>7}'.format('phase', 'calls', 'seconds', 'wall %')]
+
+        for name, (calls, seconds) in self.phases.items():
+            share = 100 * seconds / self.wallTime if self.wallTime else 0
+            lines.append('{:<20} {:>8} {:>10.3f} {:>6.1f}%'.format(name, calls, seconds, share))
+
+        lines.append('{:<20} {:>8} {:>10.3f}'.format('total (wall)', '', self.wallTime or 0))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Phase:
+    """
+    Context manager measuring time of one phase
+    """
+
+    __slots__ = ('profiler', 'name', 'start')
+
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class NoPhase:
+    """
+    Context manager doing nothing, used if profiler is not active
+    """
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name: str):
+    """
+    Measure time of phase in active profiler, if there is no active profiler, nothing is measured
+
+    :param name: name of phase
+    :return: context manager
+    """
+    if _active is None:
+        return NO_PHASE
+
+    return Phase(_active, name)
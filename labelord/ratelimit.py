@@ -0,0 +1,303 @@
+import asyncio
+import threading
+import time
+from typing import Union
+
+from labelord import metrics
+
+
+class RateLimiter:
+    """
+    Scheduler of requests to GitHub api based on rate limit headers.
+
+    * requests are paced by token bucket (rate is maxRate or remaining budget / time to reset, if budget is low)
+    * if budget is exhausted, all requests wait to reset of rate limit
+    * secondary rate limit (403 / 429) is retried after Retry-After or with exponential backoff
+
+    :ivar maxRate: maximal number of requests per second (None for unlimited)
+    :vartype maxRate: float
+    :ivar burst: size of token bucket
+    :vartype burst: int
+    :ivar lowBudget: part of rate limit, under which requests are paced to reset time
+    :vartype lowBudget: float
+    :ivar remaining: last known remaining budget
+    :vartype remaining: int
+    :ivar reset: last known time of rate limit reset (unix time)
+    :vartype reset: float
+    """
+
+    BACKOFF = 60
+    MAX_BACKOFF = 900
+
+
+    def __init__(self, maxRate: float = None, burst: int = 10, lowBudget: float = 0.1, clock=time.time,
+                 sleep=time.sleep):
+        self.maxRate = maxRate
+        self.burst = burst
+        self.lowBudget = lowBudget
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+        self.tokens = burst
+        self.lastRefill = clock()
+        self.pausedUntil = 0
+        self.budgetRate = None
+        self.remaining = None
+        self.reset = None
+
+
+    def rate(self) -> Union[float, None]:
+        """
+        Current rate of requests per second
+
+        :return: rate or None if requests are not paced
+        """
+        rates = [rate for rate in (self.maxRate, self.budgetRate) if rate is not None]
+        return min(rates) if rates else None
+
+
+    def wait(self) -> None:
+        """
+        Block until next request could be send
+
+        :return: None
+        """
+        delay = self.reserve()
+
+        if delay > 0:
+            self.sleep(delay)
+
+
+    async def wait_async(self) -> None:
+        """
+        Wait until next request could be send, coroutine version of wait for asynchronous client
+
+        :return: None
+        """
+        delay = self.reserve()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+    def reserve(self) -> float:
+        """
+        Take token for next request
+
+        :return: time to wait before request is send (seconds)
+        """
+        with self.lock:
+            now = self.clock()
+            delay = max(0, self.pausedUntil - now)
+            rate = self.rate()
+
+            if rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * rate)
+                self.lastRefill = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    delay = max(delay, -self.tokens / rate)
+
+        return delay
+
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pause all requests for given time
+
+        :param seconds: time of pause
+        :return: None
+        """
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, self.clock() + seconds)
+
+
+    def update(self, response) -> None:
+        """
+        Update budget from rate limit headers of response
+
+        :param response: response from GitHub
+        :return: None
+        """
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers or 'X-RateLimit-Reset' not in headers:
+            return
+
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+            limit = int(headers.get('X-RateLimit-Limit', 5000))
+        except ValueError:
+            return
+
+        with self.lock:
+            now = self.clock()
+            self.remaining = remaining
+            self.reset = reset
+
+            if remaining <= 0:
+                self.pausedUntil = max(self.pausedUntil, reset + 1)
+                self.budgetRate = None
+            elif remaining < limit * self.lowBudget:
+                self.budgetRate = remaining / max(reset - now, 1)
+            else:
+                self.budgetRate = None
+
+
+    def retry_delay(self, response, attempt: int) -> Union[float, None]:
+        """
+        Return time to wait before request is retried, or None if request should not be retried
+
+        :param response: response from GitHub
+        :param attempt: number of previous attempts (from 0)
+        :return: delay in seconds or None
+        """
+        if response.status_code not in (403, 429):
+            return None
+
+        if 'Retry-After' in response.headers:
+            try:
+                return float(response.headers['Retry-After'])
+            except ValueError:
+                pass
+
+        if response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in response.headers:
+            return max(float(response.headers['X-RateLimit-Reset']) - self.clock(), 0) + 1
+
+        if response.status_code == 429 or is_secondary_limit(response):
+            return min(self.BACKOFF * 2 ** attempt, self.MAX_BACKOFF)
+
+        return None
+
+
+def is_secondary_limit(response) -> bool:
+    """
+    Check if response is 403 from secondary (abuse) rate limit
+
+    :param response: response from GitHub
+    :return: True if secondary limit
+    """
+    try:
+        message = response.json().get('message', '')
+    except (ValueError, AttributeError):
+        return False
+
+    return 'secondary rate limit' in message.lower() or 'abuse' in message.lower()
+
+
+class ConcurrencyLimiter:
+    """
+    Adaptive limit of requests in flight (AIMD - additive increase, multiplicative decrease).
+
+    * after every healthy response (latency is not much higher than baseline), limit grows by 1 / limit,
+      so it grows by one after one round of requests
+    * after throttling (403 secondary limit / 429), server error (5xx) or connection error, limit is multiplied
+      by backoff, only once for all requests which were sent before the decrease
+    * slow successful responses keep limit
+
+    Baseline is the lowest observed latency, which slowly follows higher latencies.
+
+    :ivar limit: current limit (float, number of requests in flight is its integer part)
+    :vartype limit: float
+    :ivar minLimit: minimal limit
+    :vartype minLimit: int
+    :ivar maxLimit: maximal limit
+    :vartype maxLimit: int
+    :ivar backoff: multiplier of limit after throttling or error
+    :vartype backoff: float
+    :ivar tolerance: response is healthy if its latency is lower than tolerance * baseline
+    :vartype tolerance: float
+    :ivar listener: function called with (limit, reason) when integer limit is changed, or None
+    :vartype listener: function
+    """
+
+    BASELINE_DRIFT = 0.01
+
+
+    def __init__(self, maxLimit: int, initial: int = None, minLimit: int = 1, backoff: float = 0.5,
+                 tolerance: float = 2.0, listener=None):
+        self.maxLimit = maxLimit
+        self.minLimit = minLimit
+        self.limit = float(min(initial or maxLimit, maxLimit))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.listener = listener
+        self.condition = threading.Condition()
+        self.inFlight = 0
+        self.epoch = 0
+        self.baseline = None
+
+        metrics.CONCURRENCY_LIMIT.set(int(self.limit))
+
+
+    def acquire(self) -> int:
+        """
+        Block until request could be send
+
+        :return: epoch of limit, it must be passed to release
+        """
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait()
+
+            self.inFlight += 1
+            return self.epoch
+
+
+    def release(self, epoch: int, latency: float, response=None) -> None:
+        """
+        Finish request and adjust limit by its result
+
+        :param epoch: epoch returned by acquire
+        :param latency: duration of request in seconds
+        :param response: response from GitHub or None if request failed
+        :return: None
+        """
+        reason = self.failure(response)
+
+        with self.condition:
+            self.inFlight -= 1
+            old = int(self.limit)
+
+            if reason is not None:
+                if epoch == self.epoch:
+                    self.epoch += 1
+                    self.limit = max(self.limit * self.backoff, self.minLimit)
+            else:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * self.BASELINE_DRIFT
+
+                if latency <= self.baseline * self.tolerance:
+                    reason = 'Healthy'
+                    self.limit = min(self.limit + 1 / self.limit, self.maxLimit)
+
+            new = int(self.limit)
+            self.condition.notify_all()
+
+        if new != old:
+            metrics.CONCURRENCY_LIMIT.set(new)
+            if self.listener is not None:
+                self.listener(new, reason)
+
+
+    @staticmethod
+    def failure(response) -> Union[str, None]:
+        """
+        Return reason of decrease of limit for response
+
+        :param response: response from GitHub or None if request failed
+        :return: reason or None if response is not a failure
+        """
+        if response is None:
+            return 'Connection error'
+
+        if response.status_code == 429 or (response.status_code == 403 and is_secondary_limit(response)):
+            return 'Throttled ({})'.format(response.status_code)
+
+        if response.status_code >= 500:
+            return 'Server error ({})'.format(response.status_code)
+
+        return None
@@ -1,18 +1,43 @@
+import atexit
+import collections
 import hashlib
 import hmac
+import json
 import os
+import queue
+import sqlite3
 import sys
+import threading
+import time
+import traceback
 import configparser
 
 import flask
 import jinja2
 import requests
 
-from labelord import github
+from labelord import github, cache, journal, metrics, ratelimit
 
 
 server = flask.Blueprint('server', __name__, template_folder='templates')
 
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_WORKERS = 1
+
+DEFAULT_ECHO_TTL = 60
+DEFAULT_ECHO_SIZE = 10000
+DEFAULT_DEBOUNCE = 0
+DEFAULT_SHUTDOWN_TIMEOUT = 30
+
+# Delay between retries of failed fan-out jobs (seconds, multiplied by attempt)
+RETRY_DELAY = 1
+
+# Webhook action caused by operation
+ECHO_ACTIONS = {'ADD': 'created', 'UPD': 'edited', 'DEL': 'deleted'}
+
+# Minimal time between checks of config file modification (seconds)
+CONFIG_CHECK_INTERVAL = 1
+
 
 class LabelordWeb(flask.Flask):
     """
@@ -24,11 +49,18 @@ class LabelordWeb(flask.Flask):
         super().__init__(*args, **kwargs)
 
         self.session = None
+        self.token = None
         self.labelordConfig = None
         self.repos = None
         self.secret = None
-        self.updatedRepos = []
-        self.lastAction = None
+        self.echoIndex = EchoIndex()
+        self.jobQueue = None
+        self.coalescer = None
+        self.journal = None
+        self.configSnapshot = None
+        self.configPath = None
+        self.configChecked = 0
+        self.invalidMtime = None
 
 
     def inject_session(self, session: requests.Session) -> None:
@@ -40,42 +72,701 @@ class LabelordWeb(flask.Flask):
         self.session = session
 
 
-    def set_labelord_config(self, config: configparser.ConfigParser) -> None:
+    def inject_token(self, token: str) -> None:
+        """
+        Inject token given at start of server (parameter or environment variable),
+        this token has priority over token in config file also after config reload
+        :param token: GitHub token
+        :return: None
+        """
+        self.token = token
+
+
+    def set_labelord_config(self, config: configparser.ConfigParser, configPath: str = None) -> None:
         """
         Setter for config (set ConfigParser object)
+        Config is compiled to ConfigSnapshot, if path is set, config file is watched for changes
 
         :param config: config object
+        :param configPath: path to config file
         :return: None
         """
+        mtime = None
+        if configPath is not None:
+            try:
+                mtime = os.stat(configPath).st_mtime
+            except OSError:
+                pass
+
+        # Parse all values before anything is changed, so invalid config doesn't change app
+        snapshot = create_snapshot(config, mtime)
+        echoTtl = config.getfloat('server', 'echo_ttl', fallback=DEFAULT_ECHO_TTL)
+        echoSize = config.getint('server', 'echo_size', fallback=DEFAULT_ECHO_SIZE)
+        maxAttempts = config.getint('server', 'max_attempts', fallback=3)
+
+        self.configSnapshot = snapshot
         self.labelordConfig = config
+        statePath = config.get('server', 'state', fallback=None)
+        if statePath and not isinstance(self.echoIndex, SharedEchoIndex):
+            self.echoIndex = SharedEchoIndex(statePath)
+
+        self.echoIndex.ttl = echoTtl
+        self.echoIndex.maxSize = echoSize
+
+        if self.journal is None and config.get('server', 'journal', fallback=None):
+            self.open_journal(config.get('server', 'journal'), maxAttempts)
+        self.configPath = configPath
+        self.configChecked = time.monotonic()
+
+
+    def open_journal(self, path: str, maxAttempts: int = 3) -> None:
+        """
+        Open journal of fan-out jobs, unfinished jobs from journal are put to job queue
+
+        :param path: path to journal file
+        :param maxAttempts: maximal number of attempts of one job
+        :return: None
+        """
+        self.journal = journal.JobJournal(path, maxAttempts)
+
+        pending = self.journal.claim_orphans()
+        if pending:
+            self.get_job_queue().put(resume_jobs, pending)
+
+
+    def get_session(self) -> requests.Session:
+        """
+        Return session, session is created from config at first call
+
+        :return: session
+        """
+        if self.session is None:
+            token = github.load_token(self.labelordConfig, self.token or '')
+
+            self.session = create_session(self.labelordConfig, token)
+
+        return self.session
+
+
+    def refresh_config(self) -> None:
+        """
+        Reload config, if config file was changed since last load
+        Modification time of config file is checked at most once per CONFIG_CHECK_INTERVAL seconds.
+        If new config is not valid, old config is still used and same file is not loaded again
+
+        :return: None
+        """
+        now = time.monotonic()
+        if self.configPath is None or now - self.configChecked < CONFIG_CHECK_INTERVAL:
+            return
+
+        self.configChecked = now
+
+        try:
+            mtime = os.stat(self.configPath).st_mtime
+        except OSError:
+            return
+
+        if mtime in (self.configSnapshot.mtime, self.invalidMtime):
+            return
+
+        try:
+            self.reload_config(self.configPath)
+        except (SystemExit, configparser.Error, ValueError) as e:
+            self.invalidMtime = mtime
+            reason = '' if isinstance(e, SystemExit) else ': {}'.format(e)
+            sys.stderr.write('Config file {} is not valid{}, old config is used\n'.format(self.configPath, reason))
+
+
+    def get_job_queue(self) -> 'WebhookQueue':
+        """
+        Return queue of webhook jobs, queue is created and started at first call
+        Size of queue and number of workers are loaded from server section of config
+
+        :return: queue of jobs
+        """
+        if self.jobQueue is None:
+            size = self.labelordConfig.getint('server', 'queue_size', fallback=DEFAULT_QUEUE_SIZE)
+            workers = self.labelordConfig.getint('server', 'workers', fallback=DEFAULT_WORKERS)
+
+            self.jobQueue = WebhookQueue(self, size, workers)
+            self.jobQueue.start()
+            metrics.QUEUE_DEPTH.set_function(self.jobQueue.queue.qsize)
+
+        return self.jobQueue
+
+
+    def get_coalescer(self) -> 'EventCoalescer':
+        """
+        Return coalescer of label events, it is created at first call
+        Debounce window is option debounce in server section of config (0 = disabled)
+
+        :return: coalescer
+        """
+        if self.coalescer is None:
+            window = self.labelordConfig.getfloat('server', 'debounce', fallback=DEFAULT_DEBOUNCE)
+            maxPending = self.labelordConfig.getint('server', 'queue_size', fallback=DEFAULT_QUEUE_SIZE)
+
+            self.coalescer = EventCoalescer(window, self.dispatch_event, maxPending)
+            atexit.register(self.shutdown)
+
+        return self.coalescer
+
+
+    def shutdown(self) -> None:
+        """
+        Dispatch all debounced events and wait until job queue is processed (at exit of server process)
+        Queue is waited at most shutdown_timeout seconds from server section of config.
+        Buffered time of use of cached responses is written at the end
+
+        :return: None
+        """
+        if self.coalescer is not None:
+            self.coalescer.flush_all()
+
+        if self.jobQueue is not None:
+            timeout = self.labelordConfig.getfloat('server', 'shutdown_timeout', fallback=DEFAULT_SHUTDOWN_TIMEOUT)
+            if not self.jobQueue.join(timeout):
+                sys.stderr.write('Job queue is not processed in {} seconds, {} job(s) are not finished\n'.format(
+                    timeout, self.jobQueue.queue.unfinished_tasks))
 
+        responseCache = getattr(self.session, 'cache', None)
+        if responseCache is not None:
+            responseCache.flush()
 
-    def reload_config(self) -> None:
+
+    def dispatch_event(self, js: dict) -> bool:
+        """
+        Put label event to job queue with correct handler
+
+        :param js: json request object
+        :return: True if event is accepted, False if queue is full
+        """
+        handlers = {'created': create_label_request, 'edited': edit_label_request, 'deleted': delete_label_request}
+
+        if js['action'] not in handlers:
+            return True
+
+        return self.get_job_queue().put(handlers[js['action']], js)
+
+
+    def reload_config(self, configPath: str = None) -> None:
         """
         Reload config from system variable.
         Look to system variable ``LABELORD_CONFIG`` for path to config file.
         Default is ``config.cfg``
         Reload whole authentication and all settings from config
+        New config is used only if it is valid
 
+        :param configPath: path to config file (system variable is not used)
         :return: None
         :raises SystemExit: if no webhook provided
         """
-        configPath = os.getenv('LABELORD_CONFIG', 'config.cfg')
-
-        self.labelordConfig = github.load_config(configPath)
-
-        token = github.load_token(self.labelordConfig, '')
+        if configPath is None:
+            configPath = os.getenv('LABELORD_CONFIG', 'config.cfg')
 
-        auth = github.MyAuth(token)
-        self.session.auth = auth
+        config = github.load_config(configPath)
 
-        labelUpdater = github.LabelUpdater(self.session, self.labelordConfig, {})
-        repos = labelUpdater.get_target_repositories()
+        token = github.load_token(config, self.token or '')
 
-        if self.labelordConfig.get('github', 'webhook_secret', fallback=None) is None:
+        if config.get('github', 'webhook_secret', fallback=None) is None:
             sys.stderr.write('No webhook secret has been provided\n')
             quit(8)
 
+        self.set_labelord_config(config, configPath)
+
+        if self.session is None:
+            self.session = create_session(config, token)
+        elif getattr(self.session.auth, 'token', None) != token:
+            self.session.auth = github.MyAuth(token)
+
+
+ConfigSnapshot = collections.namedtuple('ConfigSnapshot', ['config', 'repos', 'allowedRepos', 'mtime'])
+ConfigSnapshot.__doc__ = """
+Immutable compiled config of server, whole snapshot is replaced when config is reloaded
+
+* config -> config object
+* repos -> tuple of target repositories
+* allowedRepos -> frozenset of target repositories (for O(1) checks)
+* mtime -> modification time of config file or None
+"""
+
+
+def create_snapshot(config: configparser.ConfigParser, mtime: float = None) -> ConfigSnapshot:
+    """
+    Compile config to ConfigSnapshot
+
+    :param config: config object
+    :param mtime: modification time of config file
+    :return: snapshot
+    """
+    repos = []
+    if 'repos' in config:
+        for key in config['repos']:
+            if config['repos'].getboolean(key):
+                repos.append(key)
+
+    return ConfigSnapshot(config, tuple(repos), frozenset(repos), mtime)
+
+
+class EchoIndex:
+    """
+    Index of webhooks, which are expected as echo of our own changes in target repositories.
+    Key is (repository, action, label name, color), color is not used for deleted labels.
+    Expected echoes expire after ttl seconds, if index is bigger than maxSize, oldest are removed.
+
+    :ivar ttl: time to live of expected echo in seconds
+    :vartype ttl: float
+    :ivar maxSize: maximal number of expected echoes
+    :vartype maxSize: int
+    """
+
+
+    def __init__(self, ttl: float = 60, maxSize: int = 10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def make_key(repo: str, action: str, name: str, color: str) -> tuple:
+        """
+        Create key of echo
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: key
+        """
+        return repo, action, name, color.lower() if color and action != 'deleted' else None
+
+
+    def expect(self, repo: str, action: str, name: str, color: str) -> None:
+        """
+        Register expected echo
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: None
+        """
+        key = self.make_key(repo, action, name, color)
+
+        with self.lock:
+            now = self.clock()
+            self.purge(now)
+
+            count = self.entries.pop(key, (0, 0))[1]
+            self.entries[key] = (now + self.ttl, count + 1)
+
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+
+    def consume(self, repo: str, action: str, name: str, color: str) -> bool:
+        """
+        Check if webhook is expected echo, expected echo is removed
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: True if webhook is echo
+        """
+        key = self.make_key(repo, action, name, color)
+
+        with self.lock:
+            self.purge(self.clock())
+
+            if key not in self.entries:
+                return False
+
+            expiry, count = self.entries[key]
+            if count > 1:
+                self.entries[key] = (expiry, count - 1)
+            else:
+                del self.entries[key]
+
+        return True
+
+
+    def discard(self, repo: str, action: str, name: str, color: str) -> None:
+        """
+        Remove expected echo (for example, when change failed)
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: None
+        """
+        self.consume(repo, action, name, color)
+
+
+    def purge(self, now: float) -> None:
+        """
+        Remove expired echoes, entries are ordered by expiry time
+
+        :param now: current time
+        :return: None
+        """
+        while self.entries:
+            key, (expiry, count) = next(iter(self.entries.items()))
+            if expiry > now:
+                break
+            del self.entries[key]
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedEchoIndex:
+    """
+    Index of expected echoes stored in SQLite database (WAL mode), so all server processes share it.
+    Echo of change done by one process is suppressed even if webhook comes to another process.
+    Interface is same as EchoIndex.
+
+    :ivar path: path to database file
+    :vartype path: str
+    :ivar ttl: time to live of expected echo in seconds
+    :vartype ttl: float
+    :ivar maxSize: maximal number of expected echoes
+    :vartype maxSize: int
+    """
+
+
+    def __init__(self, path: str, ttl: float = 60, maxSize: int = 10000, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS echoes (id INTEGER PRIMARY KEY, key TEXT, expiry REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS echoes_key ON echoes (key)')
+
+
+    @staticmethod
+    def make_key(repo: str, action: str, name: str, color: str) -> str:
+        """
+        Create key of echo serialized for database
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: key
+        """
+        return json.dumps(EchoIndex.make_key(repo, action, name, color))
+
+
+    def expect(self, repo: str, action: str, name: str, color: str) -> None:
+        """
+        Remember expected echo of change done by server
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: None
+        """
+        now = self.clock()
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM echoes WHERE expiry <= ?', (now,))
+            self.connection.execute('INSERT INTO echoes (key, expiry) VALUES (?, ?)',
+                                    (self.make_key(repo, action, name, color), now + self.ttl))
+            self.connection.execute('DELETE FROM echoes WHERE id IN '
+                                    '(SELECT id FROM echoes ORDER BY id DESC LIMIT -1 OFFSET ?)', (self.maxSize,))
+
+
+    def consume(self, repo: str, action: str, name: str, color: str) -> bool:
+        """
+        Remove expected echo, if it is in index (in any process)
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: True if webhook is echo of own change
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute('DELETE FROM echoes WHERE id = '
+                                             '(SELECT id FROM echoes WHERE key = ? AND expiry > ? ORDER BY id LIMIT 1)',
+                                             (self.make_key(repo, action, name, color), self.clock()))
+
+        return cursor.rowcount > 0
+
+
+    def discard(self, repo: str, action: str, name: str, color: str) -> None:
+        """
+        Forget expected echo of change, which failed
+
+        :param repo: repository
+        :param action: action of webhook (created, edited, deleted)
+        :param name: name of label
+        :param color: color of label
+        :return: None
+        """
+        self.consume(repo, action, name, color)
+
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM echoes WHERE expiry > ?',
+                                           (self.clock(),)).fetchone()[0]
+
+
+class EventCoalescer:
+    """
+    Collapse label events of same label from one repository, which come in short window, to one net change.
+    For example created + edited is one created event with final color, created + deleted is nothing.
+    Net change is dispatched after window seconds from first event. If window is 0, events are dispatched immediately.
+
+    :ivar window: debounce window in seconds
+    :vartype window: float
+    :ivar dispatch: function, which accept json request object and return False if it is refused
+    :vartype dispatch: function
+    :ivar maxPending: maximal number of labels waiting for dispatch
+    :vartype maxPending: int
+    """
+
+
+    def __init__(self, window: float, dispatch, maxPending: int = 100):
+        self.window = window
+        self.dispatch = dispatch
+        self.maxPending = maxPending
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
+    def submit(self, js: dict) -> bool:
+        """
+        Add label event, event is merged with pending event of same label
+
+        :param js: json request object
+        :return: True if event is accepted, False if too many labels are waiting
+        """
+        if self.window <= 0:
+            return self.dispatch(js)
+
+        repo = js['repository']['full_name']
+        name, color = js['label']['name'], js['label']['color']
+        changes = js.get('changes') or {}
+        oldName = changes['name']['from'] if 'name' in changes else name
+        oldColor = changes['color']['from'] if 'color' in changes else color
+
+        with self.lock:
+            entry = self.pending.pop((repo, oldName if js['action'] == 'edited' else name), None)
+            # Other label is pending under new name (for example delete X and rename Y to X)
+            displaced = self.pending.pop((repo, name), None) if js['action'] != 'deleted' else None
+
+            if entry is None:
+                if len(self.pending) >= self.maxPending:
+                    return False
+
+                entry = {'repo': repo, 'old': None if js['action'] == 'created' else (oldName, oldColor)}
+                timer = threading.Timer(self.window, self.flush, args=(entry,))
+                timer.daemon = True
+                timer.start()
+
+            entry['new'] = None if js['action'] == 'deleted' else (name, color)
+            entry['key'] = (repo, name)
+            self.pending[entry['key']] = entry
+
+        # Displaced change must be replicated before new one, otherwise it would be lost
+        if displaced is not None:
+            self.dispatch_entry(displaced)
+
+        return True
+
+
+    def flush(self, entry: dict) -> None:
+        """
+        Dispatch net change of pending label
+
+        :param entry: pending entry
+        :return: None
+        """
+        with self.lock:
+            if self.pending.get(entry['key']) is not entry:
+                return
+            del self.pending[entry['key']]
+
+        self.dispatch_entry(entry)
+
+
+    def dispatch_entry(self, entry: dict) -> None:
+        """
+        Dispatch net change of entry, which is not pending anymore
+
+        :param entry: entry removed from pending
+        :return: None
+        """
+        js = net_change(entry['repo'], entry['old'], entry['new'])
+
+        if js is not None and not self.dispatch(js):
+            sys.stderr.write('Queue is full, event for label {} in {} is dropped\n'.format(js['label']['name'],
+                                                                                         entry['repo']))
+
+
+    def flush_all(self) -> None:
+        """
+        Dispatch all pending labels immediately
+
+        :return: None
+        """
+        with self.lock:
+            entries = list(self.pending.values())
+
+        for entry in entries:
+            self.flush(entry)
+
+
+def net_change(repo: str, old: tuple, new: tuple):
+    """
+    Create json request object of net change between old and new state of label
+
+    :param repo: source repository
+    :param old: (name, color) of label before first event or None if label did not exist
+    :param new: (name, color) of label after last event or None if label was deleted
+    :return: json request object or None if there is no change
+    """
+    if old is None and new is None:
+        return None
+
+    repository = {'full_name': repo}
+
+    if old is None:
+        return {'action': 'created', 'repository': repository, 'label': {'name': new[0], 'color': new[1]}}
+
+    if new is None:
+        return {'action': 'deleted', 'repository': repository, 'label': {'name': old[0], 'color': old[1]}}
+
+    changes = {}
+    if old[0] != new[0]:
+        changes['name'] = {'from': old[0]}
+    if old[1].lower() != new[1].lower():
+        changes['color'] = {'from': old[1]}
+
+    if not changes:
+        return None
+
+    return {'action': 'edited', 'repository': repository, 'label': {'name': new[0], 'color': new[1]},
+            'changes': changes}
+
+
+class WebhookQueue:
+    """
+    Bounded queue of webhook jobs, jobs are processed by background workers in app context
+
+    :ivar app: flask app
+    :vartype app: LabelordWeb
+    :ivar queue: queue of jobs (handler, js)
+    :vartype queue: queue.Queue
+    :ivar workersNum: number of background workers
+    :vartype workersNum: int
+    """
+
+
+    def __init__(self, app: flask.Flask, size: int = 100, workersNum: int = 1):
+        self.app = app
+        self.queue = queue.Queue(maxsize=size)
+        self.workersNum = workersNum
+        self.workers = []
+
+
+    def start(self) -> None:
+        """
+        Start background workers
+
+        :return: None
+        """
+        while len(self.workers) < self.workersNum:
+            worker = threading.Thread(target=self.work, name='labelord-worker-{}'.format(len(self.workers)),
+                                      daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def put(self, handler, js: dict) -> bool:
+        """
+        Put job to queue, if queue is full, job is refused
+
+        :param handler: function, which handle json request object
+        :param js: json request object
+        :return: True if job is accepted, False if queue is full
+        """
+        try:
+            self.queue.put_nowait((handler, js))
+        except queue.Full:
+            return False
+
+        return True
+
+
+    def work(self) -> None:
+        """
+        Process jobs from queue until program ends
+
+        :return: None
+        """
+        while True:
+            handler, js = self.queue.get()
+            start = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    handler(js)
+            except (Exception, SystemExit):
+                # Functions shared with console commands end by quit(), worker must survive it
+                traceback.print_exc()
+            finally:
+                action = js.get('action', 'unknown') if isinstance(js, dict) else 'resume'
+                metrics.EVENT_SECONDS.observe(time.perf_counter() - start, (action,))
+                self.queue.task_done()
+
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Block until all jobs are processed
+
+        :param timeout: maximal time of waiting in seconds (None for unlimited)
+        :return: True if all jobs are processed, False if timeout expired
+        """
+        if timeout is None:
+            self.queue.join()
+            return True
+
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+
+        return True
+
+
+@server.route('/metrics')
+def metrics_page() -> flask.Response:
+    """
+    Metrics of server in Prometheus text format
+
+    :return: response
+    """
+    return flask.Response(metrics.REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
 
 @server.route('/', methods=['GET', 'POST'])
 def index() -> str:
@@ -86,24 +777,34 @@ def index() -> str:
     :return:
     """
     myApp = flask.current_app
-    if myApp.session is None:
-        token = github.load_token(myApp.labelordConfig, '')
-
-        auth = github.MyAuth(token)
-        session = requests.Session()
-        session.headers = {'User-Agent': 'Python'}
-        session.auth = auth
-
-        myApp.session = session
+    myApp.refresh_config()
+    myApp.get_session()
 
     if flask.request.method == 'POST':
         return post_request()
     else:
-        session = myApp.session
+        return flask.render_template('index.html', repos=myApp.configSnapshot.repos)
+
 
-        labelUpdater = github.LabelUpdater(session, myApp.labelordConfig, {})
-        repos = labelUpdater.get_target_repositories()
-        return flask.render_template('index.html', repos=repos)
+def create_session(config: configparser.ConfigParser, token: str) -> github.GitHubSession:
+    """
+    Create session for server from github section of config
+    Options cache, pool_size, connect_timeout and timeout are optional
+
+    :param config: config object
+    :param token: GitHub token
+    :return: authenticated session
+    """
+    cachePath = config.get('github', 'cache', fallback=None)
+    poolSize = config.getint('github', 'pool_size', fallback=github.DEFAULT_POOL_SIZE)
+    timeout = (config.getfloat('github', 'connect_timeout', fallback=github.DEFAULT_TIMEOUT[0]),
+               config.getfloat('github', 'timeout', fallback=github.DEFAULT_TIMEOUT[1]))
+
+    return github.create_session(token,
+                                 cache=cache.ResponseCache(cachePath) if cachePath else None,
+                                 rateLimiter=ratelimit.RateLimiter(),
+                                 poolSize=poolSize,
+                                 timeout=timeout)
 
 
 # @server.template_filter('gitLink')
@@ -122,11 +823,14 @@ def post_request() -> str:
     This function handle all post requests to our page.
     Parse post request, control all authentication and call correct function from labelord
 
+    Label events are only validated and put to job queue, response is 202 Accepted.
+    If queue is full, response is 503.
+
     :return: str
-    :raises flaskAbort: if come request with bad header
+    :raises flaskAbort: if come request with bad header or queue is full
     """
     myApp = flask.current_app
-    cfg = myApp.labelordConfig
+    cfg = myApp.configSnapshot.config
 
     headers = flask.request.headers
 
@@ -134,41 +838,51 @@ def post_request() -> str:
 
     js = flask.request.get_json()
 
+    event = headers.get('X-GitHub-Event', 'unknown')
+
     # Validate header action
     if headers['X-GitHub-Event'] == 'ping':
+        metrics.WEBHOOK_EVENTS.inc((event, 'ping'))
         return 'Everything is OK'
 
     elif headers['X-Github-Event'] == 'label':
         pass
 
     else:
+        metrics.WEBHOOK_EVENTS.inc((event, 'invalid'))
         flask.abort(400)
 
     # Check signature
     if 'X-Hub-Signature' not in headers:
+        metrics.WEBHOOK_EVENTS.inc((event, 'unauthorized'))
         return flask.abort(401)
     shaSignature = headers['X-Hub-Signature'].replace('sha1=', '')
     correct = check_signature(rawData, cfg.get('github', 'webhook_secret'), shaSignature)
     if not correct:
+        metrics.WEBHOOK_EVENTS.inc((event, 'unauthorized'))
         return flask.abort(401)
 
     if not check_allowed_repo(js['repository']['full_name']):
+        metrics.WEBHOOK_EVENTS.inc((event, 'invalid'))
         return flask.abort(400)
 
-    if js['action'] != myApp.lastAction:
-        myApp.updatedRepos = []
-        myApp.lastAction = js['action']
-
-    if js['action'] == 'created':
-        create_label_request(js)
+    # Webhook caused by our own change
+    if myApp.echoIndex.consume(js['repository']['full_name'], js['action'], js['label']['name'],
+                               js['label']['color']):
+        metrics.WEBHOOK_EVENTS.inc((event, 'echo'))
+        metrics.ECHO_SUPPRESSED.inc()
+        return 'Echo of own change'
 
-    elif js['action'] == 'edited':
-        edit_label_request(js)
+    if js['action'] not in ('created', 'edited', 'deleted'):
+        metrics.WEBHOOK_EVENTS.inc((event, 'ignored'))
+        return 'Nothing is happend'
 
-    elif js['action'] == 'deleted':
-        delete_label_request(js)
+    if not myApp.get_coalescer().submit(js):
+        metrics.WEBHOOK_EVENTS.inc((event, 'refused'))
+        return flask.abort(503)
 
-    return 'Nothing is happend'
+    metrics.WEBHOOK_EVENTS.inc((event, 'accepted'))
+    return 'Accepted', 202
 
 
 def check_allowed_repo(repo: str) -> bool:
@@ -178,16 +892,18 @@ def check_allowed_repo(repo: str) -> bool:
     :param repo: repository string
     :return: True if allowed, False otherwise
     """
-    myApp = flask.current_app
-    session = myApp.session
+    return repo in flask.current_app.configSnapshot.allowedRepos
 
-    labelUpdater = github.LabelUpdater(session, myApp.labelordConfig, {})
-    repos = labelUpdater.get_target_repositories()
 
-    if repo in repos:
-        return True
-    else:
-        return False
+def fanout_config(config: configparser.ConfigParser) -> dict:
+    """
+    Create runConfig of LabelUpdater for webhook fan-out
+    Number of repositories updated in parallel is option jobs in server section of config
+
+    :param config: config object
+    :return: runConfig dictionary
+    """
+    return {'jobs': config.getint('server', 'jobs', fallback=1)}
 
 
 def edit_label_request(js):
@@ -196,15 +912,11 @@ def edit_label_request(js):
     :param js: json request object
     :return: None
     """
-    myApp = flask.current_app
+    myApp = flask.current_app._get_current_object()
     session = myApp.session
 
-    if js['repository']['full_name'] in myApp.updatedRepos:
-        myApp.updatedRepos.remove(js['repository']['full_name'])
-        return
-
-    labelUpdater = github.LabelUpdater(session, myApp.labelordConfig, {})
-    repos = labelUpdater.get_target_repositories()
+    snapshot = myApp.configSnapshot
+    labelUpdater = github.LabelUpdater(session, snapshot.config, fanout_config(snapshot.config))
 
     sourceRepo = js['repository']['full_name']
 
@@ -213,12 +925,9 @@ def edit_label_request(js):
     oldLabel = github.Label(js['changes']['name']['from'] if 'name' in js['changes'] else js['label']['name'],
                             js['changes']['color']['from'] if 'color' in js['changes'] else js['label']['color'])
 
-    if sourceRepo in repos:
-        repos.remove(sourceRepo)
+    repos = [repo for repo in snapshot.repos if repo != sourceRepo]
 
-    for repo in repos:
-        myApp.updatedRepos.append(repo)
-        labelUpdater.update_label(repo, newLabel, oldLabel)
+    fan_out(myApp, labelUpdater, [(repo, ('UPD', newLabel, oldLabel)) for repo in repos])
 
 
 def delete_label_request(js) -> None:
@@ -229,26 +938,19 @@ def delete_label_request(js) -> None:
     :param js: json request object
     :return: None
     """
-    myApp = flask.current_app
+    myApp = flask.current_app._get_current_object()
     session = myApp.session
 
-    if js['repository']['full_name'] in myApp.updatedRepos:
-        myApp.updatedRepos.remove(js['repository']['full_name'])
-        return
-
-    labelUpdater = github.LabelUpdater(session, myApp.labelordConfig, {})
-    repos = labelUpdater.get_target_repositories()
+    snapshot = myApp.configSnapshot
+    labelUpdater = github.LabelUpdater(session, snapshot.config, fanout_config(snapshot.config))
 
     sourceRepo = js['repository']['full_name']
 
     label = github.Label(js['label']['name'], js['label']['color'])
 
-    if sourceRepo in repos:
-        repos.remove(sourceRepo)
+    repos = [repo for repo in snapshot.repos if repo != sourceRepo]
 
-    for repo in repos:
-        myApp.updatedRepos.append(repo)
-        labelUpdater.remove_label(repo, label)
+    fan_out(myApp, labelUpdater, [(repo, ('DEL', label, None)) for repo in repos])
 
 
 def create_label_request(js) -> None:
@@ -259,26 +961,111 @@ def create_label_request(js) -> None:
     :param js: json request object
     :return: None
     """
-    myApp = flask.current_app
+    myApp = flask.current_app._get_current_object()
     session = myApp.session
 
-    if js['repository']['full_name'] in myApp.updatedRepos:
-        myApp.updatedRepos.remove(js['repository']['full_name'])
-        return
-
-    labelUpdater = github.LabelUpdater(session, myApp.labelordConfig, {})
-    repos = labelUpdater.get_target_repositories()
+    snapshot = myApp.configSnapshot
+    labelUpdater = github.LabelUpdater(session, snapshot.config, fanout_config(snapshot.config))
 
     sourceRepo = js['repository']['full_name']
 
     label = github.Label(js['label']['name'], js['label']['color'])
 
-    if sourceRepo in repos:
-        repos.remove(sourceRepo)
+    repos = [repo for repo in snapshot.repos if repo != sourceRepo]
+
+    fan_out(myApp, labelUpdater, [(repo, ('ADD', label, None)) for repo in repos])
+
+
+def resume_jobs(jobs: list) -> None:
+    """
+    Handle unfinished jobs from journal (after restart of server)
+
+    :param jobs: list of tuples (id, repository, operation) from JobJournal.pending
+    :return: None
+    """
+    myApp = flask.current_app._get_current_object()
+    session = myApp.get_session()
+
+    snapshot = myApp.configSnapshot
+    labelUpdater = github.LabelUpdater(session, snapshot.config, fanout_config(snapshot.config))
+
+    run_journaled(myApp, labelUpdater, [(jobId, (repo, operation)) for jobId, repo, operation in jobs])
+
+
+def fan_out(myApp: LabelordWeb, labelUpdater: github.LabelUpdater, jobs: list) -> None:
+    """
+    Apply operations to target repositories
+    If app has journal, jobs are written to journal before they are applied.
+    Workers of LabelUpdater have no app context, so app is passed explicitly.
+
+    :param myApp: app (not proxy of current app)
+    :param labelUpdater: LabelUpdater for target repositories
+    :param jobs: list of tuples (repository, operation)
+    :return: None
+    """
+    start = time.perf_counter()
+
+    if myApp.journal is None:
+        labelUpdater.run_parallel(lambda job: apply_job(myApp.echoIndex, labelUpdater, *job), jobs)
+    else:
+        ids = myApp.journal.add_jobs(jobs)
+        run_journaled(myApp, labelUpdater, list(zip(ids, jobs)))
+
+    metrics.FANOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def run_journaled(myApp: LabelordWeb, labelUpdater: github.LabelUpdater, jobs: list) -> None:
+    """
+    Apply journaled jobs, results are written to journal in small batches while jobs are running
+    Jobs failed by transient error are retried until journal move them to dead letter table
+
+    :param myApp: app (not proxy of current app)
+    :param labelUpdater: LabelUpdater for target repositories
+    :param jobs: list of tuples (id, (repository, operation))
+    :return: None
+    """
+    attempt = 0
+
+    while jobs:
+        if attempt:
+            time.sleep(RETRY_DELAY * attempt)
+
+        batch = journal.ResultBatch(myApp.journal)
+
+        labelUpdater.run_parallel(lambda job: batch.add(job[0], apply_job(myApp.echoIndex, labelUpdater, *job[1])),
+                                  jobs)
+        batch.flush()
+
+        retry = set(batch.retry)
+        jobs = [job for job in jobs if job[0] in retry]
+        attempt += 1
+
+
+def apply_job(echoIndex, labelUpdater: github.LabelUpdater, repo: str, operation: tuple):
+    """
+    Apply one operation to target repository, expected echo is registered before change
+    Called from workers of LabelUpdater, so it must not use current app
+
+    :param echoIndex: EchoIndex or SharedEchoIndex of app
+    :param labelUpdater: LabelUpdater for target repositories
+    :param repo: target repository
+    :param operation: tuple (operationType, label, oldLabel)
+    :return: error message or None
+    """
+    operationType, label, oldLabel = operation
+    action = ECHO_ACTIONS[operationType]
+
+    echoIndex.expect(repo, action, label.name, label.color)
+
+    try:
+        error = labelUpdater.apply_operation(repo, operation)
+    except requests.RequestException as e:
+        error = str(e)
+
+    if error is not None:
+        echoIndex.discard(repo, action, label.name, label.color)
 
-    for repo in repos:
-        # myApp.updatedRepos.append(repo)
-        labelUpdater.add_label(repo, label)
+    return error
 
 
 def check_signature(msg: str, secret: str, signature: str) -> bool:
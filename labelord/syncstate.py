@@ -0,0 +1,138 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Union
+
+
+RepositoryState = collections.namedtuple('RepositoryState', ['fingerprint', 'pages', 'synced', 'labels'])
+RepositoryState.__doc__ = """
+Last synchronized state of one repository
+
+* fingerprint -> fingerprint of template labels and mode
+* pages -> list of (url, ETag) of all pages of labels after synchronization
+* synced -> time of synchronization (unix time)
+* labels -> fingerprint of labels of repository after synchronization (label_set_fingerprint)
+"""
+
+
+def default_state_path() -> str:
+    """
+    Return path to state file of incremental run
+    Look to system variable ``LABELORD_STATE``, default is ``~/.cache/labelord/sync-state.sqlite``
+
+    :return: path to state file
+    """
+    return os.getenv('LABELORD_STATE', os.path.join(os.path.expanduser('~'), '.cache', 'labelord',
+                                                    'sync-state.sqlite'))
+
+
+def label_set_fingerprint(labels: list) -> str:
+    """
+    Create canonical fingerprint of set of labels, order of labels and case of colors are ignored
+    Two repositories with same fingerprint need same operations
+
+    :param labels: list of labels
+    :return: hexadecimal fingerprint
+    """
+    data = json.dumps(sorted((label.name, label.color.lower()) for label in labels), separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def template_fingerprint(labels: list, mode: str) -> str:
+    """
+    Create fingerprint of template labels and mode
+
+    :param labels: list of template labels
+    :param mode: update / replace
+    :return: hexadecimal fingerprint
+    """
+    return hashlib.sha256('{}:{}'.format(mode, label_set_fingerprint(labels)).encode()).hexdigest()
+
+
+class SyncState:
+    """
+    Store of last synchronized label state of repositories (SQLite database)
+    Repository is in sync if fingerprint of template is same (or its labels were same as current template)
+    and all pages of labels are not modified (conditional requests with stored ETags)
+
+    :ivar path: path to state file
+    :vartype path: str
+    """
+
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS repositories ('
+                                    'repo TEXT PRIMARY KEY, fingerprint TEXT, pages TEXT, synced REAL, labels TEXT)')
+
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(repositories)')]
+            if 'labels' not in columns:
+                self.connection.execute('ALTER TABLE repositories ADD COLUMN labels TEXT')
+
+
+    def get(self, repository: str) -> Union[RepositoryState, None]:
+        """
+        Return last state of repository
+
+        :param repository: repository
+        :return: state or None if repository was not synchronized
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT fingerprint, pages, synced, labels FROM repositories '
+                                          'WHERE repo = ?', (repository,)).fetchone()
+
+        if row is None:
+            return None
+
+        return RepositoryState(row[0], [tuple(page) for page in json.loads(row[1])], row[2], row[3])
+
+
+    def set(self, repository: str, fingerprint: str, pages: list, labels: str = None) -> None:
+        """
+        Store state of synchronized repository
+
+        :param repository: repository
+        :param fingerprint: fingerprint of template
+        :param pages: list of (url, ETag) of all pages of labels
+        :param labels: fingerprint of labels of repository
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO repositories (repo, fingerprint, pages, synced, labels) '
+                                    'VALUES (?, ?, ?, ?, ?)',
+                                    (repository, fingerprint, json.dumps(pages), time.time(), labels))
+
+
+    def delete(self, repository: str) -> None:
+        """
+        Forget state of repository
+
+        :param repository: repository
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM repositories WHERE repo = ?', (repository,))
+
+
+    def close(self) -> None:
+        """
+        Close database connection
+
+        :return: None
+        """
+        self.connection.close()
@@ -0,0 +1,6 @@
+"""
+Entry point for WSGI servers, e.g. ``gunicorn labelord.wsgi:app``
+"""
+from labelord.labelord import create_app
+
+app = create_app()
@@ -13,7 +13,9 @@ setup(
     license='GNU General Public License v3.0',
     url='https://github.com/Wilson194/MI-PYT-DU1/',
     packages=['labelord'],
+    python_requires='>=3.7',
     install_requires=['Flask', 'click>=6', 'jinja2', 'requests', 'click', 'configparser', 'pytest'],
+    extras_require={'async': ['aiohttp']},
     entry_points={
         'console_scripts': [
             'labelord = labelord.labelord:main',
@@ -23,8 +25,11 @@ setup(
         'Intended Audience :: Developers',
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: Libraries',
         'Natural Language :: English',
         'Operating System :: POSIX :: Linux',
@@ -5,6 +5,7 @@ from labelord.github import LabelUpdater
 from labelord.github import MyAuth
 import configparser
 import json
+from labelord import github
 
 ABS_PATH = os.path.abspath(os.path.dirname(__file__))
 CONFIGS_PATH = os.path.join(ABS_PATH, 'fixtures', 'configs')
@@ -52,6 +53,21 @@ def labelord_session(betamax_parametrized_session):
     return betamax_parametrized_session
 
 
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'fake_github(**kwargs): arguments of FakeGitHub for fake_github fixture')
+
+
+@pytest.fixture
+def fake_github(request, monkeypatch):
+    """Fake GitHub api started for one test, arguments of FakeGitHub are given by fake_github marker"""
+    from benchmarks.fake_github import FakeGitHub
+    marker = request.node.get_closest_marker('fake_github')
+    fake = FakeGitHub(**(marker.kwargs if marker is not None else {}))
+    monkeypatch.setattr(github, 'API_URL', fake.start())
+    yield fake
+    fake.stop()
+
+
 @pytest.fixture
 def utils():
     return Utils()
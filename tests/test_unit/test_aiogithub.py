@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+import flexmock
+from click.testing import CliRunner
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from labelord.github import Label
+from labelord.aiogithub import AsyncLabelUpdater
+from labelord import labelord
+from labelord.ratelimit import RateLimiter
+
+
+def create_fake_api(labels, throttled=(), slow=()):
+    """Fake GitHub api with labels stored in dictionary {repo: {name: color}}
+    First write to repositories in throttled is refused by secondary rate limit,
+    writes to repositories in slow are answered after one second"""
+    throttled = set(throttled)
+
+    async def list_labels(request):
+        repo = '{}/{}'.format(request.match_info['user'], request.match_info['repo'])
+        if repo not in labels:
+            return web.json_response({'message': 'Not Found'}, status=404)
+        items = [{'name': n, 'color': c} for n, c in labels[repo].items()]
+        # Page could be shorter than per_page, only Link header tells if there is next page
+        perPage = min(int(request.query.get('per_page', '30')), 50)
+        page = int(request.query.get('page', '1'))
+        headers = {}
+        if page * perPage < len(items):
+            headers['Link'] = '<{}?per_page={}&page={}>; rel="next"'.format(request.url.with_query(None), perPage,
+                                                                         page + 1)
+        return web.json_response(items[(page - 1) * perPage:page * perPage], headers=headers)
+
+    async def add_label(request):
+        repo = '{}/{}'.format(request.match_info['user'], request.match_info['repo'])
+        if repo in slow:
+            await asyncio.sleep(1)
+        if repo in throttled:
+            throttled.discard(repo)
+            return web.json_response({'message': 'You have exceeded a secondary rate limit'}, status=403,
+                                     headers={'Retry-After': '0'})
+        js = await request.json()
+        labels[repo][js['name']] = js['color']
+        return web.json_response(js, status=201)
+
+    async def update_label(request):
+        repo = '{}/{}'.format(request.match_info['user'], request.match_info['repo'])
+        js = await request.json()
+        del labels[repo][request.match_info['name']]
+        labels[repo][js['name']] = js['color']
+        return web.json_response(js)
+
+    async def remove_label(request):
+        repo = '{}/{}'.format(request.match_info['user'], request.match_info['repo'])
+        del labels[repo][request.match_info['name']]
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_get('/repos/{user}/{repo}/labels', list_labels)
+    app.router.add_post('/repos/{user}/{repo}/labels', add_label)
+    app.router.add_patch('/repos/{user}/{repo}/labels/{name}', update_label)
+    app.router.add_delete('/repos/{user}/{repo}/labels/{name}', remove_label)
+    return app
+
+
+def run_updater(labels, runConfig, newLabels, repos, throttled=(), rateLimiter=None, slow=(), timeout=None):
+    async def scenario():
+        server = TestServer(create_fake_api(labels, throttled, slow))
+        await server.start_server()
+        try:
+            runConfig['apiUrl'] = str(server.make_url('')).rstrip('/')
+            session = flexmock.flexmock(auth=flexmock.flexmock(token='token'), rateLimiter=rateLimiter, maxRetries=5,
+                                        timeout=timeout)
+            lu = AsyncLabelUpdater(session, None, runConfig)
+            await lu.update_labels_async(newLabels, repos)
+            return lu
+        finally:
+            await server.close()
+
+    return asyncio.run(scenario())
+
+
+def test_async_updater_replace_labels_in_all_repositories():
+    labels = {'Wilson194/repo{}'.format(i): {'bug': 'ee0701', 'Old': '000000', 'Dup': '111111'} for i in range(30)}
+
+    lu = run_updater(labels, {'mode': 'replace', 'jobs': 10},
+                     [Label('bug', 'ee0701'), Label('dup', '222222'), Label('new', 'ffffff')], list(labels))
+
+    assert lu.reposNum == 30
+    assert lu.errorNum == 0
+    for repoLabels in labels.values():
+        assert repoLabels == {'bug': 'ee0701', 'dup': '222222', 'new': 'ffffff'}
+
+
+def test_async_updater_count_missing_repository_as_error(capsys):
+    labels = {'Wilson194/exists': {}}
+
+    lu = run_updater(labels, {'mode': 'update', 'verbose': True}, [Label('new', 'ffffff')],
+                     ['Wilson194/exists', 'Wilson194/missing'])
+
+    out, err = capsys.readouterr()
+
+    assert lu.reposNum == 1
+    assert lu.errorNum == 1
+    assert '[LBL][ERR] Wilson194/missing; 404 - Not Found' in out
+    assert '[ADD][SUC] Wilson194/exists; new; ffffff' in out
+
+
+def test_async_updater_retry_throttled_writes_by_rate_limiter():
+    labels = {'Wilson194/repo{}'.format(i): {} for i in range(5)}
+    rateLimiter = RateLimiter()
+
+    lu = run_updater(labels, {'mode': 'update'}, [Label('new', 'ffffff')], list(labels),
+                     throttled=['Wilson194/repo1', 'Wilson194/repo3'], rateLimiter=rateLimiter)
+
+    assert lu.errorNum == 0
+    assert all(repoLabels == {'new': 'ffffff'} for repoLabels in labels.values())
+
+
+def test_async_updater_without_rate_limiter_count_throttled_writes_as_errors():
+    labels = {'Wilson194/repo{}'.format(i): {} for i in range(5)}
+
+    lu = run_updater(labels, {'mode': 'update'}, [Label('new', 'ffffff')], list(labels),
+                     throttled=['Wilson194/repo1'])
+
+    assert lu.errorNum == 1
+
+
+def test_async_updater_load_all_pages_of_labels():
+    oldLabels = {'old{}'.format(i): '000000' for i in range(250)}
+    labels = {'Wilson194/repo': dict(oldLabels)}
+
+    lu = run_updater(labels, {'mode': 'replace'}, [Label('new', 'ffffff')], list(labels))
+
+    assert lu.errorNum == 0
+    assert labels['Wilson194/repo'] == {'new': 'ffffff'}
+
+
+def test_async_updater_count_timeout_as_error_of_operation(capsys):
+    labels = {'Wilson194/slow': {}, 'Wilson194/fast': {}}
+
+    lu = run_updater(labels, {'mode': 'update', 'verbose': True}, [Label('new', 'ffffff')], list(labels),
+                     slow=['Wilson194/slow'], timeout=(1, 0.2))
+
+    out, err = capsys.readouterr()
+
+    assert lu.reposNum == 2
+    assert lu.errorNum == 1
+    assert '[ADD][ERR] Wilson194/slow; new; ffffff' in out
+    assert labels['Wilson194/fast'] == {'new': 'ffffff'}
+
+
+def test_async_with_graphql_is_refused():
+    result = CliRunner().invoke(labelord.cli, ['run', '-a', '--async', '--graphql', 'replace'], obj={})
+
+    assert result.exit_code == 2
+    assert '--async could not be used with --graphql' in result.output
@@ -0,0 +1,19 @@
+import configparser
+import pytest
+from labelord import github
+
+
+@pytest.mark.fake_github(repos=120, labels=10, drift=0.5)
+def test_fake_github_is_synchronized_by_label_updater(fake_github):
+    config = configparser.ConfigParser()
+    config['labels'] = dict(fake_github.template)
+    session = github.create_session('benchmark')
+    labelUpdater = github.LabelUpdater(session, config, {'allRepos': True, 'mode': 'replace', 'quiet': True,
+                                                         'jobs': 4})
+
+    repositories = labelUpdater.get_target_repositories()
+    labelUpdater.update_labels(labelUpdater.get_source_labels(None), repositories)
+
+    assert len(repositories) == 120
+    assert all(sorted(labels.items()) == fake_github.template for labels in fake_github.repositories.values())
+    assert fake_github.calls['DELETE'] > 0
@@ -0,0 +1,99 @@
+import json
+import requests
+from labelord import github
+from labelord.cache import ResponseCache
+
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+    """Adapter which answer 304 if request has correct If-None-Match header"""
+
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+        self.sent = []
+
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+
+        if request.headers.get('If-None-Match') == '"v1"':
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = json.dumps(self.body).encode()
+            response.headers['ETag'] = '"v1"'
+            response.headers['Content-Length'] = str(len(response._content))
+
+        return response
+
+
+    def close(self):
+        pass
+
+
+def create_session(tmpdir, body):
+    session = github.GitHubSession(ResponseCache(str(tmpdir.join('cache.sqlite'))))
+    session.auth = github.MyAuth('token')
+    adapter = FakeAdapter(body)
+    session.mount('https://', adapter)
+    return session, adapter
+
+
+def test_second_listing_is_served_from_cache(tmpdir):
+    session, adapter = create_session(tmpdir, [{'name': 'bug', 'color': 'ee0701'}])
+
+    first = github.get_list_labels(session, 'Wilson194/labelord')
+    second = github.get_list_labels(session, 'Wilson194/labelord')
+
+    assert first == second == [github.Label('bug', 'ee0701')]
+    assert 'If-None-Match' not in adapter.sent[0].headers
+    assert adapter.sent[1].headers['If-None-Match'] == '"v1"'
+
+
+def test_cache_is_keyed_by_token(tmpdir):
+    session, adapter = create_session(tmpdir, [])
+
+    github.get_list_repos(session)
+    session.auth = github.MyAuth('anotherToken')
+    github.get_list_repos(session)
+
+    assert 'If-None-Match' not in adapter.sent[1].headers
+
+
+def test_cache_evict_least_recently_used_responses(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('cache.sqlite')), maxSize=25)
+
+    cache.set('a', b'0123456789', {'ETag': 'a'})
+    cache.set('b', b'0123456789', {'ETag': 'b'})
+    assert cache.get('a').etag == 'a'
+
+    cache.set('c', b'0123456789', {'ETag': 'c'})
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_cache_hit_write_time_of_use_at_close(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = ResponseCache(path, maxSize=25)
+
+    cache.set('a', b'0123456789', {'ETag': 'a'})
+    cache.set('b', b'0123456789', {'ETag': 'b'})
+    changes = cache.connection.total_changes
+
+    assert cache.get('a').etag == 'a'
+    assert cache.connection.total_changes == changes
+
+    cache.close()
+    cache = ResponseCache(path, maxSize=25)
+    cache.set('c', b'0123456789', {'ETag': 'c'})
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
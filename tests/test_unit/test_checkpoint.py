@@ -0,0 +1,103 @@
+import json
+import pytest
+from click.testing import CliRunner
+from labelord import checkpoint, github, labelord, syncstate
+from benchmarks.run_benchmarks import write_config
+
+
+pytestmark = pytest.mark.fake_github(repos=10, labels=5, drift=0.5)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+def test_checkpoint_is_resumed_only_with_same_fingerprint(tmpdir):
+    path = str(tmpdir.join('run.checkpoint'))
+
+    cp = checkpoint.Checkpoint(path, 'abc')
+    cp.complete('org/a')
+    cp.complete('org/b')
+    cp.close()
+
+    cp = checkpoint.Checkpoint(path, 'abc')
+    assert cp.completed == {'org/a', 'org/b'}
+    assert cp.is_completed('org/a') and not cp.is_completed('org/c')
+    cp.close()
+
+    cp = checkpoint.Checkpoint(path, 'def')
+    assert cp.completed == set()
+    cp.close()
+
+    with open(path) as f:
+        assert [json.loads(line)['fingerprint'] for line in f] == ['def']
+
+
+def test_checkpoint_ignores_incomplete_last_line(tmpdir):
+    path = tmpdir.join('run.checkpoint')
+    path.write('{"fingerprint": "abc"}\n{"repo": "org/a"}\n{"repo": "or')
+
+    cp = checkpoint.Checkpoint(str(path), 'abc')
+    cp.complete('org/b')
+    cp.close()
+
+    assert checkpoint.Checkpoint(str(path), 'abc').completed == {'org/a', 'org/b'}
+
+
+def test_checkpoint_is_synced_in_batches(tmpdir, monkeypatch):
+    syncs = []
+    monkeypatch.setattr(checkpoint.os, 'fsync', syncs.append)
+    clock = FakeClock()
+
+    cp = checkpoint.Checkpoint(str(tmpdir.join('run.checkpoint')), 'abc', batchSize=3, interval=10, clock=clock)
+    assert len(syncs) == 1
+
+    for repo in ('org/a', 'org/b', 'org/c', 'org/d'):
+        cp.complete(repo)
+    assert len(syncs) == 2
+
+    clock.now = 11
+    cp.complete('org/e')
+    assert len(syncs) == 3
+
+    cp.complete('org/f')
+    cp.close()
+    assert len(syncs) == 4
+
+
+def test_run_skips_completed_repositories_and_removes_checkpoint(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    path = str(tmpdir.join('run.checkpoint'))
+    repositories = list(fake_github.repositories)
+    fingerprint = syncstate.template_fingerprint([github.Label(name, color) for name, color in fake_github.template],
+                                                 'replace')
+
+    cp = checkpoint.Checkpoint(path, fingerprint)
+    for repo in repositories[:4]:
+        cp.complete(repo)
+    cp.close()
+    skipped = {repo: dict(fake_github.repositories[repo]) for repo in repositories[:4]}
+
+    result = CliRunner().invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-v',
+                                               '--checkpoint', path, 'replace'], obj={})
+
+    assert result.exit_code == 0
+    assert result.stdout.count('; Completed') == 4
+    assert '[SUMMARY] 10 repo(s) updated successfully' in result.stdout
+    assert all(fake_github.repositories[repo] == labels for repo, labels in skipped.items())
+    assert all(sorted(fake_github.repositories[repo].items()) == fake_github.template
+               for repo in repositories[4:])
+    assert not tmpdir.join('run.checkpoint').exists()
+
+
+def test_checkpoint_with_dry_run_is_refused(tmpdir):
+    result = CliRunner().invoke(labelord.cli, ['run', '-a', '-d', '--checkpoint', str(tmpdir.join('cp')),
+                                               'replace'], obj={})
+
+    assert result.exit_code == 2
+    assert '--checkpoint could not be used' in result.output
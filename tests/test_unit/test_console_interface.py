@@ -7,3 +7,29 @@ def test_push_force():
     result = runner.invoke(labelord.list_repos, ['push', '--force'])
     # assert result.exit_code == 0
     # assert 'forced update' in result.output
+
+
+def test_cli_import_is_fast_and_does_not_import_flask():
+    import os
+    import subprocess
+    import sys
+
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import labelord.labelord\n'
+            'print(time.perf_counter() - start)\n'
+            'print(any(module in sys.modules for module in ("flask", "jinja2", "labelord.server")))\n')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root, universal_newlines=True)
+    importTime, flaskImported = output.split()
+
+    assert flaskImported == 'False'
+    assert float(importTime) < 2.0
+
+
+def test_app_is_created_lazily():
+    import labelord
+
+    assert labelord.app is labelord.app
+    assert 'server' in labelord.app.blueprints
@@ -85,3 +85,51 @@ def test_validate_response_that_return_correct_codes():
         github.validate_response(response=flexmock.flexmock(status_code=1000, ok=False, text='Dummy'))
 
     assert pytest_wrapped_404.value.code == 10
+
+
+def test_diff_labels_create_correct_operations():
+    old = [github.Label('bug', 'ff0000'), github.Label('Question', '00ff00'), github.Label('wontfix', 'ffffff'),
+           github.Label('old', '000000')]
+    new = [github.Label('bug', 'FF0000'), github.Label('question', '00FF00'), github.Label('wontfix', '111111'),
+           github.Label('new', '222222')]
+
+    operations = github.diff_labels(new, old, 'replace')
+
+    assert operations == [('UPD', new[1], old[1]),
+                          ('UPD', new[2], None),
+                          ('ADD', new[3], None),
+                          ('DEL', old[3], None)]
+
+    assert github.diff_labels(new, old, 'update') == operations[:-1]
+
+
+def test_diff_labels_prefer_exact_name_and_match_each_old_label_once():
+    old = [github.Label('BUG', 'ff0000'), github.Label('bug', 'ff0000')]
+    new = [github.Label('bug', 'ff0000'), github.Label('Bug', 'ff0000')]
+
+    operations = github.diff_labels(new, old, 'replace')
+
+    assert operations == [('UPD', new[1], old[0])]
+
+
+def test_create_session_configure_pool_headers_and_timeout():
+    import requests
+
+    session = github.create_session('token', poolSize=32, timeout=(3, 7))
+
+    adapter = session.get_adapter('https://api.github.com')
+
+    assert adapter._pool_maxsize == 32
+    assert 'gzip' in session.headers['Accept-Encoding']
+    assert session.auth.token == 'token'
+
+    sent = []
+    flexmock.flexmock(requests.Session).should_receive('request') \
+        .replace_with(lambda method, url, **kwargs: sent.append(kwargs['timeout']) or 'response')
+
+    assert session.get('https://api.github.com/user') == 'response'
+    assert session.get('https://api.github.com/user', timeout=1) == 'response'
+    assert sent == [(3, 7), 1]
+
+    session.ensure_pool_size(8)
+    assert session.get_adapter('https://api.github.com')._pool_maxsize == 32
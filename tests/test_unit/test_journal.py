@@ -0,0 +1,174 @@
+import configparser
+import flexmock
+import pytest
+import labelord.journal
+import labelord.server
+from labelord.github import Label, create_session
+from labelord.journal import JobJournal, ResultBatch, is_transient
+from labelord.server import EchoIndex, LabelordWeb, create_label_request, fan_out
+
+
+def test_journal_keep_unfinished_jobs_and_move_failed_to_dead_letter(tmpdir):
+    path = str(tmpdir.join('journal.sqlite'))
+    journal = JobJournal(path, maxAttempts=2)
+
+    operation = ('UPD', Label('bug', 'ff0000'), Label('Bug', '00ff00'))
+    ids = journal.add_jobs([('Wilson194/a', operation), ('Wilson194/b', operation), ('Wilson194/c', operation)])
+
+    assert journal.finish([(ids[0], None), (ids[1], '502 - Bad Gateway')]) == [ids[1]]
+    assert journal.finish([(ids[1], '502 - Bad Gateway')]) == []
+
+    journal.close()
+    journal = JobJournal(path)
+
+    pending = journal.pending()
+    assert [(jobId, repo) for jobId, repo, op in pending] == [(ids[2], 'Wilson194/c')]
+    assert pending[0][2] == operation
+
+    deadLetters = journal.dead_letters()
+    assert [(repo, error) for jobId, repo, op, error in deadLetters] == [('Wilson194/b', '502 - Bad Gateway')]
+
+
+@pytest.mark.parametrize(['error', 'transient'],
+                         [('500 - Server Error', True),
+                          ('429 - Too Many Requests', True),
+                          ('403 - You have exceeded a secondary rate limit', True),
+                          ('HTTPSConnectionPool(host=api.github.com): Read timed out.', True),
+                          ('403 - Must have admin rights to Repository.', False),
+                          ('404 - Not Found', False),
+                          ('422 - Validation Failed', False)])
+def test_only_transient_errors_are_retried(error, transient):
+    assert is_transient(error) == transient
+
+
+def test_permanent_error_move_job_to_dead_letter_immediately(tmpdir):
+    journal = JobJournal(str(tmpdir.join('journal.sqlite')), maxAttempts=3)
+    ids = journal.add_jobs([('Wilson194/a', ('ADD', Label('bug', 'ff0000'), None))])
+
+    assert journal.finish([(ids[0], '422 - Validation Failed')]) == []
+    assert journal.pending() == []
+    assert [error for jobId, repo, op, error in journal.dead_letters()] == ['422 - Validation Failed']
+
+
+def test_result_batch_write_done_jobs_in_small_batches(tmpdir):
+    journal = JobJournal(str(tmpdir.join('journal.sqlite')))
+    operation = ('ADD', Label('bug', 'ff0000'), None)
+    ids = journal.add_jobs([('Wilson194/{}'.format(i), operation) for i in range(5)])
+
+    batch = ResultBatch(journal, size=2, interval=60)
+    batch.add(ids[0], None)
+    assert len(journal.pending()) == 5
+
+    batch.add(ids[1], None)
+    batch.add(ids[2], '500 - Server Error')
+    assert len(journal.pending()) == 3
+
+    batch.flush()
+    assert [jobId for jobId, repo, op in journal.pending()] == ids[2:]
+    assert batch.retry == [ids[2]]
+
+
+def test_fan_out_retry_failed_jobs_from_journal(tmpdir, monkeypatch):
+    journal = JobJournal(str(tmpdir.join('journal.sqlite')), maxAttempts=3)
+    app = flexmock.flexmock(echoIndex=EchoIndex(), journal=journal)
+    monkeypatch.setattr(labelord.server, 'RETRY_DELAY', 0)
+
+    errors = {'Wilson194/a': [None], 'Wilson194/b': ['500 - Error', None], 'Wilson194/c': ['502 - Bad Gateway'] * 3,
+              'Wilson194/d': ['422 - Invalid']}
+    calls = []
+
+    def apply_operation(repo, operation):
+        calls.append(repo)
+        return errors[repo].pop(0)
+
+    labelUpdater = flexmock.flexmock(apply_operation=apply_operation,
+                                     run_parallel=lambda function, items: [function(item) for item in items])
+
+    fan_out(app, labelUpdater, [(repo, ('ADD', Label('bug', 'ff0000'), None)) for repo in sorted(errors)])
+
+    assert sorted(calls) == ['Wilson194/a', 'Wilson194/b', 'Wilson194/b'] + ['Wilson194/c'] * 3 + ['Wilson194/d']
+    assert journal.pending() == []
+    assert sorted(repo for jobId, repo, op, error in journal.dead_letters()) == ['Wilson194/c', 'Wilson194/d']
+    assert app.echoIndex.consume('Wilson194/b', 'created', 'bug', 'ff0000')
+    assert not app.echoIndex.consume('Wilson194/c', 'created', 'bug', 'ff0000')
+
+
+def test_journal_claim_only_jobs_of_dead_processes(tmpdir):
+    journal = JobJournal(str(tmpdir.join('journal.sqlite')))
+    operation = ('ADD', Label('bug', 'ff0000'), None)
+    ids = journal.add_jobs([('Wilson194/a', operation), ('Wilson194/b', operation), ('Wilson194/c', operation)])
+
+    flexmock.flexmock(labelord.journal).should_receive('process_alive').replace_with(lambda pid: pid == 1)
+    with journal.connection:
+        journal.connection.execute('UPDATE jobs SET owner = 1 WHERE id = ?', (ids[0],))
+        journal.connection.execute('UPDATE jobs SET owner = 999999 WHERE id = ?', (ids[1],))
+
+    assert [repo for jobId, repo, op in journal.claim_orphans()] == ['Wilson194/b', 'Wilson194/c']
+    assert len(journal.pending()) == 3
+
+
+@pytest.mark.fake_github(repos=5, labels=3, drift=0)
+def test_journaled_fan_out_with_more_jobs_in_real_app(tmpdir, fake_github):
+    repos = list(fake_github.repositories)
+
+    config = configparser.ConfigParser()
+    config.read_dict({'github': {'token': 'fake', 'webhook_secret': 'secret'},
+                      'repos': {repo: 'yes' for repo in repos},
+                      'server': {'jobs': '4', 'journal': str(tmpdir.join('journal.sqlite'))}})
+
+    app = LabelordWeb(__name__)
+    app.inject_session(create_session('fake'))
+    app.set_labelord_config(config)
+
+    js = {'action': 'created', 'label': {'name': 'new', 'color': 'ff0000'}, 'repository': {'full_name': repos[0]}}
+
+    with app.app_context():
+        create_label_request(js)
+
+    assert all(fake_github.repositories[repo]['new'] == 'ff0000' for repo in repos[1:])
+    assert app.journal.pending() == []
+    assert app.journal.dead_letters() == []
+
+
+def claim_in_process(path, barrier, results):
+    journal = JobJournal(path)
+    barrier.wait()
+    results.put([jobId for jobId, repo, op in journal.claim_orphans()])
+
+
+PROCESS_ALIVE = labelord.journal.process_alive
+
+
+def slow_process_alive(pid):
+    import time
+    time.sleep(0.005)
+    return PROCESS_ALIVE(pid)
+
+
+def test_processes_started_together_claim_each_orphan_once(tmpdir, monkeypatch):
+    import multiprocessing
+    import subprocess
+    import sys
+    # Slow check of owners makes window between read and claim of jobs wide
+    monkeypatch.setattr(labelord.journal, 'process_alive', slow_process_alive)
+    path = str(tmpdir.join('journal.sqlite'))
+    journal = JobJournal(path)
+    ids = journal.add_jobs([('Wilson194/{}'.format(i), ('ADD', Label('bug', 'ff0000'), None)) for i in range(50)])
+
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    with journal.connection:
+        journal.connection.execute('UPDATE jobs SET owner = ?', (dead.pid,))
+
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(4)
+    results = context.Queue()
+    processes = [context.Process(target=claim_in_process, args=(path, barrier, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+
+    claimed = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert sorted(sum(claimed, [])) == ids
@@ -233,3 +233,203 @@ def test_print_log_print_all_necesarry_informations(label_updater_client, capsys
     assert label.color in out
     assert label.name in out
     assert 'Label not found' in out
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_update_labels_with_more_jobs_count_all_repos(capsys, jobs):
+    import flexmock
+    from labelord.github import Label, LabelUpdater
+
+    oldLabels = [{'name': 'bug', 'color': 'ee0701'}, {'name': 'old', 'color': '000000'}]
+    response = flexmock.flexmock(status_code=200, ok=True, headers={}, json=lambda: oldLabels)
+    session = flexmock.flexmock(get=lambda url: response)
+
+    label_updater_client = LabelUpdater(session, None, {'jobs': jobs, 'dryRun': True, 'verbose': True,
+                                                        'mode': 'replace'})
+    repos = ['Wilson194/repo{}'.format(i) for i in range(20)]
+
+    label_updater_client.update_labels([Label('bug', 'ee0701'), Label('new', 'FFFFFF')], repos)
+
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+
+    assert label_updater_client.reposNum == 20
+    assert label_updater_client.errorNum == 0
+    assert len([line for line in lines if line.startswith('[ADD][DRY]')]) == 20
+    assert len([line for line in lines if line.startswith('[DEL][DRY]')]) == 20
+    assert lines[-1] == '[SUMMARY] 20 repo(s) updated successfully'
+
+
+def test_plan_labels_and_apply_plan_without_loading_labels(capsys):
+    import io
+    import flexmock
+    from labelord.github import Label, LabelUpdater, load_plan
+
+    oldLabels = [{'name': 'BUG', 'color': 'ee0701'}, {'name': 'old', 'color': '000000'}]
+    response = flexmock.flexmock(status_code=200, ok=True, headers={}, json=lambda: oldLabels)
+    session = flexmock.flexmock(get=lambda url: response)
+
+    planner = LabelUpdater(session, None, {'mode': 'replace', 'dryRun': True, 'jobs': 2})
+    planFile = io.StringIO()
+    planner.plan_labels([Label('bug', 'ee0701'), Label('new', 'FFFFFF')], ['Wilson194/a', 'Wilson194/b'], planFile)
+
+    plans = list(load_plan(io.StringIO(planFile.getvalue())))
+
+    assert [plan['repo'] for plan in plans] == ['Wilson194/a', 'Wilson194/b']
+    assert plans[0]['operations'] == [{'op': 'UPD', 'name': 'bug', 'color': 'ee0701', 'oldName': 'BUG',
+                                       'oldColor': 'ee0701'},
+                                      {'op': 'ADD', 'name': 'new', 'color': 'FFFFFF'},
+                                      {'op': 'DEL', 'name': 'old', 'color': '000000'}]
+
+    calls = []
+    applySession = flexmock.flexmock(
+        post=lambda url, json: calls.append(('POST', url)) or flexmock.flexmock(status_code=201),
+        patch=lambda url, json: calls.append(('PATCH', url)) or flexmock.flexmock(status_code=200),
+        delete=lambda url: calls.append(('DELETE', url)) or flexmock.flexmock(status_code=204))
+
+    applier = LabelUpdater(applySession, None, {'verbose': True})
+    applier.apply_plan(plans)
+
+    out, err = capsys.readouterr()
+
+    assert applier.reposNum == 2
+    assert ('PATCH', 'https://api.github.com/repos/Wilson194/a/labels/BUG') in calls
+    assert ('DELETE', 'https://api.github.com/repos/Wilson194/b/labels/old') in calls
+    assert len(calls) == 6
+    assert '[SUMMARY] 2 repo(s) updated successfully' in out
+
+
+def test_list_of_repos_load_pages_from_link_header():
+    import flexmock
+    from labelord.github import get_list_repos
+
+    url = 'https://api.github.com/user/repos?per_page=100&page={}'
+    link = '<{}>; rel="next", <{}>; rel="last"'.format(url.format(2), url.format(4))
+    requested = []
+
+    def get(requestUrl):
+        requested.append(requestUrl)
+        page = int(requestUrl.rsplit('=', 1)[1])
+        repos = [{'full_name': 'Wilson194/repo{}-{}'.format(page, i)} for i in range(100 if page < 4 else 3)]
+        return flexmock.flexmock(status_code=200, ok=True, headers={'Link': link}, json=lambda: repos,
+                                 links={'last': {'url': url.format(4)}})
+
+    repos = get_list_repos(flexmock.flexmock(get=get))
+
+    assert len(repos) == 303
+    assert repos[0] == 'Wilson194/repo1-0'
+    assert repos[-1] == 'Wilson194/repo4-2'
+    assert sorted(requested) == [url.format(page) for page in range(1, 5)]
+
+
+def test_pages_of_all_workers_are_loaded_by_shared_pool():
+    import concurrent.futures
+    import threading
+    import time
+    import flexmock
+    from labelord import github
+
+    lock = threading.Lock()
+    inFlight = [0, 0]
+
+    def get(requestUrl):
+        page = int(requestUrl.rsplit('=', 1)[1])
+        if page > 1:
+            with lock:
+                inFlight[0] += 1
+                inFlight[1] = max(inFlight)
+            time.sleep(0.01)
+            with lock:
+                inFlight[0] -= 1
+        last = requestUrl.rsplit('=', 1)[0] + '=5'
+        return flexmock.flexmock(status_code=200, ok=True, headers={'Link': '<{}>; rel="last"'.format(last)},
+                                 json=lambda: [{'name': 'label', 'color': 'ffffff'}] * 100,
+                                 links={'last': {'url': last}})
+
+    session = flexmock.flexmock(get=get)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda repo: github.get_list_labels(session, 'Wilson194/repo{}'.format(repo)),
+                                    range(8)))
+
+    assert all(len(labels) == 500 for labels in results)
+    assert inFlight[1] <= github.PAGE_JOBS
+
+
+def test_full_page_without_link_header_is_the_only_page():
+    import flexmock
+    from labelord.github import get_list_repos
+
+    requested = []
+
+    def get(requestUrl):
+        requested.append(requestUrl)
+        repos = [{'full_name': 'Wilson194/repo{}'.format(i)} for i in range(100)]
+        return flexmock.flexmock(status_code=200, ok=True, headers={}, json=lambda: repos)
+
+    assert len(get_list_repos(flexmock.flexmock(get=get))) == 100
+    assert requested == ['https://api.github.com/user/repos?per_page=100&page=1']
+
+
+def test_labels_of_repositories_are_loaded_by_graphql_batches():
+    import flexmock
+    from labelord.github import Label, LabelUpdater
+
+    repoLabels = {'Wilson194/big': [{'name': 'label{}'.format(i), 'color': 'ffffff'} for i in range(150)],
+                  'Wilson194/small': [{'name': 'bug', 'color': 'ee0701'}]}
+    queries = []
+
+    def post(url, json):
+        assert url == 'https://api.github.com/graphql'
+        queries.append(json)
+        variables = json['variables']
+        data = {}
+        position = 0
+        while 'o{}'.format(position) in variables:
+            repository = '{}/{}'.format(variables['o{}'.format(position)], variables['n{}'.format(position)])
+            if repository in repoLabels:
+                start = int(variables['c{}'.format(position)] or 0)
+                nodes = repoLabels[repository][start:start + 100]
+                hasNext = start + 100 < len(repoLabels[repository])
+                data['r{}'.format(position)] = {'labels': {'nodes': nodes, 'pageInfo': {
+                    'hasNextPage': hasNext, 'endCursor': str(start + 100)}}}
+            else:
+                data['r{}'.format(position)] = None
+            position += 1
+        return flexmock.flexmock(status_code=200, ok=True, json=lambda: {'data': data})
+
+    session = flexmock.flexmock(post=post)
+    label_updater_client = LabelUpdater(session, None, {'graphql': True, 'dryRun': True, 'mode': 'update'})
+
+    with pytest.raises(SystemExit) as wrap:
+        label_updater_client.update_labels([Label('bug', 'ee0701')],
+                                           ['Wilson194/big', 'Wilson194/small', 'Wilson194/missing'])
+
+    assert wrap.value.code == 10
+
+    assert len(queries) == 2
+    assert 'r2: repository' in queries[0]['query']
+    assert queries[1]['variables'] == {'o0': 'Wilson194', 'n0': 'big', 'c0': '100'}
+    assert label_updater_client.reposNum == 2
+    assert label_updater_client.errorNum == 1
+
+
+def test_labels_of_batch_are_loaded_by_rest_if_graphql_query_fails(capsys):
+    import flexmock
+    import labelord.github
+    from labelord.github import Label, LabelUpdater
+
+    def post(url, json):
+        return flexmock.flexmock(status_code=200, ok=True, json=lambda: {
+            'data': None, 'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]})
+
+    session = flexmock.flexmock(post=post)
+    label_updater_client = LabelUpdater(session, None, {'graphql': True, 'dryRun': True, 'mode': 'update'})
+    flexmock.flexmock(labelord.github).should_receive('get_list_labels') \
+        .with_args(session, 'Wilson194/small', False, None).and_return([Label('bug', 'ee0701')]).once()
+
+    label_updater_client.update_labels([Label('bug', 'ee0701')], ['Wilson194/small'])
+
+    assert label_updater_client.reposNum == 1
+    assert label_updater_client.errorNum == 0
+    assert 'GraphQL query failed (API rate limit exceeded)' in capsys.readouterr().err
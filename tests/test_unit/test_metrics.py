@@ -0,0 +1,54 @@
+import flask
+from labelord import github, metrics
+from labelord.server import server
+from test_cache import FakeAdapter
+
+
+def test_registry_expose_counters_and_histograms_in_prometheus_format():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter('requests_total', 'Requests', ('method', 'status')))
+    histogram = registry.register(metrics.Histogram('latency_seconds', 'Latency', buckets=(0.1, 1)))
+
+    counter.inc(('GET', '200'))
+    counter.inc(('GET', '200'))
+    counter.inc(('POST', '4"2'))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.expose().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{method="GET",status="200"} 2',
+        'requests_total{method="POST",status="4\\"2"} 1',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_github_requests_are_counted_by_method_and_status():
+    session = github.GitHubSession()
+    session.mount('https://', FakeAdapter([]))
+    before = metrics.GITHUB_REQUESTS.get(('GET', '200'))
+
+    github.get_list_repos(session)
+
+    assert metrics.GITHUB_REQUESTS.get(('GET', '200')) == before + 1
+
+
+def test_metrics_page_is_served_by_server():
+    app = flask.Flask(__name__)
+    app.register_blueprint(server)
+    metrics.ECHO_SUPPRESSED.inc()
+
+    response = app.test_client().get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'labelord_echo_suppressed_total ' in response.get_data(as_text=True)
+    assert '# TYPE labelord_github_request_seconds histogram' in response.get_data(as_text=True)
@@ -0,0 +1,58 @@
+import io
+import json
+import threading
+import pytest
+from click.testing import CliRunner
+from labelord import labelord
+from labelord.output import JsonLinesWriter
+from benchmarks.run_benchmarks import write_config
+
+
+pytestmark = pytest.mark.fake_github(repos=4, labels=10, drift=0.5)
+
+
+def test_writer_buffer_records_from_more_threads():
+    stream = io.StringIO()
+    writer = JsonLinesWriter(stream, bufferSize=1000)
+
+    def work(number):
+        for i in range(500):
+            writer.write({'thread': number, 'i': i})
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stream.getvalue()) < len(json.dumps({'thread': 0, 'i': 0})) * 4000
+    writer.flush()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(records) == 4000
+    assert sorted(record['i'] for record in records if record['thread'] == 3) == list(range(500))
+
+
+def test_run_and_list_commands_with_jsonl_output(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    runner = CliRunner()
+
+    result = runner.invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-j', '4', '-o', 'jsonl',
+                                          'replace'], obj={})
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+
+    assert result.exit_code == 0
+    assert {record['op'] for record in records[:-1]} == {'ADD', 'UPD', 'DEL'}
+    assert all(record['result'] == 'SUC' and record['latency'] > 0 for record in records[:-1])
+    assert set(records[0]) == {'op', 'result', 'repo', 'label', 'color', 'error', 'latency'}
+    assert records[-1] == {'op': 'SUMMARY', 'result': 'SUC', 'action': 'updated', 'repos': 4, 'errors': 0,
+                           'shard': None}
+
+    result = runner.invoke(labelord.cli, ['-c', configPath, '--no-cache', 'list-repos', '-o', 'jsonl'], obj={})
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [{'repo': repo} for repo in
+                                                                         fake_github.repositories]
+
+    result = runner.invoke(labelord.cli, ['-c', configPath, '--no-cache', 'list-labels', '-o', 'jsonl',
+                                          'bench/repo-0001'], obj={})
+    assert sorted((r['label'], r['color']) for r in map(json.loads, result.stdout.splitlines())) == \
+        fake_github.template
@@ -0,0 +1,44 @@
+import pstats
+import pytest
+from click.testing import CliRunner
+from labelord import labelord, profiling
+from benchmarks.run_benchmarks import write_config
+
+
+pytestmark = pytest.mark.fake_github(repos=5, labels=10, drift=0.5)
+
+
+@pytest.mark.parametrize('profileFormat', ['pstats', 'collapsed'])
+def test_run_with_profile_print_phases_and_write_profile(fake_github, tmpdir, profileFormat):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    profilePath = str(tmpdir.join('profile'))
+
+    result = CliRunner().invoke(labelord.cli, ['-c', configPath, '--no-cache', '--profile-output', profilePath,
+                                               '--profile-format', profileFormat, 'run', '-a', '-q', 'replace'],
+                                obj={})
+
+    assert result.exit_code == 0
+    for phase in ('list repos', 'target labels', 'diff', 'writes', 'total (wall)'):
+        assert phase in result.stderr
+
+    if profileFormat == 'pstats':
+        assert pstats.Stats(profilePath).total_calls > 0
+    else:
+        with open(profilePath) as f:
+            assert all(line.rsplit(' ', 1)[1].strip().isdigit() for line in f)
+
+    assert profiling._active is None
+
+
+def test_phase_is_not_recorded_without_profiler():
+    assert profiling.phase('diff') is profiling.NO_PHASE
+
+    profiler = profiling.Profiler()
+    profiler.start()
+    with profiling.phase('diff'):
+        pass
+    with profiling.phase('diff'):
+        pass
+    profiler.stop()
+
+    assert profiler.phases['diff'][0] == 2
@@ -0,0 +1,186 @@
+import json
+import threading
+import pytest
+import requests
+import flexmock
+from click.testing import CliRunner
+from labelord import github, labelord, metrics
+from labelord.ratelimit import ConcurrencyLimiter, RateLimiter
+from benchmarks.run_benchmarks import write_config
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+
+    def time(self):
+        return self.now
+
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def create_limiter(**kwargs):
+    clock = FakeClock()
+    return RateLimiter(clock=clock.time, sleep=clock.sleep, **kwargs), clock
+
+
+def fake_response(status, headers=None, body=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = json.dumps(body or {}).encode()
+    return response
+
+
+def test_token_bucket_pace_requests_to_max_rate():
+    limiter, clock = create_limiter(maxRate=10, burst=2)
+
+    for _ in range(4):
+        limiter.wait()
+
+    assert sum(clock.sleeps) == pytest.approx(0.2)
+
+
+def test_exhausted_budget_pause_until_reset():
+    limiter, clock = create_limiter()
+
+    limiter.update(fake_response(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1500'}))
+    limiter.wait()
+
+    assert clock.now == 1501
+
+
+def test_low_budget_is_spread_to_reset_time():
+    limiter, clock = create_limiter()
+
+    limiter.update(fake_response(200, {'X-RateLimit-Remaining': '4000', 'X-RateLimit-Reset': '2000'}))
+    assert limiter.rate() is None
+
+    limiter.update(fake_response(200, {'X-RateLimit-Remaining': '100', 'X-RateLimit-Reset': '2000'}))
+    assert limiter.rate() == 0.1
+
+
+def test_retry_delay_of_secondary_limit():
+    limiter, clock = create_limiter()
+
+    assert limiter.retry_delay(fake_response(403, {'Retry-After': '30'}), 0) == 30
+    assert limiter.retry_delay(fake_response(403, body={'message': 'You have exceeded a secondary rate limit'}),
+                               1) == 120
+    assert limiter.retry_delay(fake_response(403, body={'message': 'Forbidden'}), 0) is None
+    assert limiter.retry_delay(fake_response(404), 0) is None
+
+
+def test_session_retry_rate_limited_request():
+    limiter, clock = create_limiter()
+    responses = [fake_response(403, {'Retry-After': '5'}), fake_response(201)]
+
+    session = github.GitHubSession(rateLimiter=limiter)
+    flexmock.flexmock(requests.Session).should_receive('request').and_return(responses[0]) \
+        .and_return(responses[1]).times(2)
+
+    assert session.post('https://api.github.com/repos/a/b/labels').status_code == 201
+    assert clock.sleeps == [5]
+
+
+def test_concurrency_limit_grows_by_one_per_round_of_healthy_responses():
+    changes = []
+    limiter = ConcurrencyLimiter(4, 2, listener=lambda limit, reason: changes.append((limit, reason)))
+
+    for _ in range(6):
+        limiter.release(limiter.acquire(), 0.1, fake_response(200))
+
+    assert changes == [(3, 'Healthy'), (4, 'Healthy')]
+    assert limiter.limit == 4
+    assert metrics.CONCURRENCY_LIMIT.samples() == [('labelord_concurrency_limit', {}, 4)]
+
+
+def test_slow_response_keeps_concurrency_limit():
+    limiter = ConcurrencyLimiter(8, 2)
+
+    limiter.release(limiter.acquire(), 0.1, fake_response(200))
+    limit = limiter.limit
+    limiter.release(limiter.acquire(), 0.5, fake_response(200))
+
+    assert limiter.limit == limit
+
+
+def test_concurrency_limit_is_cut_once_for_requests_in_flight():
+    changes = []
+    limiter = ConcurrencyLimiter(8, listener=lambda limit, reason: changes.append((limit, reason)))
+    epochs = [limiter.acquire() for _ in range(4)]
+
+    limiter.release(epochs[0], 0.1, fake_response(403, body={'message': 'You have exceeded a secondary rate limit'}))
+    limiter.release(epochs[1], 0.1, fake_response(502))
+    limiter.release(epochs[2], 0.1, None)
+    assert changes == [(4, 'Throttled (403)')]
+
+    limiter.release(limiter.acquire(), 0.1, fake_response(503))
+    assert changes == [(4, 'Throttled (403)'), (2, 'Server error (503)')]
+
+    limiter.release(epochs[3], 0.1, fake_response(404))
+    assert limiter.inFlight == 0 and int(limiter.limit) == 2
+
+
+def test_requests_over_concurrency_limit_wait():
+    limiter = ConcurrencyLimiter(1)
+    epoch = limiter.acquire()
+    acquired = threading.Event()
+
+    thread = threading.Thread(target=lambda: acquired.set() if limiter.acquire() is not None else None)
+    thread.start()
+    assert not acquired.wait(0.05)
+
+    limiter.release(epoch, 0.1, fake_response(200))
+    thread.join(1)
+    assert acquired.is_set()
+
+
+@pytest.mark.fake_github(repos=30, labels=5, drift=0.5)
+def test_adaptive_run_logs_concurrency_limit(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    result = CliRunner().invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-v', '-j', '8',
+                                               '--adaptive', 'replace'], obj={})
+
+    assert result.exit_code == 0
+    assert '[LIMIT] 5; Healthy' in result.stdout
+    assert all(sorted(labels.items()) == fake_github.template for labels in fake_github.repositories.values())
+
+
+def test_redirect_with_concurrency_limit_one_does_not_deadlock():
+    import http.server
+
+    class RedirectHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/old':
+                self.send_response(301)
+                self.send_header('Location', '/new')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'[]')
+
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RedirectHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = github.GitHubSession(concurrency=ConcurrencyLimiter(1))
+    responses = []
+
+    thread = threading.Thread(target=lambda: responses.append(
+        session.get('http://127.0.0.1:{}/old'.format(server.server_address[1]))), daemon=True)
+    thread.start()
+    thread.join(5)
+    server.shutdown()
+
+    assert [response.status_code for response in responses] == [200]
+    assert session.concurrency.inFlight == 0
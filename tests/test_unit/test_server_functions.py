@@ -9,6 +9,9 @@ ABS_PATH = os.path.abspath(os.path.dirname(__file__))
 CONFIGS_PATH = os.path.join(ABS_PATH, 'fixtures', 'configs')
 
 
+pytestmark = pytest.mark.fake_github(repos=5, labels=3, drift=0)
+
+
 @pytest.mark.parametrize('repo', ('JohnyDep/Pirates', 'BradPit/Mr&MsBlack', 'RobertDawneyJr/Iron-Man'))
 def test_server_github_link_filter(repo):
     assert 'https://github.com/{}'.format(repo) in labelord.server.convert_git_repo(repo)
@@ -32,28 +35,34 @@ def test_check_signature_create_correct_sha1_hash():
 def test_allowed_repos_return_allowed_repos(labelord_session, monkeypatch, utils, repo, result):
     from labelord.server import check_allowed_repo
 
+    from labelord.server import create_snapshot
     app = flexmock.flexmock(session=labelord_session,
-                            labelordConfig=utils.load_config(os.path.join(CONFIGS_PATH, 'target_repos.cfg')))
+                            configSnapshot=create_snapshot(utils.load_config(os.path.join(CONFIGS_PATH,
+                                                                                          'target_repos.cfg'))))
 
     monkeypatch.setattr(flask, 'current_app', app)
 
     assert check_allowed_repo(repo) == result
 
 
+def create_server_app(session, config):
+    app = labelord.server.LabelordWeb(__name__)
+    app.inject_session(session)
+    app.set_labelord_config(config)
+    return app
+
+
 def test_edit_label_request_edit_target_repository(labelord_session, monkeypatch, utils):
     from labelord.server import edit_label_request
     from labelord.github import get_list_labels
-    app = flexmock.flexmock(session=labelord_session,
-                            labelordConfig=utils.load_config(os.path.join(CONFIGS_PATH, 'editable_repos.cfg')),
-                            updatedRepos=[])
-
-    monkeypatch.setattr(flask, 'current_app', app)
+    app = create_server_app(labelord_session, utils.load_config(os.path.join(CONFIGS_PATH, 'editable_repos.cfg')))
 
     with open(os.path.join(ABS_PATH, 'fixtures', 'json', 'edit_label.json'), 'r') as f:
         js_text = f.read()
     js = json.loads(js_text)
 
-    edit_label_request(js)
+    with app.app_context():
+        edit_label_request(js)
 
     labels = get_list_labels(labelord_session, 'Wilson194/testin_repo', False)
 
@@ -63,25 +72,348 @@ def test_edit_label_request_edit_target_repository(labelord_session, monkeypatch
 def test_create_label_and_delete_label_based_on_json(labelord_session, monkeypatch, utils):
     from labelord.server import create_label_request, delete_label_request
     from labelord.github import get_list_labels
-    app = flexmock.flexmock(session=labelord_session,
-                            labelordConfig=utils.load_config(os.path.join(CONFIGS_PATH, 'editable_repos.cfg')),
-                            updatedRepos=[])
-
-    monkeypatch.setattr(flask, 'current_app', app)
+    app = create_server_app(labelord_session, utils.load_config(os.path.join(CONFIGS_PATH, 'editable_repos.cfg')))
 
     with open(os.path.join(ABS_PATH, 'fixtures', 'json', 'create_and_delete_label.json'), 'r') as f:
         js_text = f.read()
 
     js = json.loads(js_text)
 
-    create_label_request(js)
+    with app.app_context():
+        create_label_request(js)
 
     labels = get_list_labels(labelord_session, 'Wilson194/testin_repo', False)
 
     assert utils.find_label(labels, 'porn', 'FF0000')
 
-    delete_label_request(js)
+    with app.app_context():
+        delete_label_request(js)
 
     labels = get_list_labels(labelord_session, 'Wilson194/testin_repo', False)
 
     assert utils.find_label(labels, 'porn', 'FF0000') == 0
+
+
+def post_label_event(client, js, secret='MyReallyPrivatePassword'):
+    import hashlib
+    import hmac
+    body = json.dumps(js).encode()
+    signature = 'sha1=' + hmac.new(secret.encode(), body, hashlib.sha1).hexdigest()
+    return client.post('/', data=body, content_type='application/json',
+                       headers={'X-GitHub-Event': 'label', 'X-Hub-Signature': signature})
+
+
+def test_label_event_is_queued_and_answered_with_202_or_503(monkeypatch):
+    from labelord.labelord import create_app
+    monkeypatch.setenv('LABELORD_CONFIG', os.path.join(CONFIGS_PATH, 'server.cfg'))
+
+    app = create_app()
+    jobs = []
+    monkeypatch.setattr(app.get_job_queue(), 'put', lambda handler, js: not jobs and not jobs.append((handler, js)))
+    client = app.test_client()
+
+    js = {'action': 'created', 'label': {'name': 'bug', 'color': 'ff0000'},
+          'repository': {'full_name': 'Wilson194/labelord'}}
+
+    assert post_label_event(client, js).status_code == 202
+    assert jobs == [(labelord.server.create_label_request, js)]
+
+    assert post_label_event(client, js).status_code == 503
+
+    assert post_label_event(client, js, 'BadSecret').status_code == 401
+
+
+def test_webhook_queue_process_jobs_in_app_context_and_refuse_when_full():
+    import threading
+    import time
+    from labelord.server import WebhookQueue
+
+    app = flask.Flask(__name__)
+    release = threading.Event()
+    processed = []
+
+    def handler(js):
+        release.wait(5)
+        processed.append((flask.current_app.name, js))
+
+    jobQueue = WebhookQueue(app, size=1, workersNum=1)
+    jobQueue.start()
+
+    assert jobQueue.put(handler, 1)
+    while jobQueue.queue.qsize():
+        time.sleep(0.01)
+    assert jobQueue.put(handler, 2)
+    assert not jobQueue.put(handler, 3)
+
+    release.set()
+    jobQueue.join()
+
+    assert processed == [(app.name, 1), (app.name, 2)]
+
+
+def test_webhook_queue_worker_survive_quit_in_job(capsys):
+    from labelord.server import WebhookQueue
+
+    app = flask.Flask(__name__)
+    processed = []
+
+    def failing(js):
+        quit(3)
+
+    jobQueue = WebhookQueue(app, size=2, workersNum=1)
+    jobQueue.start()
+
+    assert jobQueue.put(failing, 1)
+    assert jobQueue.put(lambda js: processed.append(js), 2)
+
+    assert jobQueue.join(5)
+    assert processed == [2]
+    assert 'SystemExit' in capsys.readouterr().err
+
+
+def test_config_is_reloaded_when_config_file_changes(tmpdir, monkeypatch):
+    import shutil
+    from labelord.labelord import create_app
+    configPath = str(tmpdir.join('config.cfg'))
+    shutil.copy(os.path.join(CONFIGS_PATH, 'server.cfg'), configPath)
+    monkeypatch.setenv('LABELORD_CONFIG', configPath)
+    monkeypatch.setattr(labelord.server, 'CONFIG_CHECK_INTERVAL', 0)
+
+    app = create_app()
+    snapshot = app.configSnapshot
+
+    assert snapshot.allowedRepos == {'Wilson194/labelord', 'Wilson194/hello_world'}
+
+    app.refresh_config()
+    assert app.configSnapshot is snapshot
+
+    with open(configPath) as f:
+        text = f.read()
+    with open(configPath, 'w') as f:
+        f.write(text.replace('Wilson194/hello_world = yes', 'Wilson194/hello_world = yes\nWilson194/ella = yes'))
+    os.utime(configPath, (snapshot.mtime + 10, snapshot.mtime + 10))
+
+    app.refresh_config()
+
+    assert 'Wilson194/ella' in app.configSnapshot.allowedRepos
+    assert app.configSnapshot.repos[-1] == 'Wilson194/ella'
+
+
+def test_reload_config_keep_startup_token(tmpdir):
+    import shutil
+    import requests
+    configPath = str(tmpdir.join('config.cfg'))
+    shutil.copy(os.path.join(CONFIGS_PATH, 'server.cfg'), configPath)
+
+    app = labelord.server.LabelordWeb(__name__)
+    app.inject_session(requests.Session())
+    app.inject_token('startup-token')
+    app.reload_config(configPath)
+    auth = app.session.auth
+
+    assert auth.token == 'startup-token'
+
+    app.reload_config(configPath)
+
+    assert app.session.auth is auth
+
+
+def test_echo_index_suppress_only_expected_echoes():
+    from labelord.server import EchoIndex
+    now = [0]
+    index = EchoIndex(ttl=10, maxSize=2, clock=lambda: now[0])
+
+    index.expect('Wilson194/a', 'edited', 'bug', 'FF0000')
+    index.expect('Wilson194/a', 'deleted', 'old', '000000')
+
+    assert not index.consume('Wilson194/a', 'edited', 'bug', '00ff00')
+    assert index.consume('Wilson194/a', 'edited', 'bug', 'ff0000')
+    assert not index.consume('Wilson194/a', 'edited', 'bug', 'ff0000')
+    assert index.consume('Wilson194/a', 'deleted', 'old', 'ffffff')
+
+    index.expect('Wilson194/b', 'created', 'bug', 'ff0000')
+    now[0] = 11
+    assert not index.consume('Wilson194/b', 'created', 'bug', 'ff0000')
+
+    for repo in ('c', 'd', 'e'):
+        index.expect('Wilson194/' + repo, 'created', 'bug', 'ff0000')
+
+    assert len(index) == 2
+    assert not index.consume('Wilson194/c', 'created', 'bug', 'ff0000')
+
+
+def label_event(action, name, color, changes=None):
+    js = {'action': action, 'repository': {'full_name': 'Wilson194/labelord'},
+          'label': {'name': name, 'color': color}}
+    if changes is not None:
+        js['changes'] = changes
+    return js
+
+
+def test_coalescer_collapse_events_of_one_label_to_net_change():
+    from labelord.server import EventCoalescer
+    dispatched = []
+    coalescer = EventCoalescer(60, lambda js: dispatched.append(js) or True)
+
+    coalescer.submit(label_event('created', 'bug', 'ff0000'))
+    coalescer.submit(label_event('edited', 'Bug', 'ff0000', {'name': {'from': 'bug'}}))
+    coalescer.submit(label_event('edited', 'Bug', '00ff00', {'color': {'from': 'ff0000'}}))
+
+    coalescer.submit(label_event('edited', 'wontfix', '111111', {'color': {'from': '000000'}}))
+    coalescer.submit(label_event('edited', 'wontfix', '000000', {'color': {'from': '111111'}}))
+
+    coalescer.submit(label_event('edited', 'new', 'ffffff', {'name': {'from': 'old'}}))
+    coalescer.submit(label_event('deleted', 'new', 'ffffff'))
+
+    coalescer.submit(label_event('created', 'tmp', 'ffffff'))
+    coalescer.submit(label_event('deleted', 'tmp', 'ffffff'))
+
+    coalescer.flush_all()
+
+    assert sorted(dispatched, key=lambda js: js['action']) == [
+        label_event('created', 'Bug', '00ff00'),
+        label_event('deleted', 'old', 'ffffff')]
+
+
+def test_coalescer_dispatch_pending_change_displaced_by_rename():
+    from labelord.server import EventCoalescer
+    dispatched = []
+    coalescer = EventCoalescer(60, lambda js: dispatched.append(js) or True)
+
+    coalescer.submit(label_event('deleted', 'X', 'ff0000'))
+    coalescer.submit(label_event('edited', 'X', '00ff00', {'name': {'from': 'Y'}}))
+
+    assert dispatched == [label_event('deleted', 'X', 'ff0000')]
+
+    coalescer.flush_all()
+
+    assert dispatched == [label_event('deleted', 'X', 'ff0000'),
+                          label_event('edited', 'X', '00ff00', {'name': {'from': 'Y'}})]
+
+def test_coalescer_without_window_dispatch_immediately():
+    from labelord.server import EventCoalescer
+    dispatched = []
+    coalescer = EventCoalescer(0, lambda js: dispatched.append(js) or True)
+
+    js = label_event('deleted', 'bug', 'ff0000')
+
+    assert coalescer.submit(js)
+    assert dispatched == [js]
+
+
+def test_debounced_events_are_dispatched_and_processed_at_shutdown(monkeypatch):
+    import configparser
+    from labelord.server import LabelordWeb
+    config = configparser.ConfigParser()
+    config.read_dict({'github': {'token': 'token', 'webhook_secret': 'secret'}, 'server': {'debounce': '60'}})
+    processed = []
+    monkeypatch.setattr(labelord.server, 'create_label_request', processed.append)
+    monkeypatch.setattr(labelord.server.atexit, 'register', lambda function: None)
+
+    app = LabelordWeb(__name__)
+    app.set_labelord_config(config)
+
+    js = {'action': 'created', 'label': {'name': 'bug', 'color': 'ff0000'},
+          'repository': {'full_name': 'Wilson194/labelord'}}
+    assert app.get_coalescer().submit(js)
+    assert processed == []
+
+    app.shutdown()
+
+    assert processed == [js]
+
+def test_shared_echo_index_is_shared_by_processes(tmpdir):
+    from labelord.server import SharedEchoIndex
+    path = str(tmpdir.join('state.sqlite'))
+    now = [0]
+    first = SharedEchoIndex(path, ttl=10, maxSize=2, clock=lambda: now[0])
+    second = SharedEchoIndex(path, ttl=10, maxSize=2, clock=lambda: now[0])
+
+    first.expect('Wilson194/a', 'edited', 'bug', 'FF0000')
+    first.expect('Wilson194/a', 'deleted', 'old', '000000')
+
+    assert second.consume('Wilson194/a', 'edited', 'bug', 'ff0000')
+    assert not first.consume('Wilson194/a', 'edited', 'bug', 'ff0000')
+    assert first.consume('Wilson194/a', 'deleted', 'old', 'ffffff')
+
+    second.expect('Wilson194/b', 'created', 'bug', 'ff0000')
+    now[0] = 11
+    assert not first.consume('Wilson194/b', 'created', 'bug', 'ff0000')
+
+    for repo in ('c', 'd', 'e'):
+        first.expect('Wilson194/' + repo, 'created', 'bug', 'ff0000')
+
+    assert len(second) == 2
+    assert not second.consume('Wilson194/c', 'created', 'bug', 'ff0000')
+
+
+
+@pytest.mark.parametrize(['old', 'new'], [('[github]', 'Wilson194/ella = yes\n[github]'),
+                                          ('Wilson194/hello_world = yes', 'Wilson194/hello_world = maybe')])
+def test_invalid_config_file_keeps_old_config_and_is_not_reloaded_again(tmpdir, monkeypatch, capsys, old, new):
+    import shutil
+    from labelord.labelord import create_app
+    configPath = str(tmpdir.join('config.cfg'))
+    shutil.copy(os.path.join(CONFIGS_PATH, 'server.cfg'), configPath)
+    monkeypatch.setenv('LABELORD_CONFIG', configPath)
+    monkeypatch.setattr(labelord.server, 'CONFIG_CHECK_INTERVAL', 0)
+
+    app = create_app()
+    snapshot = app.configSnapshot
+
+    with open(configPath) as f:
+        text = f.read()
+    with open(configPath, 'w') as f:
+        f.write(text.replace(old, new))
+    os.utime(configPath, (snapshot.mtime + 10, snapshot.mtime + 10))
+
+    app.refresh_config()
+    app.refresh_config()
+
+    assert app.configSnapshot is snapshot
+    assert capsys.readouterr().err.count('is not valid') == 1
+
+
+def create_fake_config(fake_github, **server):
+    import configparser
+    config = configparser.ConfigParser()
+    config.read_dict({'github': {'token': 'fake', 'webhook_secret': 'MyReallyPrivatePassword'},
+                      'repos': {repo: 'yes' for repo in fake_github.repositories},
+                      'server': server})
+    return config
+
+
+def test_fan_out_with_more_jobs_update_all_target_repositories(fake_github):
+    from labelord.github import create_session
+    from labelord.server import create_label_request
+    repos = list(fake_github.repositories)
+    app = create_server_app(create_session('fake'), create_fake_config(fake_github, jobs='4'))
+
+    js = {'action': 'created', 'label': {'name': 'new', 'color': 'ff0000'}, 'repository': {'full_name': repos[0]}}
+
+    with app.app_context():
+        create_label_request(js)
+
+    assert 'new' not in fake_github.repositories[repos[0]]
+    assert all(fake_github.repositories[repo]['new'] == 'ff0000' for repo in repos[1:])
+    assert all(app.echoIndex.consume(repo, 'created', 'new', 'ff0000') for repo in repos[1:])
+
+
+
+def test_shutdown_wait_for_job_queue_at_most_timeout(capsys):
+    import configparser
+    import threading
+    from labelord.server import LabelordWeb
+    config = configparser.ConfigParser()
+    config.read_dict({'github': {'token': 'token', 'webhook_secret': 'secret'},
+                      'server': {'shutdown_timeout': '0.1'}})
+    release = threading.Event()
+
+    app = LabelordWeb(__name__)
+    app.set_labelord_config(config)
+    app.get_job_queue().put(lambda js: release.wait(5), {})
+
+    app.shutdown()
+    release.set()
+
+    assert '1 job(s) are not finished' in capsys.readouterr().err
@@ -0,0 +1,74 @@
+import json
+import pytest
+from click.testing import CliRunner
+from labelord import github, labelord
+from benchmarks.run_benchmarks import write_config
+
+
+pytestmark = pytest.mark.fake_github(repos=20, labels=5, drift=0.5)
+
+
+REPOSITORIES = ['org/repo-{}'.format(i) for i in range(1000)]
+
+
+def test_shards_are_disjoint_and_cover_all_repositories():
+    shards = [github.shard_repositories(REPOSITORIES, index, 4) for index in range(1, 5)]
+
+    assert sorted(sum(shards, [])) == sorted(REPOSITORIES)
+    assert all(200 < len(shard) < 300 for shard in shards)
+    assert github.shard_repositories(REPOSITORIES[::-1], 2, 4) == shards[1][::-1]
+
+
+def test_new_shard_takes_repositories_only_from_old_shards():
+    moved = [repo for repo in REPOSITORIES if github.shard_of(repo, 4) != github.shard_of(repo, 5)]
+
+    assert all(github.shard_of(repo, 5) == 5 for repo in moved)
+    assert 150 < len(moved) < 250
+
+
+def test_sharded_runs_update_all_repositories_and_summaries_are_merged(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    runner = CliRunner()
+    outputs = []
+
+    for index in (1, 2, 3):
+        result = runner.invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-o', 'jsonl',
+                                              '--shard', '{}/3'.format(index), 'replace'], obj={})
+        assert result.exit_code == 0
+        outputs.append(str(tmpdir.join('shard{}.jsonl'.format(index))))
+        with open(outputs[-1], 'w') as f:
+            f.write(result.stdout)
+
+    assert all(sorted(labels.items()) == fake_github.template for labels in fake_github.repositories.values())
+
+    result = runner.invoke(labelord.cli, ['merge-summaries'] + outputs, obj={})
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == {'op': 'SUMMARY', 'result': 'SUC', 'action': 'updated', 'repos': 20,
+                                         'errors': 0, 'shards': ['1/3', '2/3', '3/3'], 'missingShards': [],
+                                         'duplicateShards': []}
+
+    result = runner.invoke(labelord.cli, ['merge-summaries'] + outputs[:2], obj={})
+    assert result.exit_code == 10
+    assert json.loads(result.stdout)['missingShards'] == ['3/3']
+
+
+def test_merge_summaries_use_last_summary_of_repeated_shard():
+    from labelord.output import merge_summaries
+    summaries = [{'op': 'SUMMARY', 'action': 'updated', 'repos': 5, 'errors': 2, 'shard': '1/2'},
+                 {'op': 'SUMMARY', 'action': 'updated', 'repos': 6, 'errors': 0, 'shard': '2/2'},
+                 {'op': 'SUMMARY', 'action': 'updated', 'repos': 7, 'errors': 0, 'shard': '1/2'}]
+
+    summary = merge_summaries(summaries)
+
+    assert summary['repos'] == 13
+    assert summary['errors'] == 0
+    assert summary['result'] == 'SUC'
+    assert summary['shards'] == ['1/2', '2/2']
+    assert summary['duplicateShards'] == ['1/2']
+
+
+def test_invalid_shard_is_refused():
+    result = CliRunner().invoke(labelord.cli, ['run', '--shard', '4/3', 'update'], obj={})
+
+    assert result.exit_code == 2
+    assert 'between 1 and 3' in result.output
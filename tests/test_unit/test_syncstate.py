@@ -0,0 +1,89 @@
+import pytest
+from click.testing import CliRunner
+from labelord import github, labelord
+from labelord.github import Label
+from labelord.syncstate import SyncState, template_fingerprint
+from benchmarks.run_benchmarks import write_config
+
+
+pytestmark = pytest.mark.fake_github(repos=6, labels=10, drift=0.5)
+
+
+def test_template_fingerprint_ignore_order_and_color_case():
+    labels = [Label('bug', 'FF0000'), Label('feature', '00ff00')]
+
+    assert template_fingerprint(labels, 'update') == template_fingerprint(labels[::-1], 'update')
+    assert template_fingerprint(labels, 'update') == template_fingerprint([Label('bug', 'ff0000'), labels[1]],
+                                                                          'update')
+    assert template_fingerprint(labels, 'update') != template_fingerprint(labels, 'replace')
+    assert template_fingerprint(labels, 'update') != template_fingerprint(labels[:1], 'update')
+
+
+def test_incremental_run_skip_unchanged_repositories(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    statePath = str(tmpdir.join('state.sqlite'))
+
+    def run():
+        fake_github.calls.clear()
+        fake_github.notModified = 0
+        result = CliRunner().invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-q',
+                                                   '--incremental', '--state', statePath, 'replace'], obj={})
+        assert result.exit_code == 0
+
+    run()
+    assert fake_github.calls['POST'] > 0
+    assert len(SyncState(statePath).get('bench/repo-0000').pages) == 1
+
+    # Every repository is checked by one conditional request
+    run()
+    assert set(fake_github.calls) == {'GET'}
+    assert fake_github.notModified == 6
+
+    # Only changed repository is synchronized
+    fake_github.repositories['bench/repo-0003']['label-000'] = '123456'
+    run()
+    assert fake_github.calls['PATCH'] == 1
+    assert fake_github.notModified == 5
+    assert all(sorted(labels.items()) == fake_github.template for labels in fake_github.repositories.values())
+
+    # Changed template synchronize all repositories again
+    configPath = write_config(str(tmpdir), fake_github.template[1:])
+    run()
+    assert fake_github.calls['DELETE'] == 6
+
+
+def test_identical_repositories_share_one_plan(fake_github, monkeypatch):
+    import configparser
+    import flexmock
+
+    for labels in fake_github.repositories.values():
+        labels.clear()
+        labels.update(fake_github.template[1:])
+        labels['label-001'] = 'ABCDEF'
+    fake_github.repositories['bench/repo-0005'] = dict(fake_github.template)
+
+    config = configparser.ConfigParser()
+    config['labels'] = dict(fake_github.template)
+    labelUpdater = github.LabelUpdater(github.create_session('benchmark'), config,
+                                       {'allRepos': True, 'mode': 'replace', 'quiet': True, 'jobs': 3})
+    flexmock.flexmock(github).should_call('diff_labels').once()
+
+    labelUpdater.update_labels(labelUpdater.get_source_labels(None), labelUpdater.get_target_repositories())
+
+    assert fake_github.calls['POST'] == 5
+    assert fake_github.calls['PATCH'] == 5
+    assert all(sorted(labels.items()) == fake_github.template for labels in fake_github.repositories.values())
+
+
+def test_incremental_run_skip_repository_with_labels_of_template_after_mode_change(fake_github, tmpdir):
+    configPath = write_config(str(tmpdir), fake_github.template)
+    statePath = str(tmpdir.join('state.sqlite'))
+
+    for mode in ('replace', 'update'):
+        fake_github.calls.clear()
+        result = CliRunner().invoke(labelord.cli, ['-c', configPath, '--no-cache', 'run', '-a', '-q',
+                                                   '--incremental', '--state', statePath, mode], obj={})
+        assert result.exit_code == 0
+
+    assert set(fake_github.calls) == {'GET'}
+    assert fake_github.notModified == 6